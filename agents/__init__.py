@@ -1,25 +1,40 @@
-from .story_writer import develop_story
-from .character_extractor import extract_characters
-from .character_portraits_generator import generate_character_images
-from .scene_writer import write_script_based_on_story
-from .storyboard_writer import design_storyboard
-from .shot_writer import design_shot
-from .camera_manager import construct_camera_tree
-from .reference_image_selector import select_reference_images_and_generate_prompt
-from .video_generator import generate_single_video
-from .video_merger import merge_final_video
-from .state import VideoGenState
+"""The nodes of the idea2video graph.
 
-__all__ = [
-    "develop_story",
-    "extract_characters",
-    "generate_character_images",
-    "write_script_based_on_story",
-    "design_storyboard",
-    "design_shot",
-    "construct_camera_tree",
-    "select_reference_images_and_generate_prompt",
-    "generate_single_video",
-    "merge_final_video",
-    "VideoGenState",
-]
\ No newline at end of file
+Nodes are imported on first access, so ``import agents`` and tools that
+only need a few of its modules do not load the LLM, media and provider
+libraries behind the rest.
+"""
+import importlib
+
+_EXPORTS = {
+    "develop_story": ".story_writer",
+    "extract_characters": ".character_extractor",
+    "generate_character_images": ".character_portraits_generator",
+    "write_script_based_on_story": ".scene_writer",
+    "design_storyboard": ".storyboard_writer",
+    "design_shot": ".shot_writer",
+    "construct_camera_tree": ".camera_manager",
+    "select_reference_images_and_generate_prompt": ".reference_image_selector",
+    "generate_single_video": ".video_generator",
+    "merge_final_video": ".video_merger",
+    "fan_out_scenes": ".scene_pipeline",
+    "dispatch_scenes": ".scene_pipeline",
+    "process_scene": ".scene_pipeline",
+    "VideoGenState": ".state",
+    "SceneState": ".state",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,210 @@
+"""Content-addressed artifact cache.
+
+Every artifact written by a node is identified by a key: a hash of the model
+name, the prompt and parameters that produced it, and the digests of the
+upstream files it was derived from. The key is recorded next to the artifact
+in ``<artifact>.key``, so a node recomputes exactly when its inputs change
+instead of whenever the file is missing. Artifacts are also copied into a
+shared blob store addressed by key, which lets runs in different
+``cache_dir``s reuse identical work. The blob store is bounded by a byte
+budget and evicts least recently used blobs first; its size is tracked as
+blobs are stored, so only going over the budget walks the store.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from .tracing import count, instant
+
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "videoagent", "artifacts"))
+# Byte budget of the shared blob store; 0 disables sharing but keeps key-based invalidation.
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+KEY_SUFFIX = ".key"
+# Eviction frees the store down to this share of its budget, so that a full store is not walked on every store.
+EVICT_TO = 0.9
+
+
+def artifact_key(*parts, **params) -> str:
+    """Hash the inputs that determine an artifact into a cache key."""
+    payload = json.dumps([parts, params], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path) -> str:
+    """sha256 of a file's content, memoized by path, size and mtime."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_cache.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _digest_lock:
+            _digest_cache[memo_key] = digest
+    return digest
+
+
+def _atomic_copy(src, dst):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst) or ".", prefix=".tmp_")
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ArtifactCache:
+    def __init__(self, root=ARTIFACT_CACHE_DIR, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Bytes in the blob store, counted on the first store; None until then.
+        self.total_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    def blob_path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    @staticmethod
+    def recorded_key(path):
+        key_path = path + KEY_SUFFIX
+        if not os.path.exists(key_path):
+            return None
+        with open(key_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    @staticmethod
+    def _record_key(path, key):
+        with open(path + KEY_SUFFIX, "w", encoding="utf-8") as f:
+            f.write(key)
+
+    def lookup(self, path, key) -> bool:
+        """Return True if ``path`` holds the artifact for ``key``.
+
+        A stale file at ``path`` is removed; the blob store is consulted and,
+        on a hit, the artifact is materialized at ``path``. Files written
+        before keys were recorded are adopted as-is.
+        """
+        if os.path.exists(path):
+            recorded = self.recorded_key(path)
+            if recorded is None:
+                self._record_key(path, key)
+                self._trace(path, "local")
+                return True
+            if recorded == key:
+                self._trace(path, "local")
+                return True
+            # The stale version stays available in the blob store under its own key.
+            logging.info(f"♻️ Inputs of {path} changed, regenerating.")
+            self.invalidate(path)
+
+        blob_path = self.blob_path(key)
+        if self.max_bytes > 0 and os.path.exists(blob_path):
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                _atomic_copy(blob_path, path)
+                os.utime(blob_path)
+            except FileNotFoundError:
+                # Evicted between the check and the copy.
+                pass
+            else:
+                self._record_key(path, key)
+                with self.lock:
+                    self.hits += 1
+                logging.info(f"🚀 Reused cached artifact for {path}.")
+                self._trace(path, "blob")
+                return True
+
+        with self.lock:
+            self.misses += 1
+        self._trace(path, None)
+        return False
+
+    @staticmethod
+    def _trace(path, source):
+        if source is None:
+            count(cache_misses=1)
+            instant("cache miss", "cache", path=path)
+        else:
+            count(cache_hits=1)
+            instant("cache hit", "cache", path=path, source=source)
+
+    @staticmethod
+    def invalidate(path):
+        """Remove the artifact at ``path`` together with its recorded key."""
+        for stale_path in (path, path + KEY_SUFFIX):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+
+    def store(self, path, key):
+        """Record ``key`` for the freshly written ``path`` and share it through the blob store."""
+        self._record_key(path, key)
+        if self.max_bytes <= 0:
+            return
+        blob_path = self.blob_path(key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(blob_path)
+        except FileNotFoundError:
+            replaced = 0
+        _atomic_copy(path, blob_path)
+        stored = os.path.getsize(blob_path)
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self._blobs())
+            else:
+                self.total_bytes += stored - replaced
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _blobs(self):
+        """Return ``(mtime, size, path)`` of every blob in the store."""
+        blobs = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith(".tmp_"):
+                    continue
+                blob_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(blob_path)
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, blob_path))
+        return blobs
+
+    def evict(self):
+        """Delete least recently used blobs until the store fits in ``EVICT_TO`` of ``max_bytes``."""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        # Walking the store also takes in blobs that other processes sharing it have stored or evicted.
+        blobs = self._blobs()
+        self.total_bytes = sum(size for _, size, _ in blobs)
+        for _, size, blob_path in sorted(blobs):
+            if self.total_bytes <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(blob_path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+
+
+artifact_cache = ArtifactCache()
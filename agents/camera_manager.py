@@ -1,25 +1,15 @@
-import getpass
 import os
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
+from .clients import get_chat_model
+from .state import VideoGenState
+from .artifact_cache import artifact_cache, artifact_key
 
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-flash"
 
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
-from .state import VideoGenState
 
-model = ChatQwen(
-    model="qwen-flash",
-    max_tokens=3_000,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+def get_model():
+    return get_chat_model(MODEL, max_tokens=3_000, timeout=None, max_retries=2)
 
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -30,7 +20,7 @@ import json
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal, Tuple
 
-from .interfaces import Camera
+from .interfaces import Camera, ShotDescription
 
 system_prompt_template_select_reference_camera = \
 """
@@ -119,55 +109,61 @@ class CameraTreeResponse(BaseModel):
         description="The parent camera items for each camera. If a camera has no parent, set this to None. The length of the list should be the same as the number of cameras.",
     )
 
-def construct_camera_tree(state: VideoGenState) -> VideoGenState:
+def construct_camera_tree_for_scene(state: VideoGenState, idx: int, shot_descriptions: List[ShotDescription]) -> List[Camera]:
     parser = PydanticOutputParser(pydantic_object=CameraTreeResponse)
 
+    save_root = os.path.join(state['cache_dir'], f"scene_{idx}")
+    save_path = os.path.join(save_root, "camera_tree.json")
+
+    cameras: List[Camera] = []
+
+    for shot_description in shot_descriptions:
+        if shot_description.cam_idx not in [camera.idx for camera in cameras]:
+            cameras.append(Camera(idx=shot_description.cam_idx, active_shot_idxs=[shot_description.idx]))
+        else:
+            cameras[shot_description.cam_idx].active_shot_idxs.append(shot_description.idx)
+
+    camera_seq_str = "<CAMERA_SEQ>\n"
+    for cam in cameras:
+        camera_seq_str += f"<CAMERA_{cam.idx}>\n"
+        for shot_idx in cam.active_shot_idxs:
+            camera_seq_str += f"Shot {shot_idx}: {shot_descriptions[shot_idx].visual_desc}\n"
+        camera_seq_str += f"</CAMERA_{cam.idx}>\n"
+    camera_seq_str += "</CAMERA_SEQ>"
+
+    messages = [
+        SystemMessage(content=system_prompt_template_select_reference_camera.format(format_instructions=parser.get_format_instructions())),
+        HumanMessage(content=human_prompt_template_select_reference_camera.format(camera_seq_str=camera_seq_str)),
+    ]
+    key = artifact_key(MODEL, [message.content for message in messages])
+    if artifact_cache.lookup(save_path, key):
+        with open(save_path, 'r', encoding='utf-8') as f:
+            camera_tree = json.load(f)
+        camera_tree = [Camera.model_validate(camera) for camera in camera_tree]
+        logging.info(f"🚀 Loaded {len(camera_tree)} cameras from existing file.")
+    else:
+        chain = get_model() | parser
+        response: CameraTreeResponse = chain.invoke(messages)
+        for cam, parent_cam_item in zip(cameras, response.camera_parent_items):
+            cam.parent_cam_idx = parent_cam_item.parent_cam_idx if parent_cam_item is not None else None
+            cam.parent_shot_idx = parent_cam_item.parent_shot_idx if parent_cam_item is not None else None
+            cam.reason = parent_cam_item.reason if parent_cam_item is not None else None
+            cam.parent_shot_idx = parent_cam_item.parent_shot_idx if parent_cam_item is not None else None
+            cam.is_parent_fully_covers_child = parent_cam_item.is_parent_fully_covers_child if parent_cam_item is not None else None
+            cam.missing_info = parent_cam_item.missing_info if parent_cam_item is not None else None
+
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump([camera.model_dump() for camera in cameras], f, ensure_ascii=False, indent=4)
+        artifact_cache.store(save_path, key)
+
+        camera_tree = cameras
+        logging.info(f"✅ Constructed camera tree and saved to {save_path}.")
+    return camera_tree
+
+
+def construct_camera_tree(state: VideoGenState) -> VideoGenState:
     state["camera_tree"] = []
     for idx, shot_descriptions in enumerate(state["shot_descriptions"]):
-        save_root = os.path.join(state['cache_dir'], f"scene_{idx}")
-        save_path = os.path.join(save_root, "camera_tree.json")
-        if os.path.exists(save_path):
-            with open(save_path, 'r', encoding='utf-8') as f:
-                camera_tree = json.load(f)
-            camera_tree = [Camera.model_validate(camera) for camera in camera_tree]
-            state["camera_tree"].append(camera_tree)
-            logging.info(f"🚀 Loaded {len(camera_tree)} cameras from existing file.")
-        else:
-            cameras: List[Camera] = []
-            
-            for shot_description in shot_descriptions:
-                if shot_description.cam_idx not in [camera.idx for camera in cameras]:
-                    cameras.append(Camera(idx=shot_description.cam_idx, active_shot_idxs=[shot_description.idx]))
-                else:
-                    cameras[shot_description.cam_idx].active_shot_idxs.append(shot_description.idx)
-
-            camera_seq_str = "<CAMERA_SEQ>\n"
-            for cam in cameras:
-                camera_seq_str += f"<CAMERA_{cam.idx}>\n"
-                for shot_idx in cam.active_shot_idxs:
-                    camera_seq_str += f"Shot {shot_idx}: {shot_descriptions[shot_idx].visual_desc}\n"
-                camera_seq_str += f"</CAMERA_{cam.idx}>\n"
-            camera_seq_str += "</CAMERA_SEQ>"
-
-            messages = [
-                SystemMessage(content=system_prompt_template_select_reference_camera.format(format_instructions=parser.get_format_instructions())),
-                HumanMessage(content=human_prompt_template_select_reference_camera.format(camera_seq_str=camera_seq_str)),
-            ]
-    
-            chain = model | parser
-            response: CameraTreeResponse = chain.invoke(messages)
-            for cam, parent_cam_item in zip(cameras, response.camera_parent_items):
-                cam.parent_cam_idx = parent_cam_item.parent_cam_idx if parent_cam_item is not None else None
-                cam.parent_shot_idx = parent_cam_item.parent_shot_idx if parent_cam_item is not None else None
-                cam.reason = parent_cam_item.reason if parent_cam_item is not None else None
-                cam.parent_shot_idx = parent_cam_item.parent_shot_idx if parent_cam_item is not None else None
-                cam.is_parent_fully_covers_child = parent_cam_item.is_parent_fully_covers_child if parent_cam_item is not None else None
-                cam.missing_info = parent_cam_item.missing_info if parent_cam_item is not None else None
-
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump([camera.model_dump() for camera in cameras], f, ensure_ascii=False, indent=4)
-
-            state["camera_tree"].append(cameras)
-            logging.info(f"✅ Constructed camera tree and saved to {save_path}.")
-
-    return state
\ No newline at end of file
+        state["camera_tree"].append(construct_camera_tree_for_scene(state, idx, shot_descriptions))
+
+    return state
@@ -1,25 +1,16 @@
-import getpass
 import os
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
+from .clients import get_chat_model
+from .state import VideoGenState
+from .artifact_cache import artifact_cache, artifact_key
+from .incremental import INCREMENTAL_REGEN, load_applied_story, changed_passages, merge_characters
 
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-flash"
 
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
-from .state import VideoGenState
 
-model = ChatQwen(
-    model="qwen-flash",
-    max_tokens=3_000,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+def get_model():
+    return get_chat_model(MODEL, max_tokens=3_000, timeout=None, max_retries=2)
 
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -69,6 +60,23 @@ human_prompt_template_extract_characters = \
 </SCRIPT>
 """
 
+human_prompt_template_revise_characters = \
+"""
+The script is a revision of an earlier version, from which these characters were extracted:
+
+<PREVIOUS_CHARACTERS>
+{previous_characters}
+</PREVIOUS_CHARACTERS>
+
+These passages of the script are new or rewritten:
+
+<CHANGED_PASSAGES>
+{changed_passages}
+</CHANGED_PASSAGES>
+
+Keep the identifier and features of every previous character the changed passages do not affect exactly as they are. Only update, add or remove characters as the changed passages require.
+"""
+
 class CharacterInScene(BaseModel):
     idx: int = Field(
         description="The index of the character in the scene, starting from 0",
@@ -115,7 +123,18 @@ class ExtractCharactersResponse(BaseModel):
 
 def extract_characters(state: VideoGenState) -> VideoGenState:
     save_path = os.path.join(state['cache_dir'], "characters.json")
+    parser = PydanticOutputParser(pydantic_object=ExtractCharactersResponse)
+    messages = [
+        SystemMessage(content=system_prompt_template_extract_characters.format(format_instructions=parser.get_format_instructions())),
+        HumanMessage(content=human_prompt_template_extract_characters.format(script=state["story"])),
+    ]
+    key = artifact_key(MODEL, [message.content for message in messages])
+    # Read before the lookup, which removes the file if the story has changed.
+    previous_characters = None
     if os.path.exists(save_path):
+        with open(save_path, "r", encoding="utf-8") as f:
+            previous_characters = [CharacterInScene.model_validate(character) for character in json.load(f)]
+    if artifact_cache.lookup(save_path, key):
         with open(save_path, "r", encoding="utf-8") as f:
             characters = json.load(f)
         characters = [CharacterInScene.model_validate(
@@ -123,21 +142,29 @@ def extract_characters(state: VideoGenState) -> VideoGenState:
         state["character_desc"] = characters
         logging.info(f"🚀 Loaded {len(characters)} characters from existing file.")
     else:
-        parser = PydanticOutputParser(pydantic_object=ExtractCharactersResponse)
-        
-        messages = [
-            SystemMessage(content=system_prompt_template_extract_characters.format(format_instructions=parser.get_format_instructions())),
-            HumanMessage(content=human_prompt_template_extract_characters.format(script=state["story"])),
-        ]
-    
-        chain = model | parser
+        previous_story = load_applied_story(state['cache_dir']) if INCREMENTAL_REGEN else None
+        incremental = previous_characters is not None and previous_story is not None and previous_story != state["story"]
+        if incremental:
+            changed = changed_passages(previous_story, state["story"])
+            messages.append(HumanMessage(content=human_prompt_template_revise_characters.format(
+                previous_characters=json.dumps([character.model_dump() for character in previous_characters], ensure_ascii=False, indent=4),
+                changed_passages=changed,
+            )))
+
+        chain = get_model() | parser
     
         response: ExtractCharactersResponse = chain.invoke(messages)
     
         characters = response.characters
+        if incremental:
+            characters = merge_characters(previous_characters, characters, state["story"], changed)
+        else:
+            # Shots refer to characters by idx, so make sure it is unique.
+            characters = [character.model_copy(update={"idx": idx}) for idx, character in enumerate(characters)]
         with open(save_path, "w", encoding="utf-8") as f:
             json.dump([character.model_dump()
                       for character in characters], f, ensure_ascii=False, indent=4)
+        artifact_cache.store(save_path, key)
         state["character_desc"] = characters
         logging.info(f"✅ Extracted {len(characters)} characters from story and saved to {save_path}.")
     return state
\ No newline at end of file
@@ -1,7 +1,10 @@
 import json
 import os
 import logging
-from .utils import text2image, image2image
+from functools import partial
+from .utils import text2image, image2image, IMAGE_MAX_CONCURRENCY, TEXT2IMAGE_MODEL, IMAGE_EDIT_MODEL
+from .artifact_cache import artifact_cache, artifact_key, file_digest
+from .scheduler import TaskGraph
 from .state import VideoGenState
 
 
@@ -23,10 +26,46 @@ Generate a full-body, back-view portrait of character {identifier} based on the
 """
 
 
+def _generate_front_portrait(character, style, front_portrait_path):
+    features = "(static) " + character.static_features + "; (dynamic) " + character.dynamic_features
+    prompt = prompt_template_front.format(
+        identifier=character.identifier_in_scene,
+        features=features,
+        style=style,
+    )
+    key = artifact_key(TEXT2IMAGE_MODEL, prompt)
+    if artifact_cache.lookup(front_portrait_path, key):
+        return
+    text2image(prompt, front_portrait_path)
+    if not os.path.exists(front_portrait_path):
+        raise RuntimeError(f"Failed to generate front portrait for {character.identifier_in_scene}.")
+    artifact_cache.store(front_portrait_path, key)
+
+
+def _generate_view_portrait(character, style, prompt_template, front_portrait_path, portrait_path):
+    features = "(static) " + character.static_features + "; (dynamic) " + character.dynamic_features
+    prompt = prompt_template.format(
+        identifier=character.identifier_in_scene,
+        features=features,
+        style=style,
+    )
+    key = artifact_key(IMAGE_EDIT_MODEL, prompt, file_digest(front_portrait_path))
+    if artifact_cache.lookup(portrait_path, key):
+        return
+    image2image(prompt, [front_portrait_path], portrait_path)
+    if not os.path.exists(portrait_path):
+        raise RuntimeError(f"Failed to generate portrait {portrait_path}.")
+    artifact_cache.store(portrait_path, key)
+
+
 def generate_character_images(state: VideoGenState) -> VideoGenState:
     image_save_root = os.path.join(state['cache_dir'], "character_portraits")
     os.makedirs(image_save_root, exist_ok=True)
 
+    # Side and back views are edited from the front view, so each character is a small
+    # front -> {side, back} DAG and all characters run concurrently. Up-to-date portraits
+    # are recognised inside the tasks, because side/back keys depend on the front view.
+    graph = TaskGraph()
     state["character_images"] = {}
     for character in state["character_desc"]:
         character_dir = os.path.join(image_save_root, f"{character.idx}_{character.identifier_in_scene}")
@@ -35,38 +74,11 @@ def generate_character_images(state: VideoGenState) -> VideoGenState:
         front_portrait_path = os.path.join(character_dir, "front.png")
         side_portrait_path = os.path.join(character_dir, "side.png")
         back_portrait_path = os.path.join(character_dir, "back.png")
-        if os.path.exists(front_portrait_path):
-            pass
-        else:
-            features = "(static) " + character.static_features + "; (dynamic) " + character.dynamic_features
-            prompt = prompt_template_front.format(
-                identifier=character.identifier_in_scene,
-                features=features,
-                style=state["style"],
-            )
-            text2image(prompt, front_portrait_path)
-
-        if os.path.exists(side_portrait_path):
-            pass
-        else:
-            features = "(static) " + character.static_features + "; (dynamic) " + character.dynamic_features
-            prompt = prompt_template_side.format(
-                identifier=character.identifier_in_scene,
-                features=features,
-                style=state["style"],
-            )
-            image2image(prompt, [front_portrait_path], side_portrait_path)
-
-        if os.path.exists(back_portrait_path):
-            pass
-        else:
-            features = "(static) " + character.static_features + "; (dynamic) " + character.dynamic_features
-            prompt = prompt_template_back.format(
-                identifier=character.identifier_in_scene,
-                features=features,
-                style=state["style"],
-            )
-            image2image(prompt, [front_portrait_path], back_portrait_path)
+
+        front_task = (character.idx, "front")
+        graph.add(front_task, partial(_generate_front_portrait, character, state["style"], front_portrait_path))
+        graph.add((character.idx, "side"), partial(_generate_view_portrait, character, state["style"], prompt_template_side, front_portrait_path, side_portrait_path), [front_task])
+        graph.add((character.idx, "back"), partial(_generate_view_portrait, character, state["style"], prompt_template_back, front_portrait_path, back_portrait_path), [front_task])
 
         state["character_images"][character.identifier_in_scene] = {
                 "front": {
@@ -82,6 +94,13 @@ def generate_character_images(state: VideoGenState) -> VideoGenState:
                     "description": f"A back view portrait of {character.identifier_in_scene}.",
                 },
             }
-        logging.info(f"☑️ Completed character portrait generation for {character.identifier_in_scene}.")
 
-    return state
\ No newline at end of file
+    results = graph.run(max_workers=IMAGE_MAX_CONCURRENCY)
+    failed = [name for name, error in results.items() if error is not None]
+    for character in state["character_desc"]:
+        if not any(name[0] == character.idx for name in failed):
+            logging.info(f"☑️ Completed character portrait generation for {character.identifier_in_scene}.")
+    if failed:
+        raise RuntimeError(f"Failed to generate character portraits {failed}; completed portraits are kept for the next run.")
+
+    return state
@@ -0,0 +1,174 @@
+"""LangChain hooks of the shared chat models.
+
+``get_chat_model`` attaches these to every chat model it builds, so this
+module, and LangChain with it, is only imported once a chat model is
+needed rather than by everything that traces or rate-limits a call.
+
+- ``llm_span_handler`` records every chat model call as a span of the
+  current run's trace, with its token counts.
+- ``ChatRateLimiter`` takes a slot and a token of the model's limit before
+  a request, and ``chat_slot_handler`` gives the slot back when the call
+  ends. The two find each other through a context variable, which also
+  holds for ``ainvoke`` and ``abatch``, where they run on different threads.
+"""
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from .rate_limit import ModelLimit
+from .tracing import TRACING, _now_us, current
+
+
+class LLMSpanHandler(BaseCallbackHandler):
+    """Callback handler that records every chat model call as a span with its token counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, invocation_params=None, **kwargs):
+        tracer = current() if TRACING else None
+        if tracer is None:
+            return
+        params = invocation_params or {}
+        model = (metadata or {}).get("ls_model_name") or params.get("model") or (serialized or {}).get("name", "chat")
+        payload = sum(len(m.content if isinstance(m.content, str) else json.dumps(m.content)) for batch in messages for m in batch)
+        with self.lock:
+            self.open[run_id] = (tracer, model, payload, _now_us())
+
+    def _finish(self, run_id, args):
+        with self.lock:
+            entry = self.open.pop(run_id, None)
+        if entry is None:
+            return
+        tracer, model, payload, start = entry
+        tracer.complete(f"chat {model}", "llm", start, _now_us(), {"model": model, "request_bytes": payload, **args})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = {}
+        generations = [g for batch in response.generations for g in batch]
+        message = getattr(generations[0], "message", None) if generations else None
+        if message is not None and getattr(message, "usage_metadata", None):
+            usage = {"input_tokens": message.usage_metadata.get("input_tokens"), "output_tokens": message.usage_metadata.get("output_tokens")}
+        elif response.llm_output and response.llm_output.get("token_usage"):
+            token_usage = response.llm_output["token_usage"]
+            usage = {"input_tokens": token_usage.get("prompt_tokens"), "output_tokens": token_usage.get("completion_tokens")}
+        response_bytes = sum(len(g.text) for g in generations)
+        self._finish(run_id, {**usage, "response_bytes": response_bytes})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, {"error": f"{type(error).__name__}: {error}"})
+
+
+llm_span_handler = LLMSpanHandler()
+
+
+class _ChatCall:
+    """Slots taken by the runs of one chat model call (``invoke``, ``ainvoke``, ``batch`` ...)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.slots = []
+        self.closed = False
+
+    def take(self, release_all):
+        with self.lock:
+            if release_all:
+                taken, self.slots = self.slots, []
+            else:
+                taken = self.slots[-1:]
+                del self.slots[-1:]
+        return taken
+
+
+# The chat call of the current context. ``chat_slot_handler`` runs inline, so it sets this in the
+# caller's context, and the rate limiter sees it from the same context or from tasks copied from it.
+_chat_call: ContextVar[Optional[_ChatCall]] = ContextVar("chat_call", default=None)
+
+
+class ChatRateLimiter(BaseRateLimiter):
+    """LangChain ``rate_limiter`` taking a slot and a token of one model per request."""
+
+    def __init__(self, limit: ModelLimit):
+        self.limit = limit
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if not self.limit.acquire(blocking=blocking):
+            return False
+        self._hold()
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        if not await self.limit.aacquire(blocking=blocking):
+            return False
+        self._hold()
+        return True
+
+    def _hold(self):
+        # The hook runs on a cache miss only, after chat_slot_handler has opened the call.
+        call = _chat_call.get()
+        if call is None or call.closed:
+            # Without the handler the end of the request is not observed; only the rate applies.
+            self.limit.release()
+            return
+        with call.lock:
+            call.slots.append((self.limit, time.monotonic()))
+
+
+class ChatSlotHandler(BaseCallbackHandler):
+    """Give back the slots of a chat model call when its runs end, and feed back their latency.
+
+    Slots of one model are interchangeable, and LangChain ends the runs of a
+    call only after all of its requests have returned, so each run that ends
+    gives back one of the call's slots and the last one gives back the rest.
+    """
+
+    # Called in the caller's context rather than in an executor thread, see _chat_call.
+    run_inline = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        call = _chat_call.get()
+        if call is None or call.closed:
+            call = _ChatCall()
+            _chat_call.set(call)
+        with call.lock:
+            call.runs += 1
+        with self.lock:
+            self.calls[run_id] = call
+
+    def _end(self, run_id, failed):
+        with self.lock:
+            call = self.calls.pop(run_id, None)
+        if call is None:
+            return []
+        with call.lock:
+            call.runs -= 1
+            last = call.runs <= 0
+            if last:
+                call.closed = True
+        # A failed run aborts a synchronous batch, whose later runs never end.
+        return call.take(release_all=last or failed)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        now = time.monotonic()
+        for limit, start in self._end(run_id, failed=False):
+            limit.release()
+            limit.on_success(now - start)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        # Throttled attempts are reported as they happen, see report_status.
+        for limit, _ in self._end(run_id, failed=True):
+            limit.release()
+
+
+chat_slot_handler = ChatSlotHandler()
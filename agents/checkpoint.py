@@ -0,0 +1,261 @@
+"""Durable LangGraph checkpoints in SQLite.
+
+``SQLiteSaver`` keeps the graph state of every thread in one SQLite file,
+so a run that crashed or was stopped, also after the approval step, can be
+continued with ``idea2video_agent.resume(thread_id)`` from its last
+completed node instead of starting over. Scene branches that finished
+before the crash are kept as pending writes and are not run again.
+
+Like LangGraph's in-memory saver, a checkpoint stores only the channels
+that changed; values are serialized with msgpack and compressed with
+zlib, which shrinks the repeated field names of the Pydantic models in
+``VideoGenState`` to a fraction. Only the state's own model classes are
+revived on load.
+"""
+import os
+import random
+import sqlite3
+import threading
+import zlib
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# Checkpoint database of the command line runs; empty keeps checkpoints in memory only.
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join("working_dir", "checkpoints.sqlite"))
+
+# Model classes that may appear in the graph state and are revived on load.
+STATE_MODELS = [
+    ("agents.character_extractor", "CharacterInScene"),
+    ("agents.interfaces", "ShotBriefDescription"),
+    ("agents.interfaces", "ShotDescription"),
+    ("agents.interfaces", "Camera"),
+]
+
+# Values smaller than this are stored uncompressed.
+_COMPRESS_MIN_BYTES = 256
+_ZLIB_SUFFIX = "+zlib"
+
+
+class CompactSerializer(SerializerProtocol):
+    """msgpack serialization of ``JsonPlusSerializer`` with zlib compression of larger values."""
+
+    def __init__(self, allowed_models=STATE_MODELS):
+        self.serde = JsonPlusSerializer(allowed_msgpack_modules=allowed_models)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) >= _COMPRESS_MIN_BYTES:
+            compressed = zlib.compress(data, 6)
+            if len(compressed) < len(data):
+                return type_ + _ZLIB_SUFFIX, compressed
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(_ZLIB_SUFFIX):
+            type_, payload = type_[:-len(_ZLIB_SUFFIX)], zlib.decompress(payload)
+        return self.serde.loads_typed((type_, payload))
+
+
+class SQLiteSaver(BaseCheckpointSaver[str]):
+    """Checkpoint saver storing checkpoints, channel values and pending writes in SQLite."""
+
+    def __init__(self, path=CHECKPOINT_DB, serde: Optional[SerializerProtocol] = None):
+        super().__init__(serde=serde or CompactSerializer())
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, "
+                "parent_checkpoint_id TEXT, type TEXT NOT NULL, checkpoint BLOB NOT NULL, "
+                "metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, "
+                "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL, "
+                "type TEXT NOT NULL, blob BLOB, "
+                "PRIMARY KEY (thread_id, checkpoint_ns, channel, version))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS writes ("
+                "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, "
+                "task_id TEXT NOT NULL, idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT NOT NULL, value BLOB, "
+                "task_path TEXT NOT NULL, "
+                "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        """A zero-padded counter with a random suffix, as in LangGraph's in-memory saver.
+
+        Blobs are keyed by version, so a fork of an earlier checkpoint (``update_state``
+        or a replay) must not reuse the versions of the branch it forks from.
+        """
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            # Plain integers were written by earlier versions of this saver.
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def _tuple(self, thread_id, checkpoint_ns, row) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint_blob, metadata_type, metadata_blob = row
+        checkpoint = self.serde.loads_typed((type_, checkpoint_blob))
+        channel_values = {}
+        for channel, version in checkpoint["channel_versions"].items():
+            blob = self.conn.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if blob is not None and blob[0] != "empty":
+                channel_values[channel] = self.serde.loads_typed(blob)
+        writes = self.conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        writes.sort(key=lambda w: writes_sort_key(w[5], w[0], w[1]))
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((metadata_type, metadata_blob)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, _, channel, type_, value, _ in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self.lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                # Checkpoint ids are time-ordered, so the largest one is the latest.
+                row = self.conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._tuple(thread_id, checkpoint_ns, row) if row is not None else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        conditions, params = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            with self.lock:
+                checkpoint_tuple = self._tuple(thread_id, checkpoint_ns, row)
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+        blobs = [
+            (thread_id, checkpoint_ns, channel, str(version),
+             *(self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None)))
+            for channel, version in new_versions.items()
+        ]
+        type_, checkpoint_blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, checkpoint_blob, metadata_type, metadata_blob),
+            )
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = [
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel,
+             *self.serde.dumps_typed(value), task_path)
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        with self.lock, self.conn:
+            # Special writes (errors, interrupts) replace earlier ones; regular writes are only stored once.
+            self.conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [row for row in rows if row[4] < 0])
+            self.conn.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [row for row in rows if row[4] >= 0])
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock, self.conn:
+            for table in ("checkpoints", "blobs", "writes"):
+                self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None):
+        for checkpoint_tuple in self.list(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.delete_thread(thread_id)
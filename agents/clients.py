@@ -0,0 +1,109 @@
+"""Shared, pooled clients for every outbound call.
+
+Modules get their HTTP sessions and chat models from here instead of
+constructing their own, so keep-alive connections and TLS sessions are
+reused across nodes and threads. Pool sizes and timeouts are set through
+the environment variables below.
+"""
+import json
+import os
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .rate_limit import report_status
+
+# Connections kept alive per host, for media downloads and DashScope calls.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# Connections kept alive to the LLM endpoint, shared by every chat model.
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+# Timeout in seconds of LLM requests; overrides the timeout the modules ask for when set.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT")) if os.getenv("LLM_TIMEOUT") else None
+
+_lock = threading.Lock()
+_llm_lock = threading.Lock()
+_sessions = {}
+_chat_models = {}
+_llm_http_client = None
+
+
+def get_session(name: str = "default") -> requests.Session:
+    """Return the shared keep-alive session called ``name``, creating it on first use."""
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            # Retries are handled by the callers, which know what is safe to repeat.
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[name] = session
+        return session
+
+
+def _report_llm_response(response: httpx.Response):
+    # The OpenAI client retries 429s by itself; tell the rate limiter about every one of them.
+    if response.status_code != 429:
+        return
+    try:
+        model = json.loads(response.request.content).get("model")
+    except (ValueError, AttributeError, httpx.RequestNotRead):
+        model = None
+    report_status(model, response.status_code)
+
+
+def get_llm_http_client() -> httpx.Client:
+    """Return the pooled HTTP client shared by every chat model."""
+    global _llm_http_client
+    with _llm_lock:
+        if _llm_http_client is None:
+            _llm_http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+                event_hooks={"response": [_report_llm_response]},
+            )
+        return _llm_http_client
+
+
+def get_chat_model(model: str, **params):
+    """Return the shared chat model for ``model`` and ``params``, creating it on first use.
+
+    Models come from the active provider; DashScope ones all send their
+    requests through one pooled HTTP client. Identical requests are answered
+    from the persistent response cache, see ``llm_cache``, and the others
+    are paced by the model's rate limit, see ``rate_limit``.
+    """
+    from .chat_hooks import chat_slot_handler, llm_span_handler
+    from .llm_cache import get_response_cache
+    from .providers import get_provider
+    from .rate_limit import get_rate_limiter
+
+    if LLM_TIMEOUT is not None:
+        params["timeout"] = LLM_TIMEOUT
+    provider = get_provider()
+    key = (provider.name, model, tuple(sorted(params.items())))
+    with _lock:
+        chat_model = _chat_models.get(key)
+        if chat_model is None:
+            chat_model = provider.chat_model(model, **params)
+            # Record every call as a span of the current run's trace, and give back its rate limit slot.
+            chat_model.callbacks = [llm_span_handler, chat_slot_handler]
+            chat_model.cache = get_response_cache()
+            chat_model.rate_limiter = get_rate_limiter().chat(model)
+            _chat_models[key] = chat_model
+        return chat_model
+
+
+def close_all():
+    """Close every pooled connection; clients are recreated on next use."""
+    global _llm_http_client
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _chat_models.clear()
+    with _llm_lock:
+        if _llm_http_client is not None:
+            _llm_http_client.close()
+            _llm_http_client = None
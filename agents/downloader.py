@@ -0,0 +1,188 @@
+"""Shared download engine for generated media.
+
+Files are written to ``<path>.part`` and renamed into place only once they
+are complete and verified, so an interrupted download never leaves a
+truncated file where a finished one is expected. What was already received
+is kept and resumed with an HTTP Range request on the next attempt, and
+large files are fetched as several ranges over parallel connections.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+from .clients import get_session
+from .retry import as_provider_error, backoff
+from .tracing import span
+
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+# Parallel ranged connections per file; files below DOWNLOAD_PARALLEL_MIN_BYTES use one.
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_PARALLEL_MIN_BYTES = int(os.getenv("DOWNLOAD_PARALLEL_MIN_BYTES", str(8 * 1024 * 1024)))
+
+PART_SUFFIX = ".part"
+
+
+class DownloadError(IOError):
+    pass
+
+
+def _probe(session, url, headers, timeout):
+    """Return ``(size, accepts_ranges, validator)`` of the remote file.
+
+    Uses a one-byte ranged GET rather than HEAD, because presigned object
+    storage URLs are usually only signed for GET.
+    """
+    with session.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=timeout) as rsp:
+        rsp.raise_for_status()
+        validator = rsp.headers.get("ETag") or rsp.headers.get("Last-Modified")
+        if rsp.status_code == 206:
+            match = re.search(r"/(\d+)$", rsp.headers.get("Content-Range", ""))
+            return (int(match.group(1)) if match else None), True, validator
+        length = rsp.headers.get("Content-Length")
+        return (int(length) if length else None), False, validator
+
+
+def _fetch_range(session, url, part_path, start, end, headers, validator, timeout, chunk_size):
+    """Fetch bytes ``start..end`` (to the end of the file if ``end`` is None) into ``part_path``.
+
+    Bytes already in ``part_path`` are kept and only the remainder is requested.
+    """
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if end is not None:
+        expected = end - start + 1
+        if done == expected:
+            return
+        if done > expected:
+            done = 0
+
+    range_headers = dict(headers)
+    if start + done > 0 or end is not None:
+        range_headers["Range"] = f"bytes={start + done}-{'' if end is None else end}"
+        if validator:
+            # Only resume if the file has not changed since the partial bytes were received.
+            range_headers["If-Range"] = validator
+    with session.get(url, headers=range_headers, stream=True, timeout=timeout) as rsp:
+        rsp.raise_for_status()
+        if "Range" in range_headers and rsp.status_code != 206:
+            if start != 0 or end is not None:
+                raise DownloadError(f"Server ignored the range request for {url}.")
+            # The server sent the whole file; start over.
+            done = 0
+        with open(part_path, "ab" if done else "wb") as f:
+            for chunk in rsp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+
+
+def _verify(path, size, sha256):
+    actual_size = os.path.getsize(path)
+    if size is not None and actual_size != size:
+        raise DownloadError(f"Expected {size} bytes but received {actual_size}.")
+    if sha256 is not None:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != sha256.lower():
+            raise DownloadError(f"Checksum mismatch, expected sha256 {sha256} but got {digest.hexdigest()}.")
+
+
+def _discard(part_path):
+    for name in os.listdir(os.path.dirname(part_path) or "."):
+        path = os.path.join(os.path.dirname(part_path), name)
+        if path == part_path or path.startswith(part_path + "."):
+            os.remove(path)
+
+
+def _layout(part_path, size, ranged, validator, connections):
+    """Return the byte ranges to fetch, reusing the split of an interrupted download of the same file."""
+    meta_path = part_path + ".json"
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("size") == size and meta.get("validator") == validator:
+            return meta["ranges"]
+    _discard(part_path)
+
+    if size is None or not ranged:
+        ranges = [[0, None]]
+    elif connections > 1 and size >= DOWNLOAD_PARALLEL_MIN_BYTES:
+        step = -(-size // connections)
+        ranges = [[start, min(start + step, size) - 1] for start in range(0, size, step)]
+    else:
+        ranges = [[0, size - 1]] if size else [[0, None]]
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"size": size, "validator": validator, "ranges": ranges}, f)
+    return ranges
+
+
+def download(url, save_path, size: Optional[int] = None, sha256: Optional[str] = None, headers=None,
+             session=None, connections=None, timeout=None, retries=None, chunk_size=1024 * 1024):
+    """Download ``url`` to ``save_path`` and return ``save_path``.
+
+    ``size`` and ``sha256`` are checked when given; otherwise the size
+    announced by the server is. Raises ``DownloadError`` once ``retries``
+    further attempts have failed; the partial download is kept for the next call.
+    """
+    session = session or get_session("download")
+    headers = headers or {}
+    connections = DOWNLOAD_CONNECTIONS if connections is None else connections
+    timeout = DOWNLOAD_TIMEOUT if timeout is None else timeout
+    retries = DOWNLOAD_RETRIES if retries is None else retries
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    part_path = save_path + PART_SUFFIX
+
+    with span("download", "io", path=save_path) as traced:
+        error = None
+        for attempt in range(retries + 1):
+            traced.set(attempts=attempt + 1)
+            try:
+                remote_size, ranged, validator = _probe(session, url, headers, timeout)
+                if size is not None and remote_size is not None and remote_size != size:
+                    raise DownloadError(f"Expected {size} bytes but the server has {remote_size}.")
+                ranges = _layout(part_path, remote_size, ranged, validator, connections)
+
+                if len(ranges) == 1:
+                    _fetch_range(session, url, part_path, *ranges[0], headers, validator, timeout, chunk_size)
+                else:
+                    chunk_paths = [f"{part_path}.{i}" for i in range(len(ranges))]
+                    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                        futures = [
+                            executor.submit(_fetch_range, session, url, chunk_path, start, end, headers, validator, timeout, chunk_size)
+                            for chunk_path, (start, end) in zip(chunk_paths, ranges)
+                        ]
+                        for future in futures:
+                            future.result()
+                    with open(part_path, "wb") as f:
+                        for chunk_path in chunk_paths:
+                            with open(chunk_path, "rb") as chunk_file:
+                                shutil.copyfileobj(chunk_file, f, chunk_size)
+
+                try:
+                    _verify(part_path, size if size is not None else remote_size, sha256)
+                except DownloadError:
+                    _discard(part_path)
+                    raise
+                os.replace(part_path, save_path)
+                _discard(part_path)
+                traced.set(bytes=os.path.getsize(save_path), connections=len(ranges))
+                return save_path
+            except (requests.RequestException, DownloadError) as e:
+                error = e
+                logging.warning(f"⚠️ Download of {save_path} failed (attempt {attempt + 1}/{retries + 1}): {e}")
+                failure = as_provider_error(e) if isinstance(e, requests.HTTPError) else None
+                if failure is not None and not failure.retryable:
+                    # An expired or forbidden URL will not come back.
+                    break
+                if attempt < retries:
+                    time.sleep(backoff(attempt, failure.retry_after if failure is not None else None, base=1, maximum=30))
+        raise DownloadError(f"Failed to download {url} to {save_path}: {error}") from error
@@ -0,0 +1,128 @@
+"""Incremental re-generation after story edits.
+
+Artifact keys already make every node recompute exactly when its inputs
+change. What makes a story edit expensive is that the LLM stages in front of
+the scenes rewrite everything from scratch, so every downstream input
+changes. In incremental mode those stages are shown what they produced last
+time and asked to revise it, and the results are reconciled with the
+previous ones:
+
+- The story the current characters and script were built from is kept in
+  ``story.applied.txt``; the passages that differ from it are the edit.
+- Characters not mentioned in the edit keep their previous description and
+  index, so their portraits and the scenes they appear in stay valid.
+- Scenes whose script text is unchanged are moved to their new index, so
+  inserting or deleting a scene does not shift the work of the others.
+- Scene-level prompts are keyed on the characters the scene mentions, so
+  editing one character only invalidates the scenes that character is in.
+"""
+import difflib
+import logging
+import os
+import shutil
+from typing import List, Optional
+
+INCREMENTAL_REGEN = os.getenv("INCREMENTAL_REGEN", "1") not in ("0", "false", "False")
+
+APPLIED_STORY_FILE = "story.applied.txt"
+
+
+def load_applied_story(cache_dir) -> Optional[str]:
+    """Return the story the current characters and script were built from, if known."""
+    path = os.path.join(cache_dir, APPLIED_STORY_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def save_applied_story(cache_dir, story):
+    with open(os.path.join(cache_dir, APPLIED_STORY_FILE), "w", encoding="utf-8") as f:
+        f.write(story)
+
+
+def changed_passages(old: str, new: str) -> str:
+    """Return the lines of ``new`` that were inserted or rewritten relative to ``old``."""
+    old_lines = old.splitlines()
+    new_lines = new.splitlines()
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+    changed = []
+    for tag, _, _, j1, j2 in matcher.get_opcodes():
+        if tag in ("replace", "insert"):
+            changed.extend(line for line in new_lines[j1:j2] if line.strip())
+    return "\n".join(changed)
+
+
+def mentions(text: str, identifier: str) -> bool:
+    return bool(identifier) and identifier.lower() in text.lower()
+
+
+def merge_characters(previous: List, revised: List, story: str, changed: str) -> List:
+    """Reconcile re-extracted characters with the previous ones.
+
+    Characters keep their previous index, so their portrait directories and
+    the cast lists of the scenes they are in stay the same. A character not
+    mentioned in the changed passages keeps its previous description
+    verbatim; one the model dropped is kept while the story still mentions
+    it. New characters are appended with indices after every previous one,
+    so the index of a dropped character is never handed to another.
+    """
+    revised_by_identifier = {character.identifier_in_scene: character for character in revised}
+    merged = []
+    for character in previous:
+        identifier = character.identifier_in_scene
+        update = revised_by_identifier.pop(identifier, None)
+        if update is None:
+            if mentions(story, identifier):
+                merged.append(character)
+            else:
+                logging.info(f"♻️ Character {identifier} no longer appears in the story.")
+        elif mentions(changed, identifier):
+            merged.append(update.model_copy(update={"idx": character.idx}))
+        else:
+            merged.append(character)
+    next_idx = max((character.idx for character in previous), default=-1) + 1
+    added = [character for character in revised if character.identifier_in_scene in revised_by_identifier]
+    merged.extend(character.model_copy(update={"idx": next_idx + offset}) for offset, character in enumerate(added))
+    return merged
+
+
+def scene_cast(script: str, characters: List) -> List[tuple]:
+    """Return ``(idx, character)`` for the characters ``script`` mentions, or for all if it names none."""
+    cast = [(character.idx, character) for character in characters if mentions(script, character.identifier_in_scene)]
+    return cast or [(character.idx, character) for character in characters]
+
+
+def _scene_dir(cache_dir, idx):
+    return os.path.join(cache_dir, f"scene_{idx}")
+
+
+def relocate_scenes(cache_dir, previous_scenes: List[str], scenes: List[str]) -> List[int]:
+    """Move the artifacts of unchanged scenes to their new index and return the indices of changed scenes."""
+    matcher = difflib.SequenceMatcher(a=previous_scenes, b=scenes, autojunk=False)
+    moves = {}
+    unchanged = set()
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            continue
+        for offset in range(i2 - i1):
+            unchanged.add(j1 + offset)
+            if i1 + offset != j1 + offset:
+                moves[i1 + offset] = j1 + offset
+
+    # Move in two phases so that swapping neighbours cannot overwrite a scene that is still to be moved.
+    staged = {}
+    for old_idx, new_idx in moves.items():
+        src = _scene_dir(cache_dir, old_idx)
+        if os.path.isdir(src):
+            staging = os.path.join(cache_dir, f".scene_{old_idx}.moving")
+            os.rename(src, staging)
+            staged[new_idx] = staging
+    for new_idx, staging in staged.items():
+        dst = _scene_dir(cache_dir, new_idx)
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        os.rename(staging, dst)
+        logging.info(f"♻️ Scene {new_idx} is unchanged, reusing its artifacts.")
+
+    return [idx for idx in range(len(scenes)) if idx not in unchanged]
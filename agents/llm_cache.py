@@ -0,0 +1,160 @@
+"""Persistent exact-match cache of chat model responses.
+
+Every chat model handed out by ``clients.get_chat_model`` looks its prompts
+up here before calling the provider, so an identical request is paid for
+once across runs, threads and ``cache_dir``s. Entries are keyed by a hash
+of the model, its parameters and the normalized messages, and live in one
+SQLite file shared by all processes on the machine. Entries expire after
+``LLM_CACHE_TTL`` seconds, and the least recently used ones are evicted
+once the file holds more than ``LLM_CACHE_MAX_BYTES`` of responses.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from langchain_core._api import suppress_langchain_beta_warning
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, Generation
+
+from .tracing import count, instant
+
+# SQLite file of the cache; set to an empty string to disable it.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "videoagent", "llm_cache.sqlite"))
+# Seconds after which a cached response is no longer used; 0 keeps responses forever.
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+# Byte budget of the cached responses; least recently used ones are evicted first.
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+
+_MODEL_RE = re.compile(r"\('model_name', '([^']*)'\)")
+
+
+def _normalize_prompt(prompt: str) -> str:
+    # The prompt is the JSON serialization of the messages; re-serialize it with sorted keys.
+    try:
+        return json.dumps(json.loads(prompt), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    except ValueError:
+        return prompt
+
+
+class SQLiteLLMCache(BaseCache):
+    """LangChain cache storing responses in SQLite, with a TTL, a byte budget and hit/miss counters."""
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.conn:
+            # WAL lets concurrent runs read while one of them writes.
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, bytes INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        payload = json.dumps([llm_string, _normalize_prompt(prompt)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = self.key(prompt, llm_string)
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl > 0 and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        model = self._model(llm_string)
+        if row is None:
+            count(llm_cache_misses=1)
+            return None
+        count(llm_cache_hits=1)
+        instant("llm cache hit", "cache", model=model)
+        logging.info(f"🚀 Reused cached response of {model}.")
+        with suppress_langchain_beta_warning():
+            # Only revive the types a response consists of.
+            return loads(row[0], allowed_objects=[Generation, ChatGeneration, AIMessage])
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        response = dumps(return_val)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, bytes, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(prompt, llm_string), self._model(llm_string), response, len(response.encode("utf-8")), now, now),
+            )
+            self.writes += 1
+            self._evict(now)
+
+    def _evict(self, now):
+        """Drop expired responses, then least recently used ones until the rest fits in ``max_bytes``."""
+        if self.ttl > 0:
+            self.evictions += self.conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        total = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, bytes FROM responses ORDER BY accessed_at").fetchall():
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self, **kwargs):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+            self.hits = self.misses = self.writes = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": total,
+            }
+
+    @staticmethod
+    def _model(llm_string) -> Optional[str]:
+        match = _MODEL_RE.search(llm_string)
+        return match.group(1) if match else None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[SQLiteLLMCache]:
+    """Return the shared response cache, or None if LLM_CACHE_PATH is empty."""
+    global _cache
+    with _cache_lock:
+        if _cache is None and LLM_CACHE_PATH:
+            _cache = SQLiteLLMCache()
+        return _cache
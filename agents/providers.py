@@ -0,0 +1,86 @@
+"""Model providers behind the pipeline.
+
+A provider supplies the four kinds of generation the pipeline uses:
+
+- ``chat_model(model, **params)``: a LangChain chat model for text (and vision) prompts
+- ``multimodal_conversation``: text-to-image and image editing, shaped like ``dashscope.MultiModalConversation``
+- ``video_synthesis``: image-to-video, shaped like ``dashscope.VideoSynthesis``
+- ``uploader()``: temporary storage for reference images, see ``references``
+
+The provider is chosen with the PROVIDER environment variable, or with
+``set_provider`` before the first node runs. SDKs are imported, and chat
+models built, only when a provider is first asked for them, so importing
+the pipeline stays cheap. ``standin`` runs the whole pipeline offline
+against synthetic outputs, see ``standin.StandInProvider``.
+"""
+import logging
+import os
+import threading
+
+# "dashscope" calls the real APIs; "standin" uses local synthetic backends.
+PROVIDER = os.getenv("PROVIDER", "dashscope")
+# DashScope API of the Beijing region; models of the Singapore region need https://dashscope-intl.aliyuncs.com/api/v1.
+DASHSCOPE_HTTP_API_URL = "https://dashscope.aliyuncs.com/api/v1"
+# OpenAI-compatible endpoint of the chat models, international by default as in langchain-qwq;
+# domestic Chinese users should set DASHSCOPE_API_BASE to the domestic endpoint.
+DASHSCOPE_API_BASE = os.getenv("DASHSCOPE_API_BASE", "https://dashscope-intl.aliyuncs.com/compatible-mode/v1")
+
+
+def _dashscope():
+    import dashscope
+    dashscope.base_http_api_url = DASHSCOPE_HTTP_API_URL
+    return dashscope
+
+
+class DashScopeProvider:
+    name = "dashscope"
+
+    def chat_model(self, model, **params):
+        from langchain_qwq import ChatQwen
+        from .clients import get_llm_http_client
+        from .retry import PROVIDER_RETRIES
+
+        if not os.getenv("DASHSCOPE_API_KEY"):
+            logging.warning("⚠️ Please set your API_KEY")
+        params.setdefault("base_url", DASHSCOPE_API_BASE)
+        # The OpenAI client retries throttled and failed requests itself, with backoff and Retry-After.
+        params.setdefault("max_retries", PROVIDER_RETRIES)
+        return ChatQwen(model=model, http_client=get_llm_http_client(), **params)
+
+    @property
+    def multimodal_conversation(self):
+        return _dashscope().MultiModalConversation
+
+    @property
+    def video_synthesis(self):
+        return _dashscope().VideoSynthesis
+
+    def uploader(self):
+        from .references import DashScopeUploader
+        _dashscope()
+        return DashScopeUploader()
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def set_provider(provider):
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+
+def get_provider():
+    """Return the active provider, creating the one named by PROVIDER on first use."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if PROVIDER == "dashscope":
+                _provider = DashScopeProvider()
+            elif PROVIDER == "standin":
+                from .standin import StandInProvider
+                _provider = StandInProvider.from_env()
+            else:
+                raise ValueError(f"Unknown PROVIDER {PROVIDER!r}.")
+        return _provider
@@ -0,0 +1,317 @@
+"""Process-wide rate limits of provider calls, per model.
+
+Every model has its own quotas: a request rate and a number of requests
+or tasks that may be in flight at once. They are read from the JSON file
+at ``RATE_LIMITS_PATH``, keyed by model name::
+
+    {
+        "default": {"rps": 5, "concurrency": 8},
+        "qwen-image-plus": {"rps": 2, "burst": 2, "concurrency": 2},
+        "wan2.2-i2v-flash": {"rps": 1, "concurrency": 2, "adaptive": true, "max_concurrency": 8}
+    }
+
+``rps`` feeds a token bucket holding up to ``burst`` tokens (default:
+``max(1, rps)``) and ``concurrency`` bounds the calls in flight; a field
+that is left out is not limited. Models without an entry share the limits
+of ``default``, each with its own bucket and in-flight count. One limiter
+serves the whole process, so every node, thread and job of the service
+draws from the same quotas.
+
+With ``adaptive`` set, ``concurrency`` is only the starting point: an AIMD
+controller adds about one slot per ``concurrency`` successful calls, up to
+``max_concurrency`` (default: 4x the start), and multiplies the limit by
+``backoff`` (default 0.5, never below ``min_concurrency``) when the
+provider throttles a call or a call takes more than ``latency_spike``
+(default 2) times the usual latency. After a decrease, further signals
+are ignored for one usual latency, so a burst of 429s from calls that were
+already in flight halves the limit once.
+
+Chat models take a slot and a token through LangChain's ``rate_limiter``
+hook and give the slot back when the call ends, see ``chat_hooks``.
+Time spent waiting is counted on the enclosing trace span as
+``rate_limit_wait`` and kept per model, see ``RateLimiter.stats``.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from .retry import THROTTLED, as_provider_error
+from .tracing import count, instant, record
+
+# JSON file of per-model limits; set to an empty string to disable rate limiting.
+RATE_LIMITS_PATH = os.getenv("RATE_LIMITS_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rate_limits.json"))
+
+DEFAULT = "default"
+# Waits shorter than this are not counted as waits.
+_MIN_WAIT = 0.001
+# Waits shorter than this are not written to the trace.
+_TRACE_MIN_WAIT = 0.01
+# Weight of a new sample in the moving average of the latency.
+_LATENCY_WEIGHT = 0.1
+# Signals are ignored for at least this many seconds after a decrease.
+_MIN_COOLDOWN = 1.0
+# Seconds between checks for a free slot when waiting on an event loop.
+_ASYNC_POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """Hand out ``rate`` tokens per second, saving up to ``burst`` while idle."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going into debt queues callers in the order they arrived.
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class ModelLimit:
+    """The token bucket and in-flight limit of one model, with wait statistics."""
+
+    def __init__(self, model, rps=None, burst=None, concurrency=None, adaptive=False,
+                 min_concurrency=1, max_concurrency=None, backoff=0.5, latency_spike=2.0):
+        self.model = model
+        self.rps = rps
+        self.bucket = TokenBucket(rps, burst) if rps else None
+        self.adaptive = bool(adaptive and concurrency)
+        # A float, so that additive increases of 1/limit add up to one slot per window.
+        self.limit = float(concurrency) if concurrency else None
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max_concurrency or (4 * concurrency if concurrency else None)
+        self.backoff = backoff
+        self.latency_spike = latency_spike
+        self.latency = None
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+        self.freed = threading.Condition(self.lock)
+        self.calls = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttles = 0
+        self.latency_spikes = 0
+        self.decreases = 0
+
+    def acquire(self, blocking=True) -> bool:
+        """Wait for a free slot and a token; without ``blocking``, return False instead of waiting for a slot."""
+        start = time.time()
+        if self.limit is not None:
+            with self.freed:
+                while not self._take_slot():
+                    if not blocking:
+                        return False
+                    self.freed.wait()
+        delay = self.bucket.reserve() if self.bucket is not None else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        self._record(start, time.time())
+        return True
+
+    async def aacquire(self, blocking=True) -> bool:
+        """Like ``acquire``, but wait on the event loop rather than in a thread.
+
+        Waiting in executor threads could take every thread of the loop's
+        default executor, which the calls holding the slots need to finish.
+        """
+        import asyncio
+        start = time.time()
+        if self.limit is not None:
+            while True:
+                with self.freed:
+                    if self._take_slot():
+                        break
+                if not blocking:
+                    return False
+                await asyncio.sleep(_ASYNC_POLL_INTERVAL)
+        delay = self.bucket.reserve() if self.bucket is not None else 0.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._record(start, time.time())
+        return True
+
+    def _take_slot(self) -> bool:
+        # Called with the lock held.
+        if self.in_flight >= max(1, int(self.limit)):
+            return False
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def take_token(self):
+        """Wait for a token only, for calls whose end is not observed."""
+        start = time.time()
+        delay = self.bucket.reserve() if self.bucket is not None else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        self._record(start, time.time())
+
+    def release(self):
+        if self.limit is None:
+            return
+        with self.freed:
+            self.in_flight -= 1
+            self.freed.notify()
+
+    def on_success(self, latency: Optional[float] = None):
+        """Feed back a call that succeeded after ``latency`` seconds (None: not comparable, e.g. a queued task)."""
+        if not self.adaptive:
+            return
+        if latency is not None:
+            with self.lock:
+                usual = self.latency
+                self.latency = latency if usual is None else usual + _LATENCY_WEIGHT * (latency - usual)
+            if usual is not None and latency > self.latency_spike * usual:
+                self._decrease("slow", latency=round(latency, 3), usual=round(usual, 3))
+                return
+        with self.freed:
+            if time.monotonic() < self.cooldown_until:
+                return
+            before = int(self.limit)
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            if int(self.limit) > before:
+                self.freed.notify()
+                logging.debug(f"⚙️ Raised the concurrency of {self.model} to {int(self.limit)}.")
+
+    def on_throttle(self):
+        """Feed back a call the provider throttled."""
+        with self.lock:
+            self.throttles += 1
+        if self.adaptive:
+            self._decrease("throttled")
+
+    def _decrease(self, reason, **args):
+        with self.lock:
+            now = time.monotonic()
+            if reason == "slow":
+                self.latency_spikes += 1
+            if now < self.cooldown_until:
+                return
+            self.cooldown_until = now + max(_MIN_COOLDOWN, self.latency or 0.0)
+            before = self.limit
+            self.limit = max(float(self.min_concurrency), self.limit * self.backoff)
+            self.decreases += 1
+        instant("concurrency decrease", "rate_limit", model=self.model, reason=reason, limit=int(self.limit), **args)
+        logging.warning(f"⚠️ {self.model} was {reason}; lowered its concurrency from {int(before)} to {int(self.limit)}.")
+
+    def _record(self, start, end):
+        waited = end - start
+        with self.lock:
+            self.calls += 1
+            if waited >= _MIN_WAIT:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+        if waited >= _MIN_WAIT:
+            count(rate_limit_wait=round(waited, 3))
+        if waited >= _TRACE_MIN_WAIT:
+            record(f"rate limit {self.model}", "rate_limit", start, end, model=self.model)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "rps": self.rps,
+                "concurrency": int(self.limit) if self.limit is not None else None,
+                "adaptive": self.adaptive,
+                "calls": self.calls,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "mean_wait": round(self.wait_seconds / self.calls, 3) if self.calls else None,
+                "max_wait": round(self.max_wait, 3),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "throttles": self.throttles,
+                "latency_spikes": self.latency_spikes,
+                "decreases": self.decreases,
+                "latency": round(self.latency, 3) if self.latency is not None else None,
+            }
+
+
+class RateLimiter:
+    """Per-model limits, configured by a mapping of model name to the settings of ``ModelLimit``."""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config or {}
+        self.lock = threading.Lock()
+        self.limits = {}
+
+    @classmethod
+    def from_file(cls, path) -> "RateLimiter":
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        logging.info(f"⚙️ Loaded rate limits of {len(config)} models from {path}.")
+        return cls(config)
+
+    def get(self, model) -> ModelLimit:
+        with self.lock:
+            limit = self.limits.get(model)
+            if limit is None:
+                limit = ModelLimit(model, **self.config.get(model, self.config.get(DEFAULT, {})))
+                self.limits[model] = limit
+            return limit
+
+    @contextmanager
+    def limited(self, model):
+        """Hold one of ``model``'s slots and a token for the duration of a call, and feed back how it went."""
+        limit = self.get(model)
+        limit.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if as_provider_error(e).kind == THROTTLED:
+                limit.on_throttle()
+            raise
+        else:
+            limit.on_success(time.monotonic() - start)
+        finally:
+            limit.release()
+
+    def chat(self, model):
+        """Return the LangChain ``rate_limiter`` of ``model``, see ``chat_hooks``."""
+        from .chat_hooks import ChatRateLimiter
+        return ChatRateLimiter(self.get(model))
+
+    def stats(self) -> dict:
+        with self.lock:
+            limits = list(self.limits.values())
+        return {limit.model: limit.stats() for limit in limits}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter, loading RATE_LIMITS_PATH on first use; without it nothing is limited."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_file(RATE_LIMITS_PATH) if RATE_LIMITS_PATH and os.path.exists(RATE_LIMITS_PATH) else RateLimiter()
+        return _limiter
+
+
+def limited(model):
+    """``with limited(model): ...`` holds a slot and a token of ``model`` around a provider call."""
+    return get_rate_limiter().limited(model)
+
+
+def report_status(model, status_code):
+    """Feed back one HTTP response of ``model``, for calls whose client retries by itself."""
+    if model and status_code == 429:
+        get_rate_limiter().get(model).on_throttle()
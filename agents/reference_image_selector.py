@@ -1,23 +1,29 @@
-import getpass
 import os
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
-
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
-
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
+from .clients import get_chat_model
 from .state import VideoGenState
-from .utils import encode_file, image2image
-
-model = ChatQwen(
-    model="qwen3-vl-flash",
-    # other params...
-)
+from .utils import reference_image, image2image, IMAGE_MAX_CONCURRENCY, IMAGE_EDIT_MODEL
+from .artifact_cache import artifact_cache, artifact_key, file_digest
+from .scheduler import TaskGraph
+from .tracing import count
+from functools import partial
+import re
+import threading
+
+MODEL = "qwen3-vl-flash"
+# Pick the references of unambiguous frames by rule and only ask the model about the rest (0: always ask).
+REFERENCE_PRESELECT = os.getenv("REFERENCE_PRESELECT", "1") != "0"
+# Stands in for the model in the cache keys of selections made by rule; bump it when the rules change.
+PRESELECTOR = "rules-v1"
+# The multimodal model selects at most this many references.
+MAX_REFERENCE_IMAGES = 3
+# From this many candidates on, a text-only call narrows them down before the multimodal call.
+TEXT_FILTER_MIN_CANDIDATES = 8
+
+
+def get_model():
+    return get_chat_model(MODEL)
 
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -28,7 +34,7 @@ import json
 from pydantic import BaseModel, Field
 from typing import List, Optional, Literal, Tuple
 
-from .interfaces import ShotBriefDescription
+from .interfaces import ShotBriefDescription, ShotDescription, Camera
 
 system_prompt_template_select_reference_images_only_text = \
 """
@@ -161,7 +167,7 @@ def _select_reference_images_and_generate_prompt(available_image_path_and_text_p
                                                frame_description: str,):
     filtered_image_path_and_text_pairs = available_image_path_and_text_pairs
     # 1. filter images using text-only model
-    if len(available_image_path_and_text_pairs) >= 8:
+    if len(available_image_path_and_text_pairs) >= TEXT_FILTER_MIN_CANDIDATES:
         human_content = []
         for idx, (_, text) in enumerate(available_image_path_and_text_pairs):
             human_content.append({
@@ -179,7 +185,7 @@ def _select_reference_images_and_generate_prompt(available_image_path_and_text_p
             HumanMessage(content=human_content)
         ]
 
-        chain = model | parser
+        chain = get_model() | parser
 
         ref = chain.invoke(messages)
         filtered_image_path_and_text_pairs = [available_image_path_and_text_pairs[i] for i in ref.ref_image_indices]
@@ -193,7 +199,7 @@ def _select_reference_images_and_generate_prompt(available_image_path_and_text_p
         })
         human_content.append({
             "type": "image_url",
-            "image_url": {"url": encode_file(image_path)}
+            "image_url": {"url": reference_image(image_path, MODEL, http_only=True)}
         })
     human_content.append({
         "type": "text",
@@ -207,7 +213,7 @@ def _select_reference_images_and_generate_prompt(available_image_path_and_text_p
         HumanMessage(content=human_content)
     ]
 
-    chain = model | parser
+    chain = get_model() | parser
 
     response = chain.invoke(messages)       
     reference_image_path_and_text_pairs = [filtered_image_path_and_text_pairs[i] for i in response.ref_image_indices]
@@ -216,138 +222,276 @@ def _select_reference_images_and_generate_prompt(available_image_path_and_text_p
         "text_prompt": response.text_prompt,
     }
 
-def generate_frame_for_single_shot(image_output_path, selector_output_path, first_shot_ff_path_and_text_pair, frame_desc, visible_characters, character_portraits_registry):
-    if os.path.exists(image_output_path):
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？;；])\s*")
+# Phrases telling from which side a character is seen, for picking the portrait view.
+_VIEW_PATTERNS = {
+    view: re.compile(r"\b(?:" + "|".join(phrases) + r")\b", re.IGNORECASE)
+    for view, phrases in {
+        "back": [r"from behind", r"back view", r"rear view", r"(?:his|her|their) back to", r"back (?:to|toward|towards) the camera",
+                 r"facing away", r"turn(?:s|ed|ing)? away"],
+        "side": [r"in profile", r"profile view", r"side view", r"side-view", r"side profile", r"from the side", r"facing (?:left|right)"],
+        "front": [r"front view", r"front-view", r"frontal", r"(?:facing|faces|face) the camera", r"(?:looks|looking|gazes|gazing|stares|staring) (?:at|into) the camera"],
+    }.items()
+}
+# Framings where who is seen from where, or who is seen at all, is for the model to work out.
+_AMBIGUOUS_FRAMING = re.compile(r"\b(?:over[- ]the[- ]shoulder|point[- ]of[- ]view|pov|reflection|reflected|mirror|silhouette[sd]?)\b", re.IGNORECASE)
+
+
+class SelectionStats:
+    """How many frames had their references picked by rule, and the model calls that saved."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.preselected = 0
+        self.model_selected = 0
+        self.llm_calls_avoided = 0
+
+    def add(self, preselected, llm_calls):
+        with self.lock:
+            if preselected:
+                self.preselected += 1
+                self.llm_calls_avoided += llm_calls
+            else:
+                self.model_selected += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"preselected": self.preselected, "model_selected": self.model_selected,
+                    "llm_calls_avoided": self.llm_calls_avoided}
+
+
+selection_stats = SelectionStats()
+
+
+def _llm_calls(candidate_count):
+    """Model calls ``_select_reference_images_and_generate_prompt`` makes for this many candidates."""
+    return 2 if candidate_count >= TEXT_FILTER_MIN_CANDIDATES else 1
+
+
+def _character_view(frame_description, identifier, other_identifiers):
+    """Return the portrait view of a character, or None when the description does not settle it.
+
+    Only the sentences naming the character count; a character that is never
+    named can only be placed when it is the sole one in the frame.
+    """
+    sentences = [sentence for sentence in _SENTENCE_END.split(frame_description) if sentence.strip()]
+    mentions = [sentence for sentence in sentences if identifier.lower() in sentence.lower()]
+    if not mentions:
+        if other_identifiers:
+            return None
+        mentions = sentences
+    views = set()
+    for sentence in mentions:
+        found = {view for view, pattern in _VIEW_PATTERNS.items() if pattern.search(sentence)}
+        # With two characters in one sentence, which one faces where is not clear.
+        if found and any(other.lower() in sentence.lower() for other in other_identifiers):
+            return None
+        views |= found
+    if len(views) > 1:
+        return None
+    return views.pop() if views else "front"
+
+
+def _preselect_reference_images(frame_description, visible_characters, character_portraits_registry,
+                                prior_frame_path_and_text_pair, prior_frame_covers_frame):
+    """Pick the references of a simple frame without the model, or return None to leave it to the model.
+
+    A frame is simple when every visible character has one clear portrait view,
+    the prior frame from the camera tree (if any) fully covers the frame, and
+    all of them fit into the MAX_REFERENCE_IMAGES the model may pick.
+    """
+    if _AMBIGUOUS_FRAMING.search(frame_description):
+        return None
+    has_prior_frame = prior_frame_path_and_text_pair is not None
+    if has_prior_frame and not prior_frame_covers_frame:
+        return None
+    if not visible_characters and not has_prior_frame:
+        return None
+    if len(visible_characters) + has_prior_frame > MAX_REFERENCE_IMAGES:
+        return None
+
+    identifiers = [character.identifier_in_scene for character in visible_characters]
+    if len(set(identifier.lower() for identifier in identifiers)) < len(identifiers):
+        return None
+    reference_image_path_and_text_pairs = []
+    appearance = []
+    for identifier in identifiers:
+        view = _character_view(frame_description, identifier, [other for other in identifiers if other != identifier])
+        item = character_portraits_registry.get(identifier, {}).get(view) if view is not None else None
+        if item is None:
+            return None
+        appearance.append(f"{identifier}'s appearance should reference Image {len(reference_image_path_and_text_pairs)}.")
+        reference_image_path_and_text_pairs.append((item["path"], item["description"]))
+
+    if has_prior_frame:
+        text_prompt = f"Create an image based on the following guidance: \nMake modifications based on Image {len(reference_image_path_and_text_pairs)}, keeping its setting, lighting and style: {frame_description}"
+        reference_image_path_and_text_pairs.append(tuple(prior_frame_path_and_text_pair))
+    else:
+        text_prompt = f"Create an image following the given description: \n{frame_description}"
+    return {
+        "reference_image_path_and_text_pairs": reference_image_path_and_text_pairs,
+        "text_prompt": "\n".join([text_prompt] + appearance),
+    }
+
+
+def generate_frame_for_single_shot(image_output_path, selector_output_path, first_shot_ff_path_and_text_pair, frame_desc, visible_characters, character_portraits_registry,
+                                   prior_frame_covers_frame=True):
+    available_image_path_and_text_pairs = []
+    for visible_character in visible_characters:
+        identifier_in_scene = visible_character.identifier_in_scene
+        registry_item = character_portraits_registry[identifier_in_scene]
+        for view, item in registry_item.items():
+            available_image_path_and_text_pairs.append((item["path"], item["description"]))
+
+    if first_shot_ff_path_and_text_pair is not None:
+        available_image_path_and_text_pairs.append(first_shot_ff_path_and_text_pair)
+
+    # The rules are cheap and deterministic, so they run first and decide which selector the keys name.
+    preselected_output = None
+    if REFERENCE_PRESELECT:
+        preselected_output = _preselect_reference_images(frame_desc, visible_characters, character_portraits_registry,
+                                                          first_shot_ff_path_and_text_pair, prior_frame_covers_frame)
+    selector = PRESELECTOR if preselected_output is not None else MODEL
+
+    candidates = [(path, file_digest(path), text) for path, text in available_image_path_and_text_pairs]
+    # The selector output records reference paths, so its key includes them; the frame itself
+    # only depends on the content of the candidates and can be shared across runs.
+    image_key = artifact_key(IMAGE_EDIT_MODEL, selector, frame_desc, [(digest, text) for _, digest, text in candidates])
+    if artifact_cache.lookup(image_output_path, image_key):
         logging.info(f"🚀 Skipped generating frame, already exists.")
-        pass
+        return
+
+    selector_key = artifact_key(selector, frame_desc, candidates)
+    if artifact_cache.lookup(selector_output_path, selector_key):
+        with open(selector_output_path, 'r', encoding='utf-8') as f:
+            selector_output = json.load(f)
+        logging.info(f"🚀 Loaded existing reference image selection and prompt for frame from {selector_output_path}.")
     else:
-        available_image_path_and_text_pairs = []
-        for visible_character in visible_characters:
-            identifier_in_scene = visible_character.identifier_in_scene
-            registry_item = character_portraits_registry[identifier_in_scene]
-            for view, item in registry_item.items():
-                available_image_path_and_text_pairs.append((item["path"], item["description"]))
-
-        if first_shot_ff_path_and_text_pair is not None:
-            available_image_path_and_text_pairs.append(first_shot_ff_path_and_text_pair)
-
-        if os.path.exists(selector_output_path):
-            with open(selector_output_path, 'r', encoding='utf-8') as f:
-                selector_output = json.load(f)
-            logging.info(f"🚀 Loaded existing reference image selection and prompt for frame from {selector_output_path}.")
+        selection_stats.add(preselected_output is not None, _llm_calls(len(candidates)))
+        if preselected_output is not None:
+            selector_output = preselected_output
+            count(reference_llm_calls_avoided=_llm_calls(len(candidates)))
+            logging.info(f"⚙️ Picked {len(selector_output['reference_image_path_and_text_pairs'])} of {len(candidates)} reference images by rule, without {MODEL}.")
         else:
             selector_output = _select_reference_images_and_generate_prompt(
                     available_image_path_and_text_pairs=available_image_path_and_text_pairs,
                     frame_description=frame_desc
                 )
-            with open(selector_output_path, 'w', encoding='utf-8') as f:
-                json.dump(selector_output, f, ensure_ascii=False, indent=4)
-            logging.info(f"☑️ Selected reference images and generated prompt for frame, saved to {selector_output_path}.")
+        with open(selector_output_path, 'w', encoding='utf-8') as f:
+            json.dump(selector_output, f, ensure_ascii=False, indent=4)
+        artifact_cache.store(selector_output_path, selector_key)
+        logging.info(f"☑️ Selected reference images and generated prompt for frame, saved to {selector_output_path}.")
+
+    reference_image_path_and_text_pairs, prompt = selector_output["reference_image_path_and_text_pairs"], selector_output["text_prompt"]
+    prefix_prompt = ""
+    for i, (image_path, text) in enumerate(reference_image_path_and_text_pairs):
+        prefix_prompt += f"Image {i}: {text}\n"
+    prompt = f"{prefix_prompt}\n{prompt}"
+    reference_image_paths = [item[0] for item in reference_image_path_and_text_pairs]
+
+    image2image(prompt, reference_image_paths, image_output_path)
+    if os.path.exists(image_output_path):
+        artifact_cache.store(image_output_path, image_key)
+        logging.info(f"☑️ Generated frame, saved to {image_output_path}.")
 
+
+def _frame_task(image_output_path, selector_output_path, prior_frame_path_and_text_pair, frame_desc, visible_characters, character_portraits_registry, prior_frame_covers_frame=True):
+    generate_frame_for_single_shot(image_output_path, selector_output_path, prior_frame_path_and_text_pair, frame_desc, visible_characters, character_portraits_registry,
+                                   prior_frame_covers_frame)
     if not os.path.exists(image_output_path):
-        reference_image_path_and_text_pairs, prompt = selector_output["reference_image_path_and_text_pairs"], selector_output["text_prompt"]
-        prefix_prompt = ""
-        for i, (image_path, text) in enumerate(reference_image_path_and_text_pairs):
-            prefix_prompt += f"Image {i}: {text}\n"
-        prompt = f"{prefix_prompt}\n{prompt}"
-        reference_image_paths = [item[0] for item in reference_image_path_and_text_pairs]
-
-        image2image(prompt, reference_image_paths, image_output_path)
-        logging.info(f"☑️ Generated frame, saved to {image_output_path}.")
+        raise RuntimeError(f"Failed to generate frame {image_output_path}.")
+
+
+def _parent_shot_idx(camera: Camera, cameras: Dict[int, Camera], shot_descriptions: List[ShotDescription]) -> Optional[int]:
+    """Return the shot whose first frame the camera's first frame is derived from, if usable."""
+    parent_shot_idx = camera.parent_shot_idx
+    if parent_shot_idx is None or not 0 <= parent_shot_idx < len(shot_descriptions):
+        return None
+    # Walk up the camera tree; a parent chain leading back to this camera would deadlock.
+    seen = {camera.idx}
+    cam_idx = shot_descriptions[parent_shot_idx].cam_idx
+    while cam_idx is not None:
+        if cam_idx in seen:
+            logging.warning(f"⚠️ Ignoring cyclic parent shot {parent_shot_idx} of camera {camera.idx}.")
+            return None
+        seen.add(cam_idx)
+        parent = cameras.get(cam_idx)
+        if parent is None or parent.parent_shot_idx is None or not 0 <= parent.parent_shot_idx < len(shot_descriptions):
+            break
+        cam_idx = shot_descriptions[parent.parent_shot_idx].cam_idx
+    return parent_shot_idx
+
+
+def add_scene_frame_tasks(graph: TaskGraph, state: VideoGenState, idx: int, shot_descriptions: List[ShotDescription], camera_tree: List[Camera]):
+    """Register the first/last frames of one scene on ``graph``.
+
+    Task names are ``(scene_idx, shot_idx, "first" | "last")``. A frame only
+    waits for the exact frame it uses as a reference:
+    - the first frame of a camera's first shot waits for the first frame of the camera's parent shot;
+    - the first frame of any later shot waits for the first frame of its camera's first shot;
+    - the last frame of a later shot waits for the shot's own first frame.
+    Every frame is scheduled; frames that are still up to date return immediately
+    from their task, since a frame's cache key depends on the frames it references.
+    """
+    scene_root = os.path.join(state['cache_dir'], f"scene_{idx}")
+    cameras = {camera.idx: camera for camera in camera_tree}
+    scheduled_shot_idxs = {shot_idx for camera in camera_tree for shot_idx in camera.active_shot_idxs}
+    # Characters keep their idx across story edits, so it need not match their position in the list.
+    characters = {character.idx: character for character in state["character_desc"]}
+
+    def frame_path(shot_idx, kind):
+        return os.path.join(scene_root, f"shot_{shot_idx}", f"{kind}_frame.png")
+
+    def add(shot_idx, kind, prior_shot_idx, desc, vis_char_idxs, prior_frame_covers_frame=True):
+        path = frame_path(shot_idx, kind)
+        deps = []
+        prior_frame_path_and_text_pair = None
+        if prior_shot_idx is not None:
+            prior_frame_path_and_text_pair = (frame_path(prior_shot_idx, "first"), shot_descriptions[prior_shot_idx].ff_desc)
+            if prior_shot_idx in scheduled_shot_idxs:
+                deps.append((idx, prior_shot_idx, "first"))
+        selector_output_path = os.path.join(scene_root, f"shot_{shot_idx}", f"{kind}_frame_selector_output.json")
+        visible_characters = [characters[char_idx] for char_idx in vis_char_idxs]
+        graph.add((idx, shot_idx, kind), partial(_frame_task, path, selector_output_path, prior_frame_path_and_text_pair, desc, visible_characters, state["character_images"],
+                                                    prior_frame_covers_frame), deps)
+
+    for camera in camera_tree:
+        first_shot_idx = camera.active_shot_idxs[0]
+        first_shot = shot_descriptions[first_shot_idx]
+        # A parent shot from another camera may miss part of the frame; frames of the same camera do not.
+        add(first_shot_idx, "first", _parent_shot_idx(camera, cameras, shot_descriptions), first_shot.ff_desc, first_shot.ff_vis_char_idxs,
+            camera.is_parent_fully_covers_child is not False)
+        if first_shot.variation_type in ["medium", "large"]:
+            add(first_shot_idx, "last", None, first_shot.lf_desc, first_shot.lf_vis_char_idxs)
+
+        for shot_idx in camera.active_shot_idxs[1:]:
+            shot = shot_descriptions[shot_idx]
+            add(shot_idx, "first", first_shot_idx, shot.ff_desc, shot.ff_vis_char_idxs)
+            if shot.variation_type in ["medium", "large"]:
+                add(shot_idx, "last", shot_idx, shot.lf_desc, shot.lf_vis_char_idxs)
+
+
+def run_frame_tasks(graph: TaskGraph, on_done=None):
+    results = graph.run(max_workers=IMAGE_MAX_CONCURRENCY, on_done=on_done)
+    for (idx, shot_idx, kind), error in sorted(results.items()):
+        if error is None:
+            logging.info(f"☑️ Generated {kind}_frame for scene {idx} shot {shot_idx}.")
+    failed = [name for name, error in results.items() if error is not None]
+    if failed:
+        raise RuntimeError(f"Failed to generate frames {sorted(failed)}; completed frames are kept for the next run.")
+
+
+def generate_frames_for_scene(state: VideoGenState, idx: int, shot_descriptions: List[ShotDescription], camera_tree: List[Camera]):
+    graph = TaskGraph()
+    add_scene_frame_tasks(graph, state, idx, shot_descriptions, camera_tree)
+    run_frame_tasks(graph)
+
 
-        
 def select_reference_images_and_generate_prompt(state: VideoGenState) -> VideoGenState:
+    # One graph for all scenes, so frames of different scenes also run concurrently.
+    graph = TaskGraph()
     for idx, script in enumerate(state["scene_desc"]):
-        scene_root = os.path.join(state['cache_dir'], f"scene_{idx}")
-        for j, camera in enumerate(state["camera_tree"][idx]):
-            first_shot_idx = camera.active_shot_idxs[0]
-            first_shot_ff_path = os.path.join(scene_root, f"shot_{first_shot_idx}", "first_frame.png")
-            ff_selector_output_path = os.path.join(scene_root, f"shot_{first_shot_idx}", "first_frame_selector_output.json")
-            logging.info(f"🖼️ Starting first_frame generation for shot {first_shot_idx}...")
-            generate_frame_for_single_shot(first_shot_ff_path, ff_selector_output_path, None, state["shot_descriptions"][idx][first_shot_idx].ff_desc, [state["character_desc"][idx] for idx in state["shot_descriptions"][idx][first_shot_idx].ff_vis_char_idxs], state["character_images"])
-            # if os.path.exists(first_shot_ff_path):
-            #     pass
-            # else:
-            #     available_image_path_and_text_pairs = []
-
-            #     for character_idx in state["shot_descriptions"][idx][first_shot_idx].ff_vis_char_idxs:
-            #         identifier_in_scene = state["character_desc"][character_idx].identifier_in_scene
-            #         registry_item = state["character_images"][identifier_in_scene]
-            #         for view, item in registry_item.items():
-            #             available_image_path_and_text_pairs.append((item["path"], item["description"]))
-            #     if first_shot_ff_path_and_text_pair is not None:
-            #         available_image_path_and_text_pairs.append(first_shot_ff_path_and_text_pair)
-
-            #     ff_selector_output_path = os.path.join(scene_root, f"shot_{first_shot_idx}", "first_frame_selector_output.json")
-            #     if os.path.exists(ff_selector_output_path):
-            #         with open(ff_selector_output_path, 'r', encoding='utf-8') as f:
-            #             ff_selector_output = json.load(f)
-            #     else:
-            #         ff_selector_output = _select_reference_images_and_generate_prompt(
-            #             available_image_path_and_text_pairs=available_image_path_and_text_pairs,
-            #             frame_description=state["shot_descriptions"][idx][first_shot_idx].ff_desc
-            #         )
-            #         with open(ff_selector_output_path, 'w', encoding='utf-8') as f:
-            #             json.dump(ff_selector_output, f, ensure_ascii=False, indent=4)
-
-            # if not os.path.exists(first_shot_ff_path):
-            #     reference_image_path_and_text_pairs, prompt = ff_selector_output["reference_image_path_and_text_pairs"], ff_selector_output["text_prompt"]
-            #     prefix_prompt = ""
-            #     for i, (image_path, text) in enumerate(reference_image_path_and_text_pairs):
-            #         prefix_prompt += f"Image {i}: {text}\n"
-            #     prompt = f"{prefix_prompt}\n{prompt}"
-            #     reference_image_paths = [item[0] for item in reference_image_path_and_text_pairs]
-
-            #     image2image(prompt, reference_image_paths, first_shot_ff_path)
-
-            if state["shot_descriptions"][idx][first_shot_idx].variation_type in ["medium", "large"]:
-                last_shot_ff_path = os.path.join(scene_root, f"shot_{first_shot_idx}", "last_frame.png")
-                lf_selector_output_path = os.path.join(scene_root, f"shot_{first_shot_idx}", "last_frame_selector_output.json")
-                logging.info(f"🖼️ Starting last_frame generation for shot {first_shot_idx}...")
-                generate_frame_for_single_shot(last_shot_ff_path, lf_selector_output_path, None, state["shot_descriptions"][idx][first_shot_idx].lf_desc, [state["character_desc"][idx] for idx in state["shot_descriptions"][idx][first_shot_idx].lf_vis_char_idxs], state["character_images"])
-
-            for shot_idx in camera.active_shot_idxs[1:]:
-                shot_path = os.path.join(scene_root, f"shot_{shot_idx}", "first_frame.png")
-                ff_selector_output_path = os.path.join(scene_root, f"shot_{shot_idx}", "first_frame_selector_output.json")
-                logging.info(f"🖼️ Starting first_frame generation for shot {shot_idx}...")
-                generate_frame_for_single_shot(shot_path, ff_selector_output_path, (first_shot_ff_path, state["shot_descriptions"][idx][first_shot_idx].ff_desc), state["shot_descriptions"][idx][shot_idx].ff_desc, [state["character_desc"][idx] for idx in state["shot_descriptions"][idx][shot_idx].ff_vis_char_idxs], state["character_images"])
-                if state["shot_descriptions"][idx][shot_idx].variation_type in ["medium", "large"]:
-                    last_shot_path = os.path.join(scene_root, f"shot_{shot_idx}", "last_frame.png")
-                    lf_selector_output_path = os.path.join(scene_root, f"shot_{shot_idx}", "last_frame_selector_output.json")
-                    logging.info(f"🖼️ Starting last_frame generation for shot {shot_idx}...")
-                    generate_frame_for_single_shot(last_shot_path, lf_selector_output_path, (shot_path, state["shot_descriptions"][idx][shot_idx].ff_desc), state["shot_descriptions"][idx][shot_idx].lf_desc, [state["character_desc"][idx] for idx in state["shot_descriptions"][idx][shot_idx].lf_vis_char_idxs], state["character_images"])
-                    
-                # if os.path.exists(shot_path):
-                #     pass
-                # else:
-                #     available_image_path_and_text_pairs = []
-
-                #     for character_idx in state["shot_descriptions"][idx][shot_idx].ff_vis_char_idxs:
-                #         identifier_in_scene = state["character_desc"][character_idx].identifier_in_scene
-                #         registry_item = state["character_images"][identifier_in_scene]
-                #         for view, item in registry_item.items():
-                #             available_image_path_and_text_pairs.append((item["path"], item["description"]))
-    
-                #     ff_selector_output_path = os.path.join(scene_root, f"shot_{shot_idx}", "first_frame_selector_output.json")
-                #     if os.path.exists(ff_selector_output_path):
-                #         with open(ff_selector_output_path, 'r', encoding='utf-8') as f:
-                #             ff_selector_output = json.load(f)
-                #     else:
-                #         ff_selector_output = _select_reference_images_and_generate_prompt(
-                #             available_image_path_and_text_pairs=available_image_path_and_text_pairs,
-                #             frame_description=state["shot_descriptions"][idx][shot_idx].ff_desc
-                #         )
-                #         with open(ff_selector_output_path, 'w', encoding='utf-8') as f:
-                #             json.dump(ff_selector_output, f, ensure_ascii=False, indent=4)
-                # if not os.path.exists(shot_path):
-                #     reference_image_path_and_text_pairs, prompt = ff_selector_output["reference_image_path_and_text_pairs"], ff_selector_output["text_prompt"]
-                #     prefix_prompt = ""
-                #     for i, (image_path, text) in enumerate(reference_image_path_and_text_pairs):
-                #         prefix_prompt += f"Image {i}: {text}\n"
-                #     prompt = f"{prefix_prompt}\n{prompt}"
-                #     reference_image_paths = [item[0] for item in reference_image_path_and_text_pairs]
-    
-                #     image2image(prompt, reference_image_paths, shot_path)
-                    
-
-    return state
\ No newline at end of file
+        add_scene_frame_tasks(graph, state, idx, state["shot_descriptions"][idx], state["camera_tree"][idx])
+    run_frame_tasks(graph)
+
+    return state
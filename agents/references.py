@@ -0,0 +1,181 @@
+"""How reference images are attached to generation requests.
+
+The same character portraits and first frames are referenced by many shots.
+Their base64 encodings are kept in a bounded in-memory cache keyed by path,
+size and mtime, so each file is read and encoded once per change rather than
+once per request. Optionally, each image is instead uploaded once and the
+request carries only the returned URL, which keeps megabytes of base64 out
+of every payload.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .artifact_cache import file_digest
+
+# Byte budget of the cache of base64-encoded reference images.
+ENCODE_CACHE_MAX_BYTES = int(os.getenv("ENCODE_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+# "1" uploads each reference image once to the active provider's temporary storage
+# and sends its URL ("dashscope" or "standin" pick the storage explicitly); empty sends base64.
+REFERENCE_UPLOAD = os.getenv("REFERENCE_UPLOAD", "")
+# Uploads are reused for this many seconds; DashScope keeps them for 48 hours.
+REFERENCE_UPLOAD_TTL = float(os.getenv("REFERENCE_UPLOAD_TTL", str(24 * 3600)))
+
+
+class EncodingCache:
+    """LRU cache of encoded files, bounded by the total length of the encodings."""
+
+    def __init__(self, max_bytes=ENCODE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_encoded = 0
+
+    def get(self, path, encode):
+        """Return ``encode(path)``, reusing the previous result while the file is unchanged."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = encode(path)
+        with self.lock:
+            self.bytes_encoded += len(value)
+            if len(value) <= self.max_bytes and key not in self.entries:
+                self.entries[key] = value
+                self.size += len(value)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return value
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = self.misses = self.bytes_encoded = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                    "bytes": self.size, "bytes_encoded": self.bytes_encoded}
+
+
+class DashScopeUploader:
+    """Upload files to DashScope's temporary storage; the ``oss://`` URLs are valid for 48 hours.
+
+    Only the DashScope SDK resolves these URLs, so they are not used for the
+    OpenAI-compatible chat endpoint.
+    """
+
+    http_urls = False
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
+        self.certificates = {}
+        self.lock = threading.Lock()
+
+    def upload(self, path, model):
+        from dashscope.utils.oss_utils import OssUtils
+
+        with self.lock:
+            certificate = self.certificates.get(model)
+        try:
+            url, certificate = OssUtils.upload(model=model, file_path=path, api_key=self.api_key, upload_certificate=certificate)
+        except Exception:
+            if certificate is None:
+                raise
+            # The reused certificate may have expired; ask for a new one.
+            url, certificate = OssUtils.upload(model=model, file_path=path, api_key=self.api_key)
+        with self.lock:
+            self.certificates[model] = certificate
+        return url
+
+
+class ReferenceUploads:
+    """Upload each distinct reference image once per model and hand out its URL."""
+
+    def __init__(self, uploader, ttl=REFERENCE_UPLOAD_TTL):
+        self.uploader = uploader
+        self.ttl = ttl
+        self.urls = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.uploads = 0
+        self.reuses = 0
+        self.bytes_uploaded = 0
+
+    def url(self, path, model):
+        digest = file_digest(path)
+        key = (digest, model)
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        # Concurrent shots referencing the same portrait wait for a single upload.
+        with key_lock:
+            with self.lock:
+                entry = self.urls.get(key)
+                if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                    self.reuses += 1
+                    return entry[0]
+
+            # Upload under a content-derived name: storage keys are built from the
+            # file name, and every character has its own front.png.
+            with tempfile.TemporaryDirectory(prefix="videoagent_upload_") as tmp_dir:
+                named_path = os.path.join(tmp_dir, digest + os.path.splitext(path)[1])
+                shutil.copyfile(path, named_path)
+                url = self.uploader.upload(named_path, model)
+            logging.info(f"📤 Uploaded reference image {path} for {model}.")
+            with self.lock:
+                self.urls[key] = (url, time.monotonic())
+                self.uploads += 1
+                self.bytes_uploaded += os.path.getsize(path)
+            return url
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"uploads": self.uploads, "reuses": self.reuses, "bytes_uploaded": self.bytes_uploaded}
+
+
+encoding_cache = EncodingCache()
+
+_uploads = None
+_uploads_lock = threading.Lock()
+
+
+def set_uploader(uploader):
+    """Send reference images as URLs from ``uploader`` (None: inline base64)."""
+    global _uploads
+    with _uploads_lock:
+        _uploads = ReferenceUploads(uploader) if uploader is not None else None
+
+
+def get_uploads():
+    """Return the upload registry selected by REFERENCE_UPLOAD, or None when uploads are off."""
+    global _uploads
+    with _uploads_lock:
+        if _uploads is None and REFERENCE_UPLOAD:
+            if REFERENCE_UPLOAD == "1":
+                from .providers import get_provider
+                uploader = get_provider().uploader()
+            elif REFERENCE_UPLOAD == "dashscope":
+                uploader = DashScopeUploader()
+            elif REFERENCE_UPLOAD == "standin":
+                from .standin import StandInUploader
+                uploader = StandInUploader()
+            else:
+                raise ValueError(f"Unknown REFERENCE_UPLOAD {REFERENCE_UPLOAD!r}.")
+            _uploads = ReferenceUploads(uploader)
+        return _uploads
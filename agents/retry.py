@@ -0,0 +1,178 @@
+"""Retries and failure classification for provider calls.
+
+Every failed generation request is sorted into one of four kinds:
+
+- ``throttled``: the provider asked us to slow down (HTTP 429, ``Throttling.*``)
+- ``transient``: a server error, timeout or dropped connection that may not recur
+- ``rejected``: content moderation refused the prompt or an input image
+- ``permanent``: anything else, such as a malformed request or a bad API key
+
+Throttled and transient failures are retried with jittered exponential
+backoff, waiting at least as long as a ``Retry-After`` header asks;
+rejected and permanent ones fail at once, since repeating the same request
+cannot succeed. The final failure is raised as a ``ProviderError`` whose
+``kind`` callers report as the status of the shot or image.
+"""
+import logging
+import os
+import random
+import time
+from http import HTTPStatus
+from typing import Optional
+
+import httpx
+
+from .tracing import count, instant
+
+# Retries of a throttled or transient provider call after the first attempt.
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", "4"))
+# Backoff before retry n is drawn from [0, min(PROVIDER_BACKOFF_MAX, PROVIDER_BACKOFF_BASE * 2 ** n)] seconds.
+PROVIDER_BACKOFF_BASE = float(os.getenv("PROVIDER_BACKOFF_BASE", "2"))
+PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", "60"))
+
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+REJECTED = "rejected"
+PERMANENT = "permanent"
+
+RETRYABLE = (THROTTLED, TRANSIENT)
+
+# DashScope error codes of content moderation.
+_REJECTED_CODES = ("DataInspectionFailed", "data_inspection_failed", "IPInfringementSuspect")
+_TRANSIENT_CODES = ("InternalError", "SystemError", "ServiceUnavailable", "RequestTimeOut", "Timeout")
+
+
+class ProviderError(RuntimeError):
+    """A provider request that failed for good, with the kind of failure it was."""
+
+    def __init__(self, kind, message, status_code=None, code=None, request_id=None, retry_after=None, attempts=1):
+        super().__init__(message)
+        self.kind = kind
+        self.status_code = status_code
+        self.code = code
+        self.request_id = request_id
+        self.retry_after = retry_after
+        self.attempts = attempts
+
+    @property
+    def retryable(self):
+        return self.kind in RETRYABLE
+
+
+def classify(status_code=None, code=None) -> str:
+    """Return the kind of failure of a response with ``status_code`` and error ``code``."""
+    code = code or ""
+    if status_code == HTTPStatus.TOO_MANY_REQUESTS or code.startswith("Throttling"):
+        return THROTTLED
+    if code in _REJECTED_CODES or "DataInspection" in code:
+        return REJECTED
+    if code.startswith(_TRANSIENT_CODES):
+        return TRANSIENT
+    # A task that failed without saying why is worth another try.
+    if status_code is None or status_code >= 500 or status_code == HTTPStatus.REQUEST_TIMEOUT:
+        return TRANSIENT
+    return PERMANENT
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = (headers or {}).get("Retry-After") or (headers or {}).get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # An HTTP date; honour it roughly rather than parsing it.
+        return PROVIDER_BACKOFF_MAX
+
+
+def check_response(rsp, what):
+    """Raise a ``ProviderError`` unless the DashScope-style response ``rsp`` succeeded."""
+    if rsp.status_code == HTTPStatus.OK:
+        return rsp
+    code = getattr(rsp, "code", None)
+    raise ProviderError(
+        classify(int(rsp.status_code), code),
+        f"{what} failed, status_code: {rsp.status_code}, code: {code}, message: {getattr(rsp, 'message', None)}",
+        status_code=int(rsp.status_code),
+        code=code,
+        request_id=getattr(rsp, "request_id", None),
+        retry_after=_retry_after(getattr(rsp, "headers", None)),
+    )
+
+
+def check_task(rsp, what):
+    """Like ``check_response``, but also raise unless the video task in ``rsp`` has SUCCEEDED."""
+    check_response(rsp, what)
+    output = rsp.output
+    if output.task_status == "SUCCEEDED":
+        return rsp
+    code = getattr(output, "code", None) or getattr(rsp, "code", None) or None
+    message = getattr(output, "message", None) or getattr(rsp, "message", None)
+    raise ProviderError(
+        classify(None, code),
+        f"{what} ended with {output.task_status}, code: {code}, message: {message}",
+        code=code,
+        request_id=getattr(rsp, "request_id", None),
+    )
+
+
+def as_provider_error(e: BaseException) -> ProviderError:
+    """Classify an exception raised by a provider SDK or HTTP client."""
+    if isinstance(e, ProviderError):
+        return e
+    status_code = getattr(e, "status_code", None)
+    response = getattr(e, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    code = getattr(e, "code", None)
+    code = code if isinstance(code, str) else None
+    if status_code is not None:
+        kind = classify(int(status_code), code)
+    elif isinstance(e, (OSError, httpx.TransportError)):
+        # Connection errors and timeouts, including those of requests, which subclass OSError.
+        kind = TRANSIENT
+    else:
+        kind = PERMANENT
+    return ProviderError(
+        kind,
+        f"{type(e).__name__}: {e}",
+        status_code=status_code,
+        code=code,
+        retry_after=_retry_after(getattr(response, "headers", None)),
+    )
+
+
+def backoff(retry, retry_after=None, base=None, maximum=None) -> float:
+    """Seconds to wait before retry number ``retry`` (0-based): full jitter, but never less than ``retry_after``."""
+    base = PROVIDER_BACKOFF_BASE if base is None else base
+    maximum = PROVIDER_BACKOFF_MAX if maximum is None else maximum
+    delay = random.uniform(0, min(maximum, base * 2 ** retry))
+    return max(delay, retry_after or 0.0)
+
+
+def call_with_retry(fn, what, retries=None, on_throttle=None):
+    """Call ``fn()`` until it succeeds, retrying throttled and transient failures.
+
+    ``fn`` signals failure by raising; exceptions that are not a
+    ``ProviderError`` are classified with ``as_provider_error``. The last
+    failure is raised as a ``ProviderError`` with ``attempts`` set.
+    ``on_throttle()`` is called after every throttled attempt.
+    """
+    retries = PROVIDER_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            error = as_provider_error(e)
+            error.attempts = attempt + 1
+            if error.kind == THROTTLED and on_throttle is not None:
+                on_throttle()
+            if not error.retryable or attempt == retries:
+                if error is not e:
+                    raise error from e
+                raise
+            delay = backoff(attempt, error.retry_after)
+            count(retries=1)
+            instant("retry", "provider", what=what, kind=error.kind, attempt=attempt + 1, delay=round(delay, 3))
+            logging.warning(f"⚠️ {what} was {error.kind} (attempt {attempt + 1}/{retries + 1}), retrying in {delay:.1f}s: {error}")
+            time.sleep(delay)
@@ -0,0 +1,84 @@
+import os
+import logging
+from typing import List
+from langgraph.types import Send
+from .storyboard_writer import design_storyboard_for_scene
+from .shot_writer import design_shot_for_scene
+from .camera_manager import construct_camera_tree_for_scene
+from .reference_image_selector import generate_frames_for_scene, add_scene_frame_tasks, run_frame_tasks
+from .video_generator import generate_videos_for_scene, VideoStream
+from .scheduler import TaskGraph
+from .state import VideoGenState, SceneState
+from .tracing import span
+
+# Start synthesizing a shot's video as soon as its frames exist instead of after all frames of the scene.
+PIPELINE_STREAMING = os.getenv("PIPELINE_STREAMING", "1") not in ("0", "false", "False")
+
+
+def fan_out_scenes(state: VideoGenState):
+    # Reset the per-scene lists so that results of a previous run on the same thread
+    # (possibly with more scenes) do not leak into this one.
+    num_scenes = len(state["scene_desc"])
+    return {
+        "story_board": [None] * num_scenes,
+        "shot_descriptions": [None] * num_scenes,
+        "camera_tree": [None] * num_scenes,
+    }
+
+
+def dispatch_scenes(state: VideoGenState) -> List[Send]:
+    return [Send("process_scene", {**state, "scene_idx": idx}) for idx in range(len(state["scene_desc"]))]
+
+
+def generate_frames_and_videos_for_scene(state: VideoGenState, idx: int, shot_descriptions, camera_tree):
+    """Generate the frames of a scene and hand each shot to video synthesis as soon as its frames are done."""
+    graph = TaskGraph()
+    add_scene_frame_tasks(graph, state, idx, shot_descriptions, camera_tree)
+    remaining = {}
+    for (_, shot_idx, _) in graph.tasks:
+        remaining[shot_idx] = remaining.get(shot_idx, 0) + 1
+
+    stream = VideoStream()
+
+    def on_done(name, error):
+        _, shot_idx, _ = name
+        if error is not None:
+            # The shot has no complete set of frames; leave it for the next run.
+            remaining.pop(shot_idx, None)
+        elif shot_idx in remaining:
+            remaining[shot_idx] -= 1
+            if remaining[shot_idx] == 0:
+                del remaining[shot_idx]
+                stream.put(state, idx, shot_idx, shot_descriptions[shot_idx])
+
+    try:
+        run_frame_tasks(graph, on_done=on_done)
+    finally:
+        stream.close()
+
+
+def process_scene(state: SceneState):
+    """Run storyboard → shots → camera tree → frames → videos for one scene."""
+    idx = state["scene_idx"]
+    logging.info(f"🎬 Starting scene {idx}...")
+    with span(f"storyboard {idx}", scene=idx):
+        story_board = design_storyboard_for_scene(state, idx)
+    with span(f"shots {idx}", scene=idx, shots=len(story_board)):
+        shot_descriptions = design_shot_for_scene(state, idx, story_board)
+    with span(f"camera tree {idx}", scene=idx):
+        camera_tree = construct_camera_tree_for_scene(state, idx, shot_descriptions)
+    if PIPELINE_STREAMING:
+        with span(f"frames and videos {idx}", scene=idx):
+            generate_frames_and_videos_for_scene(state, idx, shot_descriptions, camera_tree)
+    else:
+        with span(f"frames {idx}", scene=idx):
+            generate_frames_for_scene(state, idx, shot_descriptions, camera_tree)
+        with span(f"videos {idx}", scene=idx):
+            generate_videos_for_scene(state, idx, shot_descriptions)
+    logging.info(f"☑️ Completed scene {idx}.")
+
+    return {
+        "story_board": {idx: story_board},
+        "shot_descriptions": {idx: shot_descriptions},
+        "camera_tree": {idx: camera_tree},
+    }
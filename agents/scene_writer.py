@@ -1,25 +1,16 @@
-import getpass
 import os
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
+from .clients import get_chat_model
+from .state import VideoGenState
+from .artifact_cache import artifact_cache, artifact_key
+from .incremental import INCREMENTAL_REGEN, load_applied_story, save_applied_story, changed_passages, relocate_scenes
 
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-flash"
 
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
-from .state import VideoGenState
 
-model = ChatQwen(
-    model="qwen-flash",
-    max_tokens=3_000,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+def get_model():
+    return get_chat_model(MODEL, max_tokens=3_000, timeout=None, max_retries=2)
 
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -73,31 +64,68 @@ human_prompt_template_write_script_based_on_story = \
 </USER_REQUIREMENT>
 """
 
+human_prompt_template_revise_script = \
+"""
+The story is a revision of an earlier version, which was adapted into this script:
+
+<PREVIOUS_SCRIPT>
+{previous_script}
+</PREVIOUS_SCRIPT>
+
+These passages of the story are new or rewritten:
+
+<CHANGED_PASSAGES>
+{changed_passages}
+</CHANGED_PASSAGES>
+
+Copy every scene of the previous script whose part of the story did not change exactly as it is, character for character. Only rewrite, add or remove the scenes the changed passages require.
+"""
+
+class WriteScriptBasedOnStoryResponse(BaseModel):
+    script: List[str] = Field(
+        ...,
+        description="The script based on the story. Each element is a scene "
+    )
+
+
 def write_script_based_on_story(state: VideoGenState) -> VideoGenState:
     save_path = os.path.join(state['cache_dir'], "script.json")
+    parser = PydanticOutputParser(pydantic_object=WriteScriptBasedOnStoryResponse)
+    format_instructions = parser.get_format_instructions()
+
+    messages = [
+        ("system", system_prompt_template_write_script_based_on_story.format(format_instructions=format_instructions)),
+        ("human", human_prompt_template_write_script_based_on_story.format(story=state["story"], user_requirement=state["user_requirement"])),
+    ]
+    key = artifact_key(MODEL, messages)
+    # Read before the lookup, which removes the file if the story has changed.
+    previous_script = None
     if os.path.exists(save_path):
+        with open(save_path, "r", encoding="utf-8") as f:
+            previous_script = json.load(f)
+    if artifact_cache.lookup(save_path, key):
         with open(save_path, "r", encoding="utf-8") as f:
             state["scene_desc"] = json.load(f)
+        save_applied_story(state['cache_dir'], state["story"])
         logging.info(f"🚀 Loaded script from existing file.")
         return state
     else:
-        class WriteScriptBasedOnStoryResponse(BaseModel):
-                script: List[str] = Field(
-                    ...,
-                    description="The script based on the story. Each element is a scene "
-                )
-    
-        parser = PydanticOutputParser(pydantic_object=WriteScriptBasedOnStoryResponse)
-        format_instructions = parser.get_format_instructions()
-    
-        messages = [
-            ("system", system_prompt_template_write_script_based_on_story.format(format_instructions=format_instructions)),
-            ("human", human_prompt_template_write_script_based_on_story.format(story=state["story"], user_requirement=state["user_requirement"])),
-        ]
-        response = model.invoke(messages)
+        previous_story = load_applied_story(state['cache_dir']) if INCREMENTAL_REGEN else None
+        incremental = previous_script is not None and previous_story is not None and previous_story != state["story"]
+        if incremental:
+            messages.append(("human", human_prompt_template_revise_script.format(
+                previous_script=json.dumps(previous_script, ensure_ascii=False, indent=4),
+                changed_passages=changed_passages(previous_story, state["story"]),
+            )))
+        response = get_model().invoke(messages)
         response = parser.parse(response.content)
         state["scene_desc"] = response.script
         with open(save_path, "w", encoding="utf-8") as f:
             json.dump(state["scene_desc"], f, ensure_ascii=False, indent=4)
+        artifact_cache.store(save_path, key)
+        if INCREMENTAL_REGEN and previous_script is not None:
+            changed = relocate_scenes(state['cache_dir'], previous_script, state["scene_desc"])
+            logging.info(f"♻️ Story edit changed scenes {changed} of {len(state['scene_desc'])}.")
+        save_applied_story(state['cache_dir'], state["story"])
         logging.info(f"✅ Written script based on story and saved to {save_path}.")
-        return state
\ No newline at end of file
+        return state
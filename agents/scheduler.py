@@ -0,0 +1,74 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Hashable, Iterable, Optional
+from .tracing import in_context, span
+
+
+class DependencyFailed(Exception):
+    """Raised in place of running a task whose dependency failed."""
+
+
+class TaskGraph:
+    """A small DAG executor.
+
+    Tasks are added with the names of the tasks they depend on and are started
+    on a thread pool as soon as all of their dependencies have succeeded. A
+    failed task does not stop independent tasks; its dependents are skipped
+    and reported with ``DependencyFailed``.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[Hashable, Callable[[], None]] = {}
+        self.deps: Dict[Hashable, tuple] = {}
+
+    def add(self, name: Hashable, fn: Callable[[], None], deps: Iterable[Hashable] = ()):
+        assert name not in self.tasks, f"Duplicate task {name}"
+        self.tasks[name] = fn
+        self.deps[name] = tuple(deps)
+
+    def run(self, max_workers: int = 4, on_done: Optional[Callable[[Hashable, Optional[BaseException]], None]] = None) -> Dict[Hashable, Optional[BaseException]]:
+        """Run every task and return ``{name: exception or None}``.
+
+        ``on_done(name, error)`` is called from the scheduling thread as soon as
+        each task finishes or is skipped; blocking in it delays further scheduling.
+        """
+        for name, deps in self.deps.items():
+            for dep in deps:
+                assert dep in self.tasks, f"Task {name} depends on unknown task {dep}"
+
+        results: Dict[Hashable, Optional[BaseException]] = {}
+        waiting = dict(self.deps)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            running = {}
+            while waiting or running:
+                for name, deps in list(waiting.items()):
+                    if any(dep not in results for dep in deps):
+                        continue
+                    del waiting[name]
+                    failed = [dep for dep in deps if results[dep] is not None]
+                    if failed:
+                        results[name] = DependencyFailed(f"{name} skipped because {failed} failed")
+                        if on_done is not None:
+                            on_done(name, results[name])
+                    else:
+                        running[executor.submit(in_context(self._run_task), name)] = name
+
+                if not running:
+                    # Everything left is blocked on a task that was skipped in this round.
+                    if waiting and all(any(dep not in results for dep in deps) for deps in waiting.values()):
+                        raise ValueError(f"Dependency cycle among tasks {list(waiting)}")
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.exception()
+                    if results[name] is not None:
+                        logging.error(f"❌ Task {name} failed: {results[name]}")
+                    if on_done is not None:
+                        on_done(name, results[name])
+        return results
+
+    def _run_task(self, name):
+        with span(f"task {name}", "task"):
+            self.tasks[name]()
@@ -1,25 +1,14 @@
-import getpass
 import os
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
+from .clients import get_chat_model
+from .state import VideoGenState
 
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-flash"
 
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
-from .state import VideoGenState
 
-model = ChatQwen(
-    model="qwen-flash",
-    max_tokens=3_000,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+def get_model():
+    return get_chat_model(MODEL, max_tokens=3_000, timeout=None, max_retries=2)
 
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -32,6 +21,13 @@ from pydantic import BaseModel, Field
 from typing import List, Optional, Literal, Tuple
 
 from .interfaces import ShotBriefDescription, ShotDescription
+from .artifact_cache import artifact_cache, artifact_key
+from .incremental import scene_cast
+
+# "batch" decomposes each shot with its own prompt, concurrently; "joint" decomposes all shots of a scene in one call.
+SHOT_DECOMPOSITION_MODE = os.getenv("SHOT_DECOMPOSITION_MODE", "batch")
+# Maximum number of concurrent LLM requests issued by a batch.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
 
 class VisDescDecompositionResponse(BaseModel):
     ff_desc: str = Field(
@@ -46,14 +42,14 @@ class VisDescDecompositionResponse(BaseModel):
         # ]
     )
     ff_vis_char_idxs: List[int] = Field(
-        description="A list of indices of characters that are visible in the first frame of the shot, corresponding to the character list provided in the input.",
+        description="A list of indices of characters that are visible in the first frame of the shot, using the index shown before each character in the character list provided in the input.",
         examples=[[0], [1], [0, 1], []]
     )
     lf_desc: str = Field(
         description="A detailed description of the last frame of the shot, capturing the concluding visual elements and composition.",
     )
     lf_vis_char_idxs: List[int] = Field(
-        description="A list of indices of characters that are visible in the last frame of the shot, corresponding to the character list provided in the input.",
+        description="A list of indices of characters that are visible in the last frame of the shot, using the index shown before each character in the character list provided in the input.",
         examples=[[0], [1], [0, 1], []]
     )
     motion_desc: str = Field(
@@ -90,7 +86,7 @@ Your task is to dissect and rewrite a user-provided visual text description of a
 
 [Input]
 You will receive a single visual text description of a shot that typically implicitly or explicitly contains information about the starting state, the motion process, and the ending state.
-Additionally, you will receive a sequence of potential characters, each containing an identifier and a feature.
+Additionally, you will receive a sequence of potential characters, each prefixed with its index and containing an identifier and a feature.
 - The description is enclosed within <VISUAL_DESC> and </VISUAL_DESC>.
 - The character list is enclosed within <CHARACTERS> and </CHARACTERS>.
 
@@ -128,7 +124,26 @@ human_prompt_template_decompose_visual_description = \
 </CHARACTERS>
 """
 
-def design_shot(state: VideoGenState) -> VideoGenState:
+human_prompt_template_decompose_visual_descriptions = \
+"""
+The following {num_shots} visual descriptions belong to consecutive shots of the same scene. Decompose each of them independently and return exactly one decomposition per shot, in the same order.
+
+{visual_descs_str}
+
+<CHARACTERS>
+{characters_str}
+</CHARACTERS>
+"""
+
+
+class MultiShotDecompositionResponse(BaseModel):
+    decompositions: List[VisDescDecompositionResponse] = Field(
+        description="One decomposition per input visual description, in the same order as the input.",
+    )
+
+
+def _decompose_batch(visual_descs: List[str], characters_str: str) -> List[VisDescDecompositionResponse]:
+    """Decompose every shot with its own prompt, issued concurrently via chain.batch."""
     parser = PydanticOutputParser(pydantic_object=VisDescDecompositionResponse)
     prompt_template = ChatPromptTemplate.from_messages(
         [
@@ -136,49 +151,104 @@ def design_shot(state: VideoGenState) -> VideoGenState:
             ('human', human_prompt_template_decompose_visual_description),
         ]
     )
-    chain = prompt_template | model | parser
-    
+    chain = prompt_template | get_model() | parser
+    format_instructions = parser.get_format_instructions()
+    return chain.batch(
+        [
+            {
+                "format_instructions": format_instructions,
+                "visual_desc": visual_desc,
+                "characters_str": characters_str,
+            }
+            for visual_desc in visual_descs
+        ],
+        config={"max_concurrency": LLM_MAX_CONCURRENCY},
+    )
+
+
+def _decompose_joint(visual_descs: List[str], characters_str: str) -> List[VisDescDecompositionResponse]:
+    """Decompose all shots in one call, sending the system prompt and format instructions once."""
+    parser = PydanticOutputParser(pydantic_object=MultiShotDecompositionResponse)
+    prompt_template = ChatPromptTemplate.from_messages(
+        [
+            ('system', system_prompt_template_decompose_visual_description),
+            ('human', human_prompt_template_decompose_visual_descriptions),
+        ]
+    )
+    chain = prompt_template | get_model() | parser
+    visual_descs_str = "\n\n".join(
+        f"<VISUAL_DESC_{j}>\n{visual_desc}\n</VISUAL_DESC_{j}>" for j, visual_desc in enumerate(visual_descs)
+    )
+    response: MultiShotDecompositionResponse = chain.invoke(input={
+            "format_instructions": parser.get_format_instructions(),
+            "num_shots": len(visual_descs),
+            "visual_descs_str": visual_descs_str,
+            "characters_str": characters_str,
+        },
+    )
+    if len(response.decompositions) != len(visual_descs):
+        logging.warning(f"⚠️ Expected {len(visual_descs)} shot decompositions but got {len(response.decompositions)}, falling back to per-shot calls.")
+        return _decompose_batch(visual_descs, characters_str)
+    return response.decompositions
+
+
+def design_shot_for_scene(state: VideoGenState, idx: int, story_board: List[ShotBriefDescription]) -> List[ShotDescription]:
+    story_board_root = os.path.join(state['cache_dir'], f"scene_{idx}")
+    # Only the characters this scene mentions are offered, and the key covers exactly them, so editing
+    # another character keeps the shots. They keep their index in the full list, which vis_char_idxs refer to.
+    cast_str = "\n".join([f"{index}. {char.identifier_in_scene}: (static) {char.static_features}; (dynamic) {char.dynamic_features}" for index, char in scene_cast(state["scene_desc"][idx], state["character_desc"])])
+    shot_descriptions = [None] * len(story_board)
+    keys = [None] * len(story_board)
+    missing = []
+    for j, shot_brief_description in enumerate(story_board):
+        shot_root = os.path.join(story_board_root, f"shot_{j}")
+        os.makedirs(shot_root, exist_ok=True)
+        shot_description_path = os.path.join(shot_root, "shot_description.json")
+        keys[j] = artifact_key(MODEL, system_prompt_template_decompose_visual_description, shot_brief_description.model_dump(), cast_str)
+        if artifact_cache.lookup(shot_description_path, keys[j]):
+            with open(shot_description_path, 'r', encoding='utf-8') as f:
+                shot_descriptions[j] = ShotDescription.model_validate(json.load(f))
+            logging.info(f"🚀 Loaded shot {shot_brief_description.idx} description from existing file.")
+        else:
+            missing.append(j)
+
+    if not missing:
+        return shot_descriptions
+
+    visual_descs = [story_board[j].visual_desc.strip() for j in missing]
+    if SHOT_DECOMPOSITION_MODE == "joint" and len(missing) > 1:
+        decompositions = _decompose_joint(visual_descs, cast_str)
+    else:
+        decompositions = _decompose_batch(visual_descs, cast_str)
+
+    for j, decomposition in zip(missing, decompositions):
+        shot_brief_description = story_board[j]
+        shot_description = ShotDescription(
+            idx=shot_brief_description.idx,
+            is_last=shot_brief_description.is_last,
+            cam_idx=shot_brief_description.cam_idx,
+            visual_desc=shot_brief_description.visual_desc,
+            variation_type=decomposition.variation_type,
+            variation_reason=decomposition.variation_reason,
+            ff_desc=decomposition.ff_desc,
+            ff_vis_char_idxs=decomposition.ff_vis_char_idxs,
+            lf_desc=decomposition.lf_desc,
+            lf_vis_char_idxs=decomposition.lf_vis_char_idxs,
+            motion_desc=decomposition.motion_desc,
+            audio_desc=shot_brief_description.audio_desc,
+        )
+        shot_description_path = os.path.join(story_board_root, f"shot_{j}", "shot_description.json")
+        with open(shot_description_path, 'w', encoding='utf-8') as f:
+            json.dump(shot_description.model_dump(), f, ensure_ascii=False, indent=4)
+        artifact_cache.store(shot_description_path, keys[j])
+        shot_descriptions[j] = shot_description
+        logging.info(f"✅ Decomposed visual description for shot {shot_brief_description.idx} and saved to {shot_description_path}.")
+    return shot_descriptions
+
+
+def design_shot(state: VideoGenState) -> VideoGenState:
     state["shot_descriptions"] = []
     for idx, story_board in enumerate(state["story_board"]):
-        story_board_root = os.path.join(state['cache_dir'], f"scene_{idx}")
-        shot_descriptions = []
-        for j, shot_brief_description in enumerate(story_board):
-            shot_root = os.path.join(story_board_root, f"shot_{j}")
-            os.makedirs(shot_root, exist_ok=True)
-            shot_description_path = os.path.join(shot_root, "shot_description.json")
-            if os.path.exists(shot_description_path):
-                with open(shot_description_path, 'r', encoding='utf-8') as f:
-                    shot_description = ShotDescription.model_validate(json.load(f))
-                shot_descriptions.append(shot_description)
-                logging.info(f"🚀 Loaded shot {shot_brief_description.idx} description from existing file.")
-            else:
-                visual_desc = shot_brief_description.visual_desc.strip()
-                characters_str = "\n".join([f"{char.identifier_in_scene}: (static) {char.static_features}; (dynamic) {char.dynamic_features}" for char in state["character_desc"]])
-
-                decomposition: VisDescDecompositionResponse = chain.invoke(input={
-                        "format_instructions": parser.get_format_instructions(),
-                        "visual_desc": visual_desc,
-                        "characters_str": characters_str,
-                    },
-                )
-                shot_description = ShotDescription(
-                    idx=shot_brief_description.idx,
-                    is_last=shot_brief_description.is_last,
-                    cam_idx=shot_brief_description.cam_idx,
-                    visual_desc=shot_brief_description.visual_desc,
-                    variation_type=decomposition.variation_type,
-                    variation_reason=decomposition.variation_reason,
-                    ff_desc=decomposition.ff_desc,
-                    ff_vis_char_idxs=decomposition.ff_vis_char_idxs,
-                    lf_desc=decomposition.lf_desc,
-                    lf_vis_char_idxs=decomposition.lf_vis_char_idxs,
-                    motion_desc=decomposition.motion_desc,
-                    audio_desc=shot_brief_description.audio_desc,
-                )
-                with open(shot_description_path, 'w', encoding='utf-8') as f:
-                    json.dump(shot_description.model_dump(), f, ensure_ascii=False, indent=4)
-                shot_descriptions.append(shot_description)
-                logging.info(f"✅ Decomposed visual description for shot {shot_brief_description.idx} and saved to {shot_description_path}.")
-        state["shot_descriptions"].append(shot_descriptions)
-
-    return state
\ No newline at end of file
+        state["shot_descriptions"].append(design_shot_for_scene(state, idx, story_board))
+
+    return state
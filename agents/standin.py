@@ -0,0 +1,576 @@
+"""Local stand-ins for the DashScope APIs used by the pipeline.
+
+They mimic the request/response shapes of the real SDK closely enough that
+the pipeline code can run against them unchanged, while generated media is
+served from a local HTTP server instead of the provider's OSS buckets.
+Outputs are deterministic functions of the request, and every backend has
+a configurable latency, jitter and rate of failed or throttled requests,
+so the pipeline can be load-tested offline; see ``StandInProvider``.
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import random
+import tempfile
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from types import SimpleNamespace
+from functools import partial
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from .rate_limit import get_rate_limiter
+from .retry import call_with_retry
+
+# Latency in seconds of each kind of stand-in request.
+STANDIN_CHAT_LATENCY = float(os.getenv("STANDIN_CHAT_LATENCY", "0.5"))
+STANDIN_IMAGE_LATENCY = float(os.getenv("STANDIN_IMAGE_LATENCY", "2"))
+STANDIN_VIDEO_LATENCY = float(os.getenv("STANDIN_VIDEO_LATENCY", "10"))
+# Latencies vary by up to this fraction ("uniform"), or with this coefficient of variation ("lognormal").
+STANDIN_JITTER = float(os.getenv("STANDIN_JITTER", "0.2"))
+STANDIN_LATENCY_DISTRIBUTION = os.getenv("STANDIN_LATENCY_DISTRIBUTION", "uniform")
+# Probability that a request fails (500) or is throttled (429).
+STANDIN_FAILURE_RATE = float(os.getenv("STANDIN_FAILURE_RATE", "0"))
+STANDIN_THROTTLE_RATE = float(os.getenv("STANDIN_THROTTLE_RATE", "0"))
+# Number of items in every list the stand-in chat model returns (scenes, shots, characters),
+# overridden per output field by STANDIN_LIST_LENGTHS, e.g. "script=3,storyboard=5,characters=2".
+STANDIN_LIST_LENGTH = int(os.getenv("STANDIN_LIST_LENGTH", "2"))
+STANDIN_LIST_LENGTHS = {
+    field.strip(): int(length)
+    for field, length in (item.split("=") for item in os.getenv("STANDIN_LIST_LENGTHS", "").split(",") if item.strip())
+}
+STANDIN_SEED = int(os.getenv("STANDIN_SEED", "0"))
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    """Static file handler that, like object storage, honours single ``Range: bytes=`` requests."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def copyfile(self, source, outputfile):
+        sent = 0
+        for chunk in iter(lambda: source.read(64 * 1024), b""):
+            outputfile.write(chunk)
+            sent += len(chunk)
+        with self.server.stats_lock:
+            self.server.requests += 1
+            self.server.bytes_sent += sent
+
+    def send_head(self):
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", "").strip())
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path) or match.group(1) == match.group(2) == "":
+            return super().send_head()
+        size = os.path.getsize(path)
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start = max(0, size - int(match.group(2)))
+            end = size - 1
+        if start >= size or start > end:
+            self.send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            return None
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return _LimitedReader(f, end - start + 1)
+
+
+class _LimitedReader:
+    """File wrapper that stops after ``remaining`` bytes, for ``copyfile`` in range responses."""
+
+    def __init__(self, f, remaining):
+        self.f = f
+        self.remaining = remaining
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class MediaServer:
+    """Serve published files over http://127.0.0.1 from a temporary directory."""
+
+    def __init__(self, root=None):
+        self.root = root or tempfile.mkdtemp(prefix="videoagent_standin_")
+        handler = partial(_QuietHandler, directory=self.root)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.stats_lock = threading.Lock()
+        self.httpd.requests = 0
+        self.httpd.bytes_sent = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def publish(self, name, data):
+        with open(os.path.join(self.root, name), "wb") as f:
+            f.write(data)
+        return f"{self.base_url}/{name}"
+
+    def stats(self) -> dict:
+        with self.httpd.stats_lock:
+            return {"requests": self.httpd.requests, "bytes_sent": self.httpd.bytes_sent}
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+_media_server = None
+_media_server_lock = threading.Lock()
+
+
+def get_media_server():
+    global _media_server
+    with _media_server_lock:
+        if _media_server is None:
+            _media_server = MediaServer()
+        return _media_server
+
+
+class _Faults:
+    """Seeded latency and fault injection shared by the stand-in backends.
+
+    ``jitter`` is in seconds: the half-width of a uniform spread around
+    ``latency``, or the standard deviation of a lognormal with mean ``latency``.
+    """
+
+    def __init__(self, latency, jitter, failure_rate, throttle_rate, seed, distribution="uniform"):
+        if distribution not in ("uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {distribution!r}.")
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.distribution = distribution
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def duration(self):
+        with self.lock:
+            if self.distribution == "lognormal" and self.latency > 0 and self.jitter > 0:
+                sigma = math.sqrt(math.log(1 + (self.jitter / self.latency) ** 2))
+                return self.rng.lognormvariate(math.log(self.latency) - sigma ** 2 / 2, sigma)
+            return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def fault(self):
+        """Return None, or the ``(status_code, code, message)`` of an injected error."""
+        with self.lock:
+            draw = self.rng.random()
+        if draw < self.throttle_rate:
+            return HTTPStatus.TOO_MANY_REQUESTS, "Throttling.RateQuota", "Stand-in request was throttled."
+        if draw < self.throttle_rate + self.failure_rate:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, "InternalError", "Stand-in request failed."
+        return None
+
+
+class _Counters:
+    """Thread-safe named counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.values[name] = self.values.get(name, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class StandInError(Exception):
+    """Error raised by the stand-in chat model, carrying the HTTP status a real endpoint would return."""
+
+    def __init__(self, status_code, code, message):
+        super().__init__(f"{status_code} {code}: {message}")
+        self.status_code = int(status_code)
+        self.code = code
+
+
+class StandInUploader:
+    """Drop-in for DashScope's temporary file storage that publishes to the local media server.
+
+    The returned URLs are plain http, so they work for every endpoint.
+    """
+
+    http_urls = True
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.uploaded = 0
+
+    def upload(self, path, model):
+        time.sleep(self.latency)
+        with open(path, "rb") as f:
+            data = f.read()
+        with self.lock:
+            self.uploaded += 1
+        return get_media_server().publish(f"{uuid.uuid4().hex}_{os.path.basename(path)}", data)
+
+
+def synthetic_video(seed, duration=1, size=(64, 64), fps=8):
+    """Render a short solid-colour mp4 whose colour is derived from ``seed``."""
+    from moviepy import ColorClip
+
+    rng = random.Random(seed)
+    color = tuple(rng.randrange(256) for _ in range(3))
+    path = os.path.join(tempfile.mkdtemp(prefix="videoagent_clip_"), "clip.mp4")
+    clip = ColorClip(size=size, color=color, duration=duration)
+    clip.write_videofile(path, fps=fps, codec="libx264", audio=False, logger=None)
+    clip.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+def synthetic_image(seed, size=(256, 256)) -> bytes:
+    """Render a PNG gradient whose colours are derived from ``seed``."""
+    import numpy as np
+    from PIL import Image
+
+    rng = random.Random(seed)
+    start, end = (np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32) for _ in range(2))
+    ramp = np.linspace(0.0, 1.0, size[0], dtype=np.float32)[None, :, None]
+    pixels = np.broadcast_to(start + (end - start) * ramp, (size[1], size[0], 3)).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class _Response(dict):
+    """Dict with attribute access, like the SDK's ``DashScopeAPIResponse``, so ``json.dumps`` works on it."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class StandInMultiModalConversation:
+    """Drop-in for ``dashscope.MultiModalConversation`` as used for text-to-image and image editing.
+
+    ``call`` blocks for ``latency`` seconds and answers with the URL of a
+    synthetic image derived from the messages, or with an error status with
+    probability ``failure_rate`` (500) or ``throttle_rate`` (429).
+    """
+
+    def __init__(self, latency=2.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0, seed=0, size=(256, 256),
+                 distribution="uniform"):
+        self.faults = _Faults(latency, jitter, failure_rate, throttle_rate, seed, distribution)
+        self.size = size
+        self.counters = _Counters()
+
+    def call(self, model, messages, api_key=None, **kwargs):
+        kwargs.pop("session", None)
+        request = json.dumps({"model": model, "messages": messages, **kwargs}, ensure_ascii=False, sort_keys=True)
+        self.counters.add(calls=1, request_bytes=len(request.encode("utf-8")))
+        time.sleep(self.faults.duration())
+        fault = self.faults.fault()
+        if fault is not None:
+            status_code, code, message = fault
+            self.counters.add(errors=1)
+            return _Response(status_code=status_code, request_id=uuid.uuid4().hex, code=code, message=message, output=None)
+        digest = _digest(request)
+        url = get_media_server().publish(f"{digest[:32]}.png", synthetic_image(digest, self.size))
+        return _Response(
+            status_code=HTTPStatus.OK,
+            request_id=uuid.uuid4().hex,
+            code="",
+            message="",
+            output={"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": [{"image": url}]}}]},
+            usage={"width": self.size[0], "height": self.size[1], "image_count": 1},
+        )
+
+
+class StandInVideoSynthesis:
+    """Drop-in for ``dashscope.VideoSynthesis`` with the async task API.
+
+    ``async_call`` returns immediately with a task id, or a 429 with
+    probability ``throttle_rate``; ``fetch`` reports PENDING, RUNNING and
+    finally SUCCEEDED (or FAILED, with probability ``failure_rate``) once
+    ``latency`` seconds have elapsed.
+    """
+
+    def __init__(self, latency=2.0, jitter=0.0, failure_rate=0.0, seed=0, throttle_rate=0.0, distribution="uniform"):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.faults = _Faults(latency, jitter, 0.0, 0.0, seed, distribution)
+        self.rng = random.Random(seed)
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.fetched = 0
+        self.request_bytes = 0
+
+    def async_call(self, model, prompt=None, api_key=None, **kwargs):
+        kwargs.pop("session", None)
+        task_id = uuid.uuid4().hex
+        request_bytes = len(json.dumps({"model": model, "prompt": prompt, **kwargs}, ensure_ascii=False).encode("utf-8"))
+        duration = self.faults.duration()
+        with self.lock:
+            self.submitted += 1
+            self.request_bytes += request_bytes
+            if self.rng.random() < self.throttle_rate:
+                rsp = self._response(task_id, "UNKNOWN", code="Throttling.RateQuota", message="Stand-in request was throttled.")
+                rsp.status_code = HTTPStatus.TOO_MANY_REQUESTS
+                return rsp
+            self.tasks[task_id] = {
+                "model": model,
+                "prompt": prompt,
+                "ready_at": time.monotonic() + duration,
+                "failed": self.rng.random() < self.failure_rate,
+                "video_url": None,
+            }
+        return self._response(task_id, "PENDING")
+
+    def fetch(self, task, api_key=None, **kwargs):
+        task_id = task if isinstance(task, str) else task.output.task_id
+        with self.lock:
+            self.fetched += 1
+            record = self.tasks.get(task_id)
+        if record is None:
+            return self._response(task_id, "UNKNOWN")
+        if time.monotonic() < record["ready_at"]:
+            return self._response(task_id, "RUNNING")
+        if record["failed"]:
+            return self._response(task_id, "FAILED", code="InternalError", message="Stand-in task failed.")
+        if record["video_url"] is None:
+            data = synthetic_video(task_id)
+            record["video_url"] = get_media_server().publish(f"{task_id}.mp4", data)
+        return self._response(task_id, "SUCCEEDED", video_url=record["video_url"])
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"submitted": self.submitted, "fetched": self.fetched, "request_bytes": self.request_bytes,
+                    "failed": sum(task["failed"] for task in self.tasks.values())}
+
+    def call(self, model, prompt=None, api_key=None, **kwargs):
+        rsp = self.async_call(model, prompt=prompt, api_key=api_key, **kwargs)
+        while rsp.status_code == HTTPStatus.OK and rsp.output.task_status in ("PENDING", "RUNNING"):
+            time.sleep(0.1)
+            rsp = self.fetch(rsp.output.task_id)
+        return rsp
+
+    @staticmethod
+    def _response(task_id, task_status, video_url="", code="", message=""):
+        return SimpleNamespace(
+            status_code=HTTPStatus.OK,
+            request_id=uuid.uuid4().hex,
+            code=code,
+            message=message,
+            output=SimpleNamespace(task_id=task_id, task_status=task_status, video_url=video_url),
+        )
+
+
+_SCHEMA_RE = re.compile(r"Here is the output schema:\s*```\s*(\{.*?\})\s*```", re.S)
+_WORDS = ("light", "shadow", "street", "window", "rain", "smile", "door", "river", "city", "quiet",
+          "morning", "glance", "coat", "table", "voice", "train", "garden", "letter", "step", "night")
+
+
+class StandInChatModel(BaseChatModel):
+    """Chat model that answers offline after a simulated latency.
+
+    When the prompt carries the format instructions of a
+    ``PydanticOutputParser``, the answer is a JSON instance synthesized from
+    that schema; otherwise it is a few paragraphs of filler text. Answers
+    are deterministic functions of the prompt. Lists get ``list_length``
+    items; integer fields named ``idx`` or ``*_idx`` count up with their
+    position, ``is_last`` marks the last item, index lists point at the
+    first item and optional fields other than text are left empty, so the outputs chain
+    through the pipeline like real ones. ``list_lengths`` overrides the
+    length of the lists in particular fields, e.g. ``{"storyboard": 5}``.
+    Injected failures are retried with backoff, as the OpenAI client under
+    ``ChatQwen`` retries real ones.
+    """
+
+    model_name: str = "standin"
+    latency: float = 0.5
+    jitter: float = 0.0
+    distribution: str = "uniform"
+    failure_rate: float = 0.0
+    throttle_rate: float = 0.0
+    seed: int = 0
+    list_length: int = 2
+    list_lengths: dict = {}
+    faults: Any = None
+    counters: Any = None
+
+    def model_post_init(self, __context):
+        self.faults = _Faults(self.latency, self.jitter, self.failure_rate, self.throttle_rate, self.seed, self.distribution)
+        if self.counters is None:
+            self.counters = _Counters()
+
+    @property
+    def _llm_type(self) -> str:
+        return "standin"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name}
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        # Throttled attempts are fed back to the rate limiter, as the HTTP client hook does for ChatQwen.
+        return call_with_retry(partial(self._attempt, messages), f"chat {self.model_name}",
+                               on_throttle=get_rate_limiter().get(self.model_name).on_throttle)
+
+    def _attempt(self, messages) -> ChatResult:
+        prompt = "\n".join(m.content if isinstance(m.content, str) else json.dumps(m.content, ensure_ascii=False) for m in messages)
+        self.counters.add(calls=1, request_bytes=len(prompt.encode("utf-8")))
+        time.sleep(self.faults.duration())
+        fault = self.faults.fault()
+        if fault is not None:
+            self.counters.add(errors=1)
+            raise StandInError(*fault)
+
+        rng = random.Random(_digest(self.model_name, prompt))
+        match = _SCHEMA_RE.search(prompt)
+        if match:
+            schema = json.loads(match.group(1))
+            content = json.dumps(self._instance(schema, schema, "", 0, 1, rng), ensure_ascii=False, indent=2)
+        else:
+            content = "\n\n".join(self._sentence(rng, 40) for _ in range(self.list_length))
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        self.counters.add(response_bytes=len(content.encode("utf-8")), input_tokens=usage["input_tokens"], output_tokens=usage["output_tokens"])
+        message = AIMessage(content=content, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _sentence(rng, words):
+        return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+    def _instance(self, node, root, name, position, count, rng):
+        if "$ref" in node:
+            target = root
+            for part in node["$ref"].lstrip("#/").split("/"):
+                target = target[part]
+            return self._instance(target, root, name, position, count, rng)
+        if "anyOf" in node:
+            options = [option for option in node["anyOf"] if option.get("type") != "null"]
+            if not options or (len(options) < len(node["anyOf"]) and options[0].get("type") != "string"):
+                return None
+            return self._instance(options[0], root, name, position, count, rng)
+        if "enum" in node:
+            return node["enum"][0]
+        kind = node.get("type")
+        if kind == "object" or "properties" in node:
+            return {
+                key: self._instance(value, root, key, position, count, rng)
+                for key, value in node.get("properties", {}).items()
+            }
+        if kind == "array":
+            items = node.get("items", {})
+            if items.get("type") == "integer":
+                return [0]
+            length = self.list_lengths.get(name, self.list_length)
+            return [self._instance(items, root, name, i, length, rng) for i in range(length)]
+        if kind == "integer":
+            return position if name == "idx" or name.endswith("_idx") else 0
+        if kind == "number":
+            return 0.0
+        if kind == "boolean":
+            return position == count - 1 if name == "is_last" else True
+        if kind == "string":
+            return f"{node.get('title', name)} {position}: {self._sentence(rng, 12)}"
+        return None
+
+
+class StandInProvider:
+    """Provider whose text, image, image-edit and video backends all run locally.
+
+    Configured from the STANDIN_* environment variables by ``from_env``.
+    """
+
+    name = "standin"
+
+    def __init__(self, chat_latency=0.5, image_latency=2.0, video_latency=10.0, jitter=0.2, distribution="uniform",
+                 failure_rate=0.0, throttle_rate=0.0, list_length=2, list_lengths=None, seed=0):
+        self.chat_latency = chat_latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.list_length = list_length
+        self.list_lengths = dict(list_lengths or {})
+        self.seed = seed
+        self.chat_counters = _Counters()
+        self.uploaders = []
+        self.multimodal_conversation = StandInMultiModalConversation(
+            latency=image_latency, jitter=image_latency * jitter, failure_rate=failure_rate,
+            throttle_rate=throttle_rate, seed=seed, distribution=distribution,
+        )
+        self.video_synthesis = StandInVideoSynthesis(
+            latency=video_latency, jitter=video_latency * jitter, failure_rate=failure_rate,
+            throttle_rate=throttle_rate, seed=seed, distribution=distribution,
+        )
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            chat_latency=STANDIN_CHAT_LATENCY, image_latency=STANDIN_IMAGE_LATENCY, video_latency=STANDIN_VIDEO_LATENCY,
+            jitter=STANDIN_JITTER, distribution=STANDIN_LATENCY_DISTRIBUTION,
+            failure_rate=STANDIN_FAILURE_RATE, throttle_rate=STANDIN_THROTTLE_RATE,
+            list_length=STANDIN_LIST_LENGTH, list_lengths=STANDIN_LIST_LENGTHS, seed=STANDIN_SEED,
+        )
+
+    def chat_model(self, model, **params):
+        return StandInChatModel(
+            model_name=model, latency=self.chat_latency, jitter=self.chat_latency * self.jitter,
+            distribution=self.distribution, failure_rate=self.failure_rate, throttle_rate=self.throttle_rate,
+            seed=self.seed, list_length=self.list_length, list_lengths=self.list_lengths,
+            counters=self.chat_counters,
+        )
+
+    def uploader(self):
+        uploader = StandInUploader()
+        self.uploaders.append(uploader)
+        return uploader
+
+    def stats(self) -> dict:
+        """Requests and bytes handled by every backend so far."""
+        return {
+            "chat": self.chat_counters.snapshot(),
+            "image": self.multimodal_conversation.counters.snapshot(),
+            "video": self.video_synthesis.stats(),
+            "uploads": sum(uploader.uploaded for uploader in self.uploaders),
+            "media_server": get_media_server().stats(),
+        }
@@ -1,4 +1,22 @@
-from typing import TypedDict, List, Dict, Any, DefaultDict
+from typing import TypedDict, List, Dict, Any, DefaultDict, Annotated
+
+
+def merge_by_scene(left: List[Any], right: Any) -> List[Any]:
+    """Reducer for per-scene lists.
+
+    Whole-workflow nodes write the complete list, which replaces the old value.
+    Scene branches run in parallel and each writes ``{scene_idx: value}``,
+    which is merged into the list at that scene's position.
+    """
+    if not isinstance(right, dict):
+        return right
+    merged = list(left or [])
+    for idx, value in right.items():
+        if idx >= len(merged):
+            merged.extend([None] * (idx + 1 - len(merged)))
+        merged[idx] = value
+    return merged
+
 
 # 定义状态数据结构 - 贯穿整个工作流的核心数据
 class VideoGenState(TypedDict):
@@ -9,10 +27,15 @@ class VideoGenState(TypedDict):
     story: str                    # 生成的故事文本
     character_desc: List[Dict[str, Any]] # 人物描述（主要/次要）
     character_images: Dict[str, Any]   # 生成的人物图像URL/路径
-    story_board: List[Any]
-    shot_descriptions: List[Any]
-    camera_tree: List[Any]
+    story_board: Annotated[List[Any], merge_by_scene]
+    shot_descriptions: Annotated[List[Any], merge_by_scene]
+    camera_tree: Annotated[List[Any], merge_by_scene]
     scene_desc: List[str] # 场景描述列表
     final_video: str              # 最终视频URL/路径
     cache_dir: str
-    need_regen: DefaultDict[str, bool]
\ No newline at end of file
+    need_regen: DefaultDict[str, bool]
+
+
+class SceneState(VideoGenState):
+    """单个场景分支的输入，scene_idx 为该分支负责的场景序号"""
+    scene_idx: int
@@ -1,25 +1,16 @@
-import getpass
 import os
+import json
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
+from .clients import get_chat_model
+from .state import VideoGenState
+from .artifact_cache import artifact_cache, artifact_key
 
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-flash"
 
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
-from .state import VideoGenState
 
-model = ChatQwen(
-    model="qwen-flash",
-    max_tokens=3_000,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+def get_model():
+    return get_chat_model(MODEL, max_tokens=3_000, timeout=None, max_retries=2)
 
 system_prompt_template_develop_story = \
 """
@@ -78,30 +69,71 @@ human_prompt_template_develop_story = \
 </USER_REQUIREMENT>
 """
 
+human_prompt_template_revise_story = \
+"""
+The story above was rejected. Revise it according to the feedback below. Keep every passage the feedback does not concern exactly as it is, word for word, and only rewrite what has to change.
+
+<FEEDBACK>
+{feedback}
+</FEEDBACK>
+"""
+
+# Feedback given on the story, replayed so that later runs resolve to the same revised story.
+REVISIONS_FILE = "story_revisions.json"
+
+
+def _load_revisions(cache_dir, base_key):
+    path = os.path.join(cache_dir, REVISIONS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        revisions = json.load(f)
+    # Feedback on a story for a different idea does not apply.
+    return revisions["feedback"] if revisions.get("base_key") == base_key else []
+
+
+def _save_revisions(cache_dir, base_key, feedback):
+    with open(os.path.join(cache_dir, REVISIONS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"base_key": base_key, "feedback": feedback}, f, ensure_ascii=False, indent=4)
+
+
 from collections import defaultdict
 def develop_story(state: VideoGenState) -> VideoGenState:
     save_path = os.path.join(state['cache_dir'], "story.txt")
-    if os.path.exists(save_path):
+    messages = [
+        ("system", system_prompt_template_develop_story),
+        ("human", human_prompt_template_develop_story.format(idea=state["user_idea"], user_requirement=state["user_requirement"])),
+    ]
+    base_key = artifact_key(MODEL, messages)
+
+    if not isinstance(state["need_regen"], defaultdict):
+        state["need_regen"] = defaultdict(lambda: [False, ""], state["need_regen"])
+    feedback = _load_revisions(state['cache_dir'], base_key)
+    need_regen, reason = state["need_regen"]["develop_story"]
+    if need_regen:
+        feedback = feedback + [reason]
+        state["need_regen"]["develop_story"] = [False, ""]
+    key = artifact_key(base_key, feedback) if feedback else base_key
+
+    if artifact_cache.lookup(save_path, key):
         with open(save_path, "r", encoding="utf-8") as f:
             state["story"] = f.read()
         logging.info(f"🚀 Loaded story from existing file.")
     else:
-        messages = [
-            ("system", system_prompt_template_develop_story),
-            ("human", human_prompt_template_develop_story.format(idea=state["user_idea"], user_requirement=state["user_requirement"])),
-        ]
-        response = model.invoke(messages)
+        if feedback:
+            # Revise the rejected story rather than writing a new one, so that the
+            # unaffected parts, and everything generated from them, survive.
+            if state.get("story"):
+                messages.append(("ai", state["story"]))
+            feedback_str = "\n".join(f"{i + 1}. {item}" for i, item in enumerate(feedback))
+            messages.append(("human", human_prompt_template_revise_story.format(feedback=feedback_str)))
+        response = get_model().invoke(messages)
         state["story"] = response.content
         with open(save_path, "w", encoding="utf-8") as f:
             f.write(state["story"])
+        artifact_cache.store(save_path, key)
         logging.info(f"✅ Developed story and saved to {save_path}.")
+    if need_regen:
+        _save_revisions(state['cache_dir'], base_key, feedback)
 
-    if not isinstance(state["need_regen"], defaultdict):
-        state["need_regen"] = defaultdict(lambda: [False, ""], state["need_regen"])
-    if state["need_regen"]["develop_story"][0]:
-        logging.info(f"Regenerate")
-        print(state["need_regen"]["develop_story"][1])
-        state["need_regen"]["develop_story"] = False
-        
     return state
-
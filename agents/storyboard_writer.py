@@ -1,25 +1,16 @@
-import getpass
 import os
 import logging
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    print('Please set your API_KEY')
+from .clients import get_chat_model
+from .state import VideoGenState
+from .artifact_cache import artifact_cache, artifact_key
+from .incremental import scene_cast
 
-# Note: Domestic Chinese users should configure DASHSCOPE_API_BASE to the domestic endpoint, as langchain-qwq defaults to the international Alibaba Cloud endpoint.
-if not os.getenv("DASHSCOPE_API_BASE"):
-    os.environ["DASHSCOPE_API_BASE"] = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-flash"
 
-from langchain_qwq import ChatQwen
-from langchain.tools import tool
-from .state import VideoGenState
 
-model = ChatQwen(
-    model="qwen-flash",
-    max_tokens=3_000,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+def get_model():
+    return get_chat_model(MODEL, max_tokens=3_000, timeout=None, max_retries=2)
 
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -88,41 +79,52 @@ human_prompt_template_design_storyboard = \
 </USER_REQUIREMENT>
 """
 
+class StoryboardResponse(BaseModel):
+    storyboard: List[ShotBriefDescription] = Field(
+        description="A complete storyboard of the scene, including the visual and audio description of each shot.",
+    )
+
+
+def design_storyboard_for_scene(state: VideoGenState, idx: int) -> List[ShotBriefDescription]:
+    script = state["scene_desc"][idx]
+    save_root = os.path.join(state['cache_dir'], f"scene_{idx}")
+    os.makedirs(save_root, exist_ok=True)
+    save_path = os.path.join(save_root, "storyboard.json")
+
+    script_str = script.strip()
+    # Only the characters this scene mentions are offered, and the key covers exactly them,
+    # so editing another character keeps the storyboard.
+    cast_str = "\n".join([f"Character {index}: {char}" for index, char in scene_cast(script_str, state["character_desc"])])
+    user_requirement_str = state["user_requirement"].strip() if state["user_requirement"] else ""
+
+    parser = PydanticOutputParser(pydantic_object=StoryboardResponse)
+    messages = [
+        ('system', system_prompt_template_design_storyboard.format(format_instructions=parser.get_format_instructions())),
+        ('human', human_prompt_template_design_storyboard.format(script_str=script_str, characters_str=cast_str, user_requirement_str=user_requirement_str)),
+    ]
+    key = artifact_key(MODEL, messages[0], script_str, cast_str, user_requirement_str)
+    if artifact_cache.lookup(save_path, key):
+        with open(save_path, 'r', encoding='utf-8') as f:
+            storyboard = json.load(f)
+        storyboard = [ShotBriefDescription.model_validate(shot) for shot in storyboard]
+        logging.info(f"🚀 Loaded {len(storyboard)} shot brief descriptions from existing file.")
+    else:
+        chain = get_model() | parser
+
+        response: StoryboardResponse = chain.invoke(messages)
+
+        storyboard = response.storyboard
+
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump([shot.model_dump() for shot in storyboard], f, ensure_ascii=False, indent=4)
+        artifact_cache.store(save_path, key)
+        logging.info(f"✅ Designed storyboard and saved to {save_path}.")
+    return storyboard
+
+
 def design_storyboard(state: VideoGenState) -> VideoGenState:
-    class StoryboardResponse(BaseModel):
-            storyboard: List[ShotBriefDescription] = Field(
-                description="A complete storyboard of the scene, including the visual and audio description of each shot.",
-            )
     state["story_board"] = []
     for idx, script in enumerate(state["scene_desc"]):
-        save_root = os.path.join(state['cache_dir'], f"scene_{idx}")
-        os.makedirs(save_root, exist_ok=True)
-        save_path = os.path.join(save_root, "storyboard.json")
-        if os.path.exists(save_path):
-            with open(save_path, 'r', encoding='utf-8') as f:
-                storyboard = json.load(f)
-            storyboard = [ShotBriefDescription.model_validate(shot) for shot in storyboard]
-            state["story_board"].append(storyboard)
-            logging.info(f"🚀 Loaded {len(storyboard)} shot brief descriptions from existing file.")
-        else:
-            script_str = script.strip()
-            characters_str = "\n".join([f"Character {index}: {char}" for index, char in enumerate(state["character_desc"])])
-            user_requirement_str = state["user_requirement"].strip() if state["user_requirement"] else ""
-    
-            parser = PydanticOutputParser(pydantic_object=StoryboardResponse)
-            messages = [
-                ('system', system_prompt_template_design_storyboard.format(format_instructions=parser.get_format_instructions())),
-                ('human', human_prompt_template_design_storyboard.format(script_str=script_str, characters_str=characters_str, user_requirement_str=user_requirement_str)),
-            ]
-            chain = model | parser
-            
-            response: StoryboardResponse = chain.invoke(messages)
-    
-            storyboard = response.storyboard
-    
-            with open(save_path, 'w', encoding='utf-8') as f:
-                json.dump([shot.model_dump() for shot in storyboard], f, ensure_ascii=False, indent=4)
-            state["story_board"].append(storyboard)
-            logging.info(f"✅ Designed storyboard and saved to {save_path}.")
-
-    return state
\ No newline at end of file
+        state["story_board"].append(design_storyboard_for_scene(state, idx))
+
+    return state
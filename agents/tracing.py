@@ -0,0 +1,193 @@
+"""Timing spans for graph nodes, pipeline stages and provider calls.
+
+Every run writes ``trace_<time>_<pid>.json`` into its ``cache_dir`` in the
+Chrome trace event format, which chrome://tracing, Perfetto
+(ui.perfetto.dev) and speedscope load directly. Events are appended as
+they complete, so the trace of a run that crashed is still readable.
+
+Spans carry what explains their duration: the model, token counts,
+payload bytes, artifact cache hits and misses, and retries. The tracer
+of the current run is found through a context variable, which the
+pipeline's thread pools copy into their workers; threads that do not
+inherit it fall back to the only active run, if there is just one.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial, wraps
+
+
+# Set to 0 to stop writing trace files.
+TRACING = os.getenv("TRACING", "1") not in ("0", "false", "False")
+
+TRACE_PREFIX = "trace_"
+
+
+def _now_us() -> float:
+    return time.time() * 1e6
+
+
+class Tracer:
+    """Append trace events of one run to a JSON array file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.file = open(path, "w", encoding="utf-8")
+        # The closing bracket is optional in the JSON array trace format.
+        self.file.write("[\n")
+        self.file.flush()
+
+    def emit(self, event):
+        tid = threading.get_ident()
+        event = {"pid": self.pid, "tid": tid, **event}
+        with self.lock:
+            if self.file.closed:
+                return
+            if tid not in self.threads:
+                self.threads.add(tid)
+                name = {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": threading.current_thread().name}}
+                self.file.write(json.dumps(name) + ",\n")
+            self.file.write(json.dumps(event, ensure_ascii=False, default=str) + ",\n")
+            self.file.flush()
+
+    def complete(self, name, cat, start_us, end_us, args=None):
+        self.emit({"name": name, "cat": cat, "ph": "X", "ts": start_us, "dur": max(0.0, end_us - start_us), "args": args or {}})
+
+    def instant(self, name, cat, args=None):
+        self.emit({"name": name, "cat": cat, "ph": "i", "s": "t", "ts": _now_us(), "args": args or {}})
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                name = {"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0, "args": {"name": "videoagent"}}
+                self.file.write(json.dumps(name) + "]\n")
+                self.file.close()
+
+
+class Span:
+    """Arguments of an open span; ``set`` adds to them before the span is written."""
+
+    def __init__(self, args):
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def add(self, **amounts):
+        for name, amount in amounts.items():
+            self.args[name] = self.args.get(name, 0) + amount
+
+
+_current = contextvars.ContextVar("videoagent_tracer", default=None)
+_current_span = contextvars.ContextVar("videoagent_span", default=None)
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+def start_run(cache_dir) -> Tracer:
+    """Open a new trace file in ``cache_dir`` for a run, closing the previous run's."""
+    finish_run(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{TRACE_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}.json")
+    tracer = Tracer(path)
+    with _tracers_lock:
+        _tracers[os.path.abspath(cache_dir)] = tracer
+    logging.info(f"⚙️ Writing trace to {path}.")
+    return tracer
+
+
+def get_tracer(cache_dir) -> Tracer:
+    """Return the tracer of the run in ``cache_dir``, starting one if there is none."""
+    with _tracers_lock:
+        tracer = _tracers.get(os.path.abspath(cache_dir))
+    return tracer if tracer is not None else start_run(cache_dir)
+
+
+def finish_run(cache_dir):
+    with _tracers_lock:
+        tracer = _tracers.pop(os.path.abspath(cache_dir), None)
+    if tracer is not None:
+        tracer.close()
+
+
+def current():
+    tracer = _current.get()
+    if tracer is None:
+        with _tracers_lock:
+            if len(_tracers) == 1:
+                tracer = next(iter(_tracers.values()))
+    return tracer
+
+
+@contextmanager
+def activate(tracer):
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name, cat="stage", **args):
+    """Time the enclosed block as a span of the current run; yields a ``Span`` to attach results to."""
+    tracer = current() if TRACING else None
+    s = Span(args)
+    if tracer is None:
+        yield s
+        return
+    start = _now_us()
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.complete(name, cat, start, _now_us(), s.args)
+
+
+def count(**amounts):
+    """Add to counters of the innermost open span, e.g. ``count(cache_hits=1)``."""
+    s = _current_span.get()
+    if s is not None:
+        s.add(**amounts)
+
+
+def instant(name, cat="event", **args):
+    tracer = current() if TRACING else None
+    if tracer is not None:
+        tracer.instant(name, cat, args)
+
+
+def record(name, cat, start, end, **args):
+    """Write a span whose start and end (``time.time()`` seconds) were measured elsewhere."""
+    tracer = current() if TRACING else None
+    if tracer is not None:
+        tracer.complete(name, cat, start * 1e6, end * 1e6, args)
+
+
+def in_context(fn):
+    """Return ``fn`` bound to a copy of the caller's context, to be run once in another thread."""
+    return partial(contextvars.copy_context().run, fn)
+
+
+def traced_node(name, fn):
+    """Wrap a graph node so that it runs under its run's tracer, as a span."""
+    @wraps(fn)
+    def node(state, *args, **kwargs):
+        if not TRACING:
+            return fn(state, *args, **kwargs)
+        with activate(get_tracer(state["cache_dir"])):
+            node_args = {"scene": state["scene_idx"]} if "scene_idx" in state else {}
+            with span(name if not node_args else f"{name} {node_args['scene']}", "node", **node_args):
+                return fn(state, *args, **kwargs)
+    return node
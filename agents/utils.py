@@ -1,19 +1,19 @@
 import json
+import logging
 import os
-import dashscope
-from http import HTTPStatus
-from dashscope import MultiModalConversation
-from dashscope import VideoSynthesis
 import mimetypes
 import base64
-import requests
-
-# 以下为北京地域url，若使用新加坡地域的模型，需将url替换为：https://dashscope-intl.aliyuncs.com/api/v1
-dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
+from .downloader import download, DownloadError
+from .clients import get_session
+from .references import encoding_cache, get_uploads
+from .providers import get_provider
+from .rate_limit import limited
+from .retry import call_with_retry, check_response, check_task
+from .tracing import span
 
 # ---用于 Base64 编码 ---
 # 格式为 data:{mime_type};base64,{base64_data}
-def encode_file(file_path):
+def _encode_file(file_path):
     mime_type, _ = mimetypes.guess_type(file_path)
     if not mime_type or not mime_type.startswith("image/"):
         raise ValueError("不支持或无法识别的图像格式")
@@ -26,10 +26,40 @@ def encode_file(file_path):
     except IOError as e:
         raise IOError(f"读取文件时出错: {file_path}, 错误: {str(e)}")
 
+def encode_file(file_path):
+    # 同一文件（路径、大小、修改时间均未变）只编码一次
+    return encoding_cache.get(file_path, _encode_file)
+
+def reference_image(file_path, model, http_only=False):
+    """
+    返回请求中引用图片所用的地址
+    :param model: 使用该图片的模型，上传凭证按模型区分
+    :param http_only: 为 True 时只接受 http(s) 地址（OpenAI 兼容接口无法解析 oss:// 地址）
+    :return: 开启 REFERENCE_UPLOAD 时为上传一次后复用的 URL，否则为 Base64 编码
+    """
+    uploads = get_uploads()
+    if uploads is None or (http_only and not uploads.uploader.http_urls):
+        return encode_file(file_path)
+    return uploads.url(file_path, model)
+
 # 新加坡和北京地域的API Key不同。获取API Key：https://help.aliyun.com/zh/model-studio/get-api-key
 # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx"
 api_key = os.getenv("DASHSCOPE_API_KEY")
 
+# 各生成阶段使用的模型
+TEXT2IMAGE_MODEL = "qwen-image-plus"
+IMAGE_EDIT_MODEL = "qwen-image-edit-plus"
+I2V_MODEL = "wan2.2-i2v-flash"
+KF2V_MODEL = "wan2.2-kf2v-flash"
+
+# 下载图片时使用的请求头
+DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+# 同时进行的图像生成请求数上限
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", "4"))
+
 def text2image(prompt, save_dir):
     messages = [
         {
@@ -40,50 +70,39 @@ def text2image(prompt, save_dir):
         }
     ]
     
-    response = MultiModalConversation.call(
-        api_key=api_key,
-        model="qwen-image-plus",
-        messages=messages,
-        result_format='message',
-        stream=False,
-        watermark=False,
-        prompt_extend=True,
-        negative_prompt='',
-        size='1328*1328'
-    )
-    
-    if response.status_code == 200:
-        response = json.dumps(response, ensure_ascii=False)
-        response_dict = json.loads(response)
-        print(response_dict)
-        image_url = response_dict["output"]["choices"][0]["message"]["content"][0]["image"]
-        print(image_url)
-        # 注意：添加超时和请求头，避免下载失败
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        }
-        img_response = requests.get(
-            image_url,
-            headers=headers,
-            timeout=30,  # 超时时间30秒
-            stream=True  # 流式下载（适合大文件）
-        )
-        img_response.raise_for_status()  # 抛出HTTP错误（如404/500）
-
-        # 写入文件（二进制模式）
-        with open(save_dir, "wb") as f:
-            for chunk in img_response.iter_content(chunk_size=8192):  # 分块写入
-                f.write(chunk)
-
-        print(f"图片已保存到: {save_dir}")
-    else:
-        print(f"HTTP返回码：{response.status_code}")
-        print(f"错误码：{response.code}")
-        print(f"错误信息：{response.message}")
-        print("请参考文档：https://help.aliyun.com/zh/model-studio/developer-reference/error-code")
+    def call():
+        # 按模型限流，所有节点和任务共享配额，见 rate_limit
+        with limited(TEXT2IMAGE_MODEL):
+            response = get_provider().multimodal_conversation.call(
+                api_key=api_key,
+                session=get_session("dashscope"),  # 复用连接池中的长连接
+                model=TEXT2IMAGE_MODEL,
+                messages=messages,
+                result_format='message',
+                stream=False,
+                watermark=False,
+                prompt_extend=True,
+                negative_prompt='',
+                size='1328*1328'
+            )
+            traced.set(status_code=int(response.status_code), request_id=response.request_id)
+            # 在限流范围内检查，限流器据此调整该模型的并发数
+            return check_response(response, "text2image")
+
+    with span("text2image", "provider", model=TEXT2IMAGE_MODEL, request_bytes=len(prompt.encode("utf-8"))) as traced:
+        # 限流和临时错误按指数退避重试，其余错误抛出 ProviderError，错误码见：
+        # https://help.aliyun.com/zh/model-studio/developer-reference/error-code
+        response = call_with_retry(call, "text2image")
+
+    response = json.dumps(response, ensure_ascii=False)
+    response_dict = json.loads(response)
+    image_url = response_dict["output"]["choices"][0]["message"]["content"][0]["image"]
+    # 先写入临时文件，校验完整后再重命名，中断后可断点续传
+    download(image_url, save_dir, headers=DOWNLOAD_HEADERS)
+    logging.debug(f"图片已保存到: {save_dir}（{image_url}）")
 
 def image2image(prompt, image_paths, save_dir):
-    content = [{"image": encode_file(image_path)} for image_path in image_paths]
+    content = [{"image": reference_image(image_path, IMAGE_EDIT_MODEL)} for image_path in image_paths]
     content.append({"text": prompt})
     messages = [
         {
@@ -93,79 +112,73 @@ def image2image(prompt, image_paths, save_dir):
     ]
     
     # qwen-image-edit-plus支持输出1-6张图片，此处以2张为例
-    response = MultiModalConversation.call(
-        api_key=api_key,
-        model="qwen-image-edit-plus",
-        messages=messages,
-        stream=False,
-        n=1,
-        watermark=False,
-        negative_prompt=" ",
-        prompt_extend=True,
-        # 仅当输出图像数量n=1时支持设置size参数，否则会报错
-        # size="2048*1024",
-    )
-    
-    if response.status_code == 200:
-        response = json.dumps(response, ensure_ascii=False)
-        response_dict = json.loads(response)
-        image_url = response_dict["output"]["choices"][0]["message"]["content"][0]["image"]
-        print(image_url)
-        # 注意：添加超时和请求头，避免下载失败
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        }
-        img_response = requests.get(
-            image_url,
-            headers=headers,
-            timeout=30,  # 超时时间30秒
-            stream=True  # 流式下载（适合大文件）
-        )
-        img_response.raise_for_status()  # 抛出HTTP错误（如404/500）
-
-        # 写入文件（二进制模式）
-        with open(save_dir, "wb") as f:
-            for chunk in img_response.iter_content(chunk_size=8192):  # 分块写入
-                f.write(chunk)
-
-        print(f"图片已保存到: {save_dir}")
-    else:
-        print(f"HTTP返回码：{response.status_code}")
-        print(f"错误码：{response.code}")
-        print(f"错误信息：{response.message}")
-        print("请参考文档：https://help.aliyun.com/zh/model-studio/developer-reference/error-code")
+    request_bytes = sum(len(item.get("image", item.get("text", "")).encode("utf-8")) for item in content)
+
+    def call():
+        with limited(IMAGE_EDIT_MODEL):
+            response = get_provider().multimodal_conversation.call(
+                api_key=api_key,
+                session=get_session("dashscope"),  # 复用连接池中的长连接
+                model=IMAGE_EDIT_MODEL,
+                messages=messages,
+                stream=False,
+                n=1,
+                watermark=False,
+                negative_prompt=" ",
+                prompt_extend=True,
+                # 仅当输出图像数量n=1时支持设置size参数，否则会报错
+                # size="2048*1024",
+            )
+            traced.set(status_code=int(response.status_code), request_id=response.request_id)
+            return check_response(response, "image2image")
+
+    with span("image2image", "provider", model=IMAGE_EDIT_MODEL, images=len(image_paths), request_bytes=request_bytes) as traced:
+        response = call_with_retry(call, "image2image")
+
+    response = json.dumps(response, ensure_ascii=False)
+    response_dict = json.loads(response)
+    image_url = response_dict["output"]["choices"][0]["message"]["content"][0]["image"]
+    # 先写入临时文件，校验完整后再重命名，中断后可断点续传
+    download(image_url, save_dir, headers=DOWNLOAD_HEADERS)
+    logging.debug(f"图片已保存到: {save_dir}（{image_url}）")
+
+
+def i2v_model(image_paths):
+    # 单帧使用图生视频模型，首尾帧使用首尾帧生视频模型
+    return I2V_MODEL if len(image_paths) == 1 else KF2V_MODEL
+
+
+def i2v_arguments(prompt, image_paths):
+    if i2v_model(image_paths) == I2V_MODEL:
+        return dict(model=I2V_MODEL,
+                    prompt=prompt,
+                    img_url=reference_image(image_paths[0], I2V_MODEL))
+    assert len(image_paths) == 2
+    return dict(model=KF2V_MODEL,
+                prompt=prompt,
+                first_frame_url=reference_image(image_paths[0], KF2V_MODEL),
+                last_frame_url=reference_image(image_paths[1], KF2V_MODEL))
 
 
 def sample_call_i2v(prompt, image_paths, save_dir):
     # 同步调用，直接返回结果
-    print('please wait...')
-    if len(image_paths) == 1:
-        img_url = encode_file(image_paths[0])
-        rsp = VideoSynthesis.call(api_key=api_key,
-                                  model='wan2.2-i2v-flash',
-                                  prompt=prompt,
-                                  img_url=img_url)
-    else:
-        assert len(image_paths) == 2
-        img_url = encode_file(image_paths[0])
-        img2_url = encode_file(image_paths[1])
-        rsp = VideoSynthesis.call(api_key=api_key,
-                                  model='wan2.2-kf2v-flash',
-                                  prompt=prompt,
-                                  first_frame_url=img_url,
-                                  last_frame_url=img2_url,)
-    print(rsp)
-    if rsp.status_code == HTTPStatus.OK:
-        print("video_url:", rsp.output.video_url)
-    else:
-        print('Failed, status_code: %s, code: %s, message: %s' %
-              (rsp.status_code, rsp.code, rsp.message))
-
-    print(rsp.output.video_url)
-    download_video(
-        video_url=rsp.output.video_url,
-        save_path=save_dir  # 用task_id命名，避免重复
-    )
+    arguments = i2v_arguments(prompt, image_paths)
+
+    def call():
+        # 同步调用在任务完成前一直占用该模型的并发任务配额
+        with limited(arguments["model"]):
+            rsp = get_provider().video_synthesis.call(api_key=api_key, session=get_session("dashscope"), **arguments)
+            traced.set(status_code=int(rsp.status_code), request_id=getattr(rsp, "request_id", None),
+                       task_id=getattr(getattr(rsp, "output", None), "task_id", None))
+            # 任务失败（如内容审核不通过）时状态码仍可能为 200，需检查任务状态
+            return check_task(rsp, "image2video")
+
+    with span("image2video", "provider", model=arguments["model"],
+              request_bytes=sum(len(value) for value in arguments.values() if isinstance(value, str))) as traced:
+        rsp = call_with_retry(call, "image2video")
+
+    if download_video(video_url=rsp.output.video_url, save_path=save_dir) is None:
+        raise DownloadError(f"Failed to download {rsp.output.video_url} to {save_dir}.")
 
 # ========== 新增：下载视频到本地 ==========
 def download_video(video_url, save_path='./downloaded_video.mp4', chunk_size=1024*1024):
@@ -174,35 +187,16 @@ def download_video(video_url, save_path='./downloaded_video.mp4', chunk_size=102
     :param video_url: 视频远程URL
     :param save_path: 本地保存路径（默认当前目录，文件名downloaded_video.mp4）
     :param chunk_size: 分块下载大小（默认1MB，避免内存占用过大）
+    :return: 成功时返回 save_path，失败时返回 None
     """
     try:
-        # 发送GET请求（添加超时，避免无限等待）
-        response = requests.get(video_url, stream=True, timeout=30)
-        response.raise_for_status()  # 抛出HTTP错误（如404/500）
-
-        # 获取文件总大小（可选，用于进度提示）
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded_size = 0
-
-        # 写入文件（分块下载，适合大文件）
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if chunk:  # 过滤空块
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    # 打印下载进度（可选）
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        print(f"下载进度: {progress:.1f}% ({downloaded_size}/{total_size} bytes)", end='\r')
-
-        print(f"\n视频已成功保存到: {os.path.abspath(save_path)}")
+        # 大文件会按 Range 分段并行下载，校验大小后才重命名为 save_path
+        download(video_url, save_path, chunk_size=chunk_size)
+        logging.debug(f"视频已成功保存到: {os.path.abspath(save_path)}")
         return save_path
-
-    except requests.exceptions.RequestException as e:
-        print(f"\n下载失败: {str(e)}")
-        # 清理未下载完成的文件
-        if os.path.exists(save_path):
-            os.remove(save_path)
+    except DownloadError as e:
+        # 已下载的部分保留在 .part 文件中，下次调用时断点续传
+        logging.warning(f"⚠️ 下载失败: {str(e)}")
         return None
 
 if __name__ == "__main__":
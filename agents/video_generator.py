@@ -1,25 +1,207 @@
 import json
 import os
 import logging
-from .utils import sample_call_i2v
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .utils import sample_call_i2v, i2v_model
+from .video_jobs import VideoJob, VideoJobEngine, failure_status, save_shot_status
+from .artifact_cache import artifact_cache, artifact_key, file_digest
 from .state import VideoGenState
+from .tracing import in_context
+
+# "async" submits every shot up front and polls the tasks; "sync" blocks a worker per shot.
+VIDEO_SYNTHESIS_MODE = os.getenv("VIDEO_SYNTHESIS_MODE", "async")
+# Maximum number of shots rendered concurrently in "sync" mode, and in flight while streaming. Set to 1 to render serially.
+VIDEO_MAX_CONCURRENCY = int(os.getenv("VIDEO_MAX_CONCURRENCY", "4"))
+# Shots whose frames are ready but that have not been handed to video synthesis yet.
+# Frame generation blocks once this many are waiting.
+VIDEO_QUEUE_SIZE = int(os.getenv("VIDEO_QUEUE_SIZE", "8"))
+
+
+def _video_job_for_shot(shot_root, shot_description):
+    frame_paths = []
+    frame_paths.append(os.path.join(shot_root, "first_frame.png"))
+    last_frame_path = os.path.join(shot_root, "last_frame.png")
+    # Last frames are only generated for medium/large variation shots. A last_frame.png left over
+    # from an earlier storyboard of a small variation shot must not end up in the video or its key.
+    if shot_description.variation_type in ["medium", "large"] and os.path.exists(last_frame_path):
+        frame_paths.append(last_frame_path)
+    prompt=shot_description.motion_desc + "\n" + shot_description.audio_desc
+    key = artifact_key(i2v_model(frame_paths), prompt, [file_digest(frame_path) for frame_path in frame_paths])
+    return VideoJob(prompt=prompt, image_paths=frame_paths, shot_root=shot_root, key=key)
+
+
+def _generate_video_for_shot(job: VideoJob, shot_description):
+    try:
+        sample_call_i2v(job.prompt, job.image_paths, job.video_path)
+    except Exception as e:
+        save_shot_status(job.shot_root, failure_status(e), str(e), getattr(e, "attempts", None))
+        raise
+    save_shot_status(job.shot_root, "SUCCEEDED")
+    artifact_cache.store(job.video_path, job.key)
+    logging.info(f"☑️ Generated video for shot {shot_description.idx}, saved to {job.video_path}.")
+
+
+def _pending_shot(state: VideoGenState, idx: int, shot_idx: int, shot_description):
+    """Return the job rendering one shot, or None if its video is cached or its frames are missing."""
+    shot_root = os.path.join(state['cache_dir'], f"scene_{idx}", f"shot_{shot_idx}")
+    try:
+        job = _video_job_for_shot(shot_root, shot_description)
+    except FileNotFoundError as e:
+        logging.error(f"❌ Cannot generate video for scene {idx} shot {shot_description.idx}, missing frame: {e.filename}")
+        return None
+    if artifact_cache.lookup(job.video_path, job.key):
+        logging.info(f"🚀 Skipped generating video for shot {shot_description.idx}, already exists.")
+        return None
+    return job
+
+
+def _pending_shots(state: VideoGenState, idx: int, shot_descriptions):
+    pending = []
+    for j, shot_description in enumerate(shot_descriptions):
+        job = _pending_shot(state, idx, j, shot_description)
+        if job is not None:
+            pending.append((idx, job, shot_description))
+    return pending
+
+
+def _render_shots(pending):
+    if not pending:
+        return
+
+    if VIDEO_SYNTHESIS_MODE == "async":
+        jobs = [job for _, job, _ in pending]
+        results = VideoJobEngine().run(jobs)
+        for job in jobs:
+            if results.get(job.shot_root) == "SUCCEEDED":
+                artifact_cache.store(job.video_path, job.key)
+        failed = [shot_root for shot_root, status in results.items() if status != "SUCCEEDED"]
+        if failed:
+            logging.warning(f"⚠️ {len(failed)}/{len(pending)} shots failed to generate: {failed}")
+        return
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, VIDEO_MAX_CONCURRENCY)) as executor:
+        futures = {
+            executor.submit(in_context(_generate_video_for_shot), job, shot_description): (idx, shot_description)
+            for idx, job, shot_description in pending
+        }
+        for future in as_completed(futures):
+            idx, shot_description = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                # A failed shot must not abort the others; it is retried on the next run.
+                failed.append((idx, shot_description.idx))
+                logging.error(f"❌ Failed to generate video for scene {idx} shot {shot_description.idx}: {e}")
+
+    if failed:
+        logging.warning(f"⚠️ {len(failed)}/{len(pending)} shots failed to generate: {failed}")
+
+
+class VideoStream:
+    """Render shots in the background as soon as they are handed over with ``put``.
+
+    Shots flow through a bounded queue to a consumer thread, so video
+    synthesis of early shots overlaps with frame generation of later ones.
+    The consumer keeps at most ``VIDEO_MAX_CONCURRENCY`` shots in flight and
+    ``put`` blocks once ``maxsize`` more are waiting, which stops the frame
+    generator from racing ahead of synthesis. ``close`` waits for every shot.
+    If the consumer itself fails, later shots are no longer queued and
+    ``close`` marks every shot without a result as failed and re-raises.
+    """
+
+    def __init__(self, maxsize=VIDEO_QUEUE_SIZE, max_concurrency=VIDEO_MAX_CONCURRENCY):
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.max_concurrency = max(1, max_concurrency)
+        self.shots = {}
+        self.results = {}
+        self.error = None
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=in_context(self._consume), daemon=True)
+        self.thread.start()
+
+    def put(self, state: VideoGenState, idx: int, shot_idx: int, shot_description):
+        job = _pending_shot(state, idx, shot_idx, shot_description)
+        if job is not None:
+            self.shots[job.shot_root] = (idx, job, shot_description)
+            if self.error is None:
+                self.queue.put(job)
+
+    def close(self):
+        self.closed.set()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            for shot_root in self.shots:
+                if shot_root not in self.results:
+                    self.results[shot_root] = "FAILED"
+                    save_shot_status(shot_root, failure_status(self.error), str(self.error))
+            raise self.error
+        failed = [shot_root for shot_root, status in self.results.items() if status != "SUCCEEDED"]
+        if failed:
+            logging.warning(f"⚠️ {len(failed)}/{len(self.shots)} shots failed to generate: {failed}")
+        return self.results
+
+    def _consume(self):
+        try:
+            self._render()
+        except BaseException as e:
+            self.error = e
+            logging.error(f"❌ Video synthesis stopped; queued and later shots are not rendered: {e}")
+            self._drain()
+
+    def _drain(self):
+        # Keep emptying the queue, so that put and close never block on a consumer that is gone.
+        while True:
+            try:
+                if self.queue.get(timeout=0.1) is None:
+                    return
+            except queue.Empty:
+                if self.closed.is_set():
+                    return
+
+    def _render(self):
+        if VIDEO_SYNTHESIS_MODE == "async":
+            self.results = VideoJobEngine().run_stream(self.queue, max_in_flight=self.max_concurrency)
+            for shot_root, status in self.results.items():
+                if status == "SUCCEEDED":
+                    _, job, _ = self.shots[shot_root]
+                    artifact_cache.store(job.video_path, job.key)
+            return
+
+        slots = threading.Semaphore(self.max_concurrency)
+
+        def render(job):
+            idx, _, shot_description = self.shots[job.shot_root]
+            try:
+                _generate_video_for_shot(job, shot_description)
+                self.results[job.shot_root] = "SUCCEEDED"
+            except Exception as e:
+                self.results[job.shot_root] = "FAILED"
+                logging.error(f"❌ Failed to generate video for scene {idx} shot {shot_description.idx}: {e}")
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while True:
+                # Only take the next shot off the queue once a worker is free.
+                slots.acquire()
+                job = self.queue.get()
+                if job is None:
+                    break
+                executor.submit(in_context(render), job)
+
+
+def generate_videos_for_scene(state: VideoGenState, idx: int, shot_descriptions):
+    _render_shots(_pending_shots(state, idx, shot_descriptions))
 
 
 def generate_single_video(state: VideoGenState) -> VideoGenState:
+    pending = []
     for idx, shots in enumerate(state["shot_descriptions"]):
-        for j, shot_description in enumerate(shots):
-            video_path = os.path.join(state['cache_dir'], f"scene_{idx}", f"shot_{j}", "video.mp4")
-            if os.path.exists(video_path):
-                logging.info(f"🚀 Skipped generating video for shot {shot_description.idx}, already exists.")
-                pass
-            else:
-                frame_paths = []
-                frame_paths.append(os.path.join(state['cache_dir'], f"scene_{idx}", f"shot_{j}", "first_frame.png"))
-                last_frame_path = os.path.join(state['cache_dir'], f"scene_{idx}", f"shot_{j}", "last_frame.png")
-                if os.path.exists(last_frame_path):
-                    frame_paths.append(last_frame_path)
-                prompt=shot_description.motion_desc + "\n" + shot_description.audio_desc
-                sample_call_i2v(prompt, frame_paths, video_path)
-                logging.info(f"☑️ Generated video for shot {shot_description.idx}, saved to {video_path}.")
-
-    return state
\ No newline at end of file
+        pending.extend(_pending_shots(state, idx, shots))
+    _render_shots(pending)
+
+    return state
@@ -0,0 +1,359 @@
+"""Submit-then-poll video synthesis.
+
+Every shot is submitted with ``VideoSynthesis.async_call`` and the returned
+task id is persisted to ``task.json`` in the shot directory before polling
+starts. A run that dies after submission therefore resumes polling the same
+task instead of paying for the shot a second time.
+
+Throttled and transient submissions are retried with backoff, and tasks
+that fail for a transient reason are resubmitted within the same run. How
+every shot ended up is written to ``status.json`` in its directory.
+
+Every task holds one of its model's concurrency slots (see ``rate_limit``)
+from submission until it finishes, so the provider's quota of concurrent
+tasks is shared with every other run in the process; jobs whose model has
+no free slot wait while the engine keeps polling. Finished tasks and
+throttled submissions are fed back to the model's adaptive limit.
+"""
+import json
+import os
+import queue
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List
+from pydantic import BaseModel
+from .utils import api_key, i2v_arguments, i2v_model, download_video
+from .clients import get_session
+from .downloader import DownloadError
+from .providers import get_provider
+from .rate_limit import get_rate_limiter
+from .retry import ProviderError, PROVIDER_RETRIES, PERMANENT, REJECTED, THROTTLED, as_provider_error, call_with_retry, check_response, classify
+from .tracing import in_context, record, span
+
+TASK_FILE = "task.json"
+STATUS_FILE = "status.json"
+
+# Statuses after which a task will never produce a video; such tasks are resubmitted.
+DEAD_STATUSES = ("FAILED", "CANCELED", "UNKNOWN")
+# Rate limit entry of task status queries, which share one quota across models.
+TASK_QUERY = "task_query"
+
+
+class VideoTask(BaseModel):
+    task_id: str
+    model: str
+    key: Optional[str] = None
+    task_status: str = "PENDING"
+    submitted_at: float
+    # When this run picked up a task submitted by an earlier one; the timeout counts from here.
+    resumed_at: Optional[float] = None
+    video_url: Optional[str] = None
+    code: Optional[str] = None
+    message: Optional[str] = None
+
+
+class ShotStatus(BaseModel):
+    """Outcome of a shot's last synthesis: SUCCEEDED, or the kind of failure in upper case
+    (THROTTLED, TRANSIENT, REJECTED, PERMANENT), TIMED_OUT or DOWNLOAD_FAILED."""
+    status: str
+    message: Optional[str] = None
+    attempts: Optional[int] = None
+    updated_at: float
+
+
+class VideoJob(BaseModel):
+    prompt: str
+    image_paths: List[str]
+    shot_root: str
+    # Artifact cache key of the inputs; a persisted task for different inputs is not resumed.
+    key: Optional[str] = None
+
+    @property
+    def video_path(self):
+        return os.path.join(self.shot_root, "video.mp4")
+
+    @property
+    def task_path(self):
+        return os.path.join(self.shot_root, TASK_FILE)
+
+
+def load_task(job: VideoJob) -> Optional[VideoTask]:
+    if not os.path.exists(job.task_path):
+        return None
+    with open(job.task_path, "r", encoding="utf-8") as f:
+        return VideoTask.model_validate(json.load(f))
+
+
+def save_task(job: VideoJob, task: VideoTask):
+    tmp_path = job.task_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(task.model_dump(), f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, job.task_path)
+
+
+def failure_status(error: BaseException) -> str:
+    if isinstance(error, ProviderError):
+        return error.kind.upper()
+    if isinstance(error, DownloadError):
+        return "DOWNLOAD_FAILED"
+    return PERMANENT.upper()
+
+
+def save_shot_status(shot_root, status, message=None, attempts=None):
+    path = os.path.join(shot_root, STATUS_FILE)
+    shot_status = ShotStatus(status=status, message=message, attempts=attempts, updated_at=time.time())
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(shot_status.model_dump(), f, ensure_ascii=False, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def load_shot_status(shot_root) -> Optional[ShotStatus]:
+    path = os.path.join(shot_root, STATUS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return ShotStatus.model_validate(json.load(f))
+
+
+class VideoJobEngine:
+    """Submit all jobs up front, poll them adaptively and download as they finish.
+
+    ``synthesis`` is anything exposing the ``async_call``/``fetch`` pair of
+    ``dashscope.VideoSynthesis``, by default the active provider's.
+    The poll interval starts at ``min_poll_interval``, grows by ``backoff``
+    after every round in which nothing finished and snaps back as soon as a
+    task completes. A task is given up on after ``timeout`` seconds, counted
+    from when this run submitted or resumed it, or after ``max_poll_failures``
+    status queries in a row have raised; either way it stays persisted and is
+    resumed by the next run.
+    """
+
+    def __init__(self, synthesis=None, min_poll_interval=2.0, max_poll_interval=30.0,
+                 backoff=1.5, timeout=3600.0, download_workers=4, max_poll_failures=10):
+        self.synthesis = synthesis or get_provider().video_synthesis
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_poll_failures = max_poll_failures
+        self.download_workers = download_workers
+
+    def submit(self, job: VideoJob, blocking=True) -> Optional[VideoTask]:
+        """Submit ``job``, or resume its persisted task, holding a slot of the model until ``release``.
+
+        Without ``blocking``, return None instead of waiting when the model has no free slot.
+        """
+        task = load_task(job)
+        resumed = task is not None and task.task_status not in DEAD_STATUSES and task.key == job.key
+        limit = get_rate_limiter().get(task.model if resumed else i2v_model(job.image_paths))
+        if not limit.acquire(blocking=blocking):
+            return None
+        if resumed:
+            logging.info(f"🔁 Resuming video task {task.task_id} for {job.shot_root}.")
+            task.resumed_at = time.time()
+            return task
+        try:
+            return self._submit(job)
+        except BaseException:
+            limit.release()
+            raise
+
+    @staticmethod
+    def release(task: VideoTask):
+        limit = get_rate_limiter().get(task.model)
+        limit.release()
+        if task.task_status == "SUCCEEDED":
+            # Task durations include queueing at the provider, so they are no latency signal.
+            limit.on_success()
+        elif task.task_status in DEAD_STATUSES and classify(None, task.code) == THROTTLED:
+            limit.on_throttle()
+
+    def _submit(self, job: VideoJob) -> VideoTask:
+        arguments = i2v_arguments(job.prompt, job.image_paths)
+
+        def call():
+            rsp = self.synthesis.async_call(api_key=api_key, session=get_session("dashscope"), **arguments)
+            s.set(status_code=int(rsp.status_code), request_id=getattr(rsp, "request_id", None))
+            return check_response(rsp, f"Submitting video task for {job.shot_root}")
+
+        with span("video submit", "provider", model=arguments["model"], shot=job.shot_root,
+                  request_bytes=sum(len(value) for value in arguments.values() if isinstance(value, str))) as s:
+            rsp = call_with_retry(call, f"Submitting video task for {job.shot_root}",
+                                  on_throttle=get_rate_limiter().get(arguments["model"]).on_throttle)
+        task = VideoTask(
+            task_id=rsp.output.task_id,
+            model=arguments["model"],
+            key=job.key,
+            task_status=rsp.output.task_status,
+            submitted_at=time.time(),
+        )
+        save_task(job, task)
+        logging.info(f"📤 Submitted video task {task.task_id} for {job.shot_root}.")
+        return task
+
+    def poll(self, job: VideoJob, task: VideoTask) -> VideoTask:
+        get_rate_limiter().get(TASK_QUERY).take_token()
+        rsp = check_response(self.synthesis.fetch(task.task_id, api_key=api_key), f"Querying video task {task.task_id}")
+        video_url = getattr(rsp.output, "video_url", None) or None
+        if rsp.output.task_status != task.task_status or video_url != task.video_url:
+            # Result URLs expire, so always keep the most recently issued one.
+            task.task_status = rsp.output.task_status
+            task.video_url = video_url
+            task.code = getattr(rsp.output, "code", None) or rsp.code or None
+            task.message = getattr(rsp.output, "message", None) or rsp.message or None
+            save_task(job, task)
+        return task
+
+    def run(self, jobs: List[VideoJob]) -> dict:
+        """Run ``jobs`` to completion and return ``{shot_root: status}``, see ``ShotStatus``."""
+        source = queue.Queue()
+        for job in jobs:
+            source.put(job)
+        source.put(None)
+        return self.run_stream(source)
+
+    def run_stream(self, source: queue.Queue, max_in_flight: Optional[int] = None) -> dict:
+        """Like ``run``, but take jobs from ``source`` as they arrive until a ``None`` sentinel.
+
+        New jobs are submitted while earlier ones are still being polled, so
+        synthesis can start before the producer has finished. With
+        ``max_in_flight`` set, no more jobs are taken from ``source`` while
+        that many tasks are pending, so a bounded ``source`` pushes back on
+        its producer. Neither are they while a job waits for a slot of its model.
+        """
+        results = {}
+        pending = {}
+        resubmits = {}
+        # Consecutive failed status queries per shot.
+        poll_failures = {}
+        # Jobs whose model had no free slot; their submission is retried every round.
+        waiting = deque()
+        closed = False
+        interval = self.min_poll_interval
+
+        def has_room():
+            return not closed and not waiting and (max_in_flight is None or len(pending) < max_in_flight)
+
+        def fail(job, status, message, attempts=None):
+            results[job.shot_root] = status
+            save_shot_status(job.shot_root, status, message, attempts)
+            logging.error(f"❌ Video for {job.shot_root} failed ({status}): {message}")
+
+        def accept(job):
+            nonlocal closed
+            if job is None:
+                closed = True
+                return
+            try:
+                task = self.submit(job, blocking=False)
+            except Exception as e:
+                fail(job, failure_status(e), str(e), getattr(e, "attempts", None))
+                return
+            if task is None:
+                waiting.append(job)
+            else:
+                pending[job.shot_root] = (job, task)
+
+        def finish(shot_root):
+            job, task = pending.pop(shot_root)
+            self.release(task)
+            return job
+
+        with ThreadPoolExecutor(max_workers=max(1, self.download_workers)) as executor:
+            downloads = {}
+            try:
+                while True:
+                    for _ in range(len(waiting)):
+                        accept(waiting.popleft())
+                    # Take the jobs that have arrived while there is room; block only when nothing is in flight.
+                    block = not pending and not waiting
+                    while has_room():
+                        try:
+                            job = source.get(block=block)
+                        except queue.Empty:
+                            break
+                        block = False
+                        accept(job)
+                    if not pending:
+                        if closed and not waiting:
+                            break
+                        if waiting:
+                            # Every slot is held by other runs; wait for one of them to finish.
+                            time.sleep(self.min_poll_interval)
+                        continue
+
+                    finished = False
+                    for shot_root, (job, task) in list(pending.items()):
+                        timed_out = time.time() - (task.resumed_at or task.submitted_at) > self.timeout
+                        try:
+                            task = self.poll(job, task)
+                        except Exception as e:
+                            error = as_provider_error(e)
+                            failures = poll_failures[shot_root] = poll_failures.get(shot_root, 0) + 1
+                            logging.warning(f"⚠️ Failed to query video task {task.task_id} ({failures}/{self.max_poll_failures}): {e}")
+                            if not error.retryable:
+                                # An unknown or expired task id will not answer on the next run either; submit the shot anew then.
+                                finish(shot_root)
+                                task.task_status = "UNKNOWN"
+                                save_task(job, task)
+                                fail(job, error.kind.upper(), f"Gave up querying video task {task.task_id}: {e}", failures)
+                            elif timed_out or failures >= self.max_poll_failures:
+                                finish(shot_root)
+                                fail(job, "TIMED_OUT" if timed_out else error.kind.upper(),
+                                     f"Gave up querying video task {task.task_id} after {failures} failed queries: {e}; it will be resumed on the next run.")
+                            continue
+                        poll_failures.pop(shot_root, None)
+                        if task.task_status in ("SUCCEEDED",) + DEAD_STATUSES:
+                            # From submission to the poll that saw the task finish.
+                            record(f"video task {shot_root}", "provider", task.submitted_at, time.time(),
+                                   model=task.model, task_id=task.task_id, status=task.task_status)
+                        if task.task_status == "SUCCEEDED":
+                            finished = True
+                            finish(shot_root)
+                            downloads[shot_root] = (job, executor.submit(in_context(download_video), task.video_url, job.video_path))
+                        elif task.task_status in DEAD_STATUSES:
+                            finished = True
+                            finish(shot_root)
+                            kind = PERMANENT if task.task_status == "CANCELED" else classify(None, task.code)
+                            message = f"Video task {task.task_id} ended with {task.task_status}, code: {task.code}, message: {task.message}"
+                            attempts = resubmits.get(shot_root, 0) + 1
+                            if kind not in (PERMANENT, REJECTED) and attempts <= PROVIDER_RETRIES:
+                                # A task that failed for a transient reason is worth paying for again right away.
+                                resubmits[shot_root] = attempts
+                                logging.warning(f"⚠️ {message}; resubmitting (attempt {attempts + 1}/{PROVIDER_RETRIES + 1}).")
+                                accept(job)
+                            else:
+                                fail(job, kind.upper(), message, attempts)
+                        elif timed_out:
+                            finish(shot_root)
+                            fail(job, "TIMED_OUT", f"Timed out waiting for video task {task.task_id}; it will be resumed on the next run.")
+                        else:
+                            pending[shot_root] = (job, task)
+                    if not pending:
+                        continue
+
+                    interval = self.min_poll_interval if finished else min(interval * self.backoff, self.max_poll_interval)
+                    if not has_room():
+                        time.sleep(interval)
+                    else:
+                        # Wait out the poll interval, but submit a new job immediately if one arrives.
+                        try:
+                            accept(source.get(timeout=interval))
+                        except queue.Empty:
+                            pass
+            finally:
+                # Give back the slots of tasks left pending when the run is aborted.
+                for shot_root in list(pending):
+                    finish(shot_root)
+
+            for shot_root, (job, future) in downloads.items():
+                if future.result() is not None:
+                    results[shot_root] = "SUCCEEDED"
+                    save_shot_status(shot_root, "SUCCEEDED", attempts=resubmits.get(shot_root, 0) + 1)
+                    logging.info(f"☑️ Generated video, saved to {os.path.join(shot_root, 'video.mp4')}.")
+                else:
+                    fail(job, "DOWNLOAD_FAILED", f"Failed to download {job.video_path}; the partial file is resumed on the next run.")
+
+        return results
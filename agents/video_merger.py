@@ -1,27 +1,268 @@
 import json
 import os
+import re
 import logging
-from moviepy import VideoFileClip, concatenate_videoclips
+import subprocess
+import tempfile
+from collections import Counter
+from functools import lru_cache
+from .artifact_cache import artifact_cache, artifact_key, file_digest
 from .state import VideoGenState
+from .video_jobs import load_shot_status
+
+# "auto" concatenates by stream copy and only re-encodes clips whose parameters differ;
+# "reencode" always decodes and re-encodes the whole film.
+VIDEO_MERGE_MODE = os.getenv("VIDEO_MERGE_MODE", "auto")
+# Settings of the encoder used when the film has to be re-encoded.
+VIDEO_ENCODER_THREADS = int(os.getenv("VIDEO_ENCODER_THREADS", "0"))  # 0 lets libx264 decide
+VIDEO_ENCODER_PRESET = os.getenv("VIDEO_ENCODER_PRESET", "medium")
+VIDEO_ENCODER_CRF = int(os.getenv("VIDEO_ENCODER_CRF", "23"))
+
+AUDIO_RATE = 44100
+AUDIO_CHANNELS = 2
+_PIPE_CHUNK = 1 << 20
+
+# Encoders used to bring a mismatching clip in line with the others, by codec name.
+_VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+_AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame"}
+
+_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: (Video|Audio): (.*)")
+
+
+@lru_cache(maxsize=None)
+def _ffmpeg_binary():
+    # The ffmpeg moviepy resolves; importing moviepy takes most of a second, so only when merging.
+    from moviepy.config import FFMPEG_BINARY
+    return FFMPEG_BINARY
+
+
+def _ffmpeg(*args):
+    subprocess.run([_ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", *args], check=True, capture_output=True)
+
+
+def _probe(path) -> tuple:
+    """Return the stream parameters that must agree for clips to be joined without re-encoding."""
+    # ffmpeg without an output prints the stream summary and exits with an error.
+    proc = subprocess.run([_ffmpeg_binary(), "-hide_banner", "-i", path], capture_output=True, text=True)
+    streams = []
+    for kind, desc in _STREAM_RE.findall(proc.stderr):
+        fields = [field.strip() for field in re.split(r",(?![^(]*\))", desc)]
+        codec = fields[0].split()[0]
+        if kind == "Video":
+            size = re.search(r"\b([1-9]\d*)x([1-9]\d*)\b", desc)
+            fps = re.search(r"([\d.]+) (?:fps|tbr)", desc)
+            pix_fmt = fields[1].split("(")[0] if len(fields) > 1 else None
+            streams.append(("video", codec, pix_fmt, tuple(map(int, size.groups())) if size else None, float(fps.group(1)) if fps else None))
+        else:
+            rate = re.search(r"(\d+) Hz", desc)
+            layout = fields[2] if len(fields) > 2 else None
+            streams.append(("audio", codec, int(rate.group(1)) if rate else None, layout))
+    streams.sort(key=lambda stream: stream[0] != "video")
+    if not streams or streams[0][0] != "video":
+        raise RuntimeError(f"No video stream found in {path}.")
+    return tuple(streams)
+
+
+def _normalize(src, dst, signature, src_signature):
+    """Re-encode ``src`` so that its streams match ``signature``."""
+    _, codec, pix_fmt, (width, height), fps = signature[0]
+    audio = next((stream for stream in signature if stream[0] == "audio"), None)
+    has_audio = any(stream[0] == "audio" for stream in src_signature)
+
+    args = ["-i", src]
+    if audio is not None and not has_audio:
+        # Pad with silence so the joined audio track stays continuous.
+        args += ["-f", "lavfi", "-i", f"anullsrc=r={audio[2]}:cl={audio[3]}"]
+    args += ["-map", "0:v:0", "-vf", f"scale={width}:{height},setsar=1,fps={fps}",
+             "-c:v", _VIDEO_ENCODERS[codec], "-pix_fmt", pix_fmt]
+    if audio is None:
+        args += ["-an"]
+    else:
+        args += ["-map", "0:a:0" if has_audio else "1:a:0", "-c:a", _AUDIO_ENCODERS[audio[1]], "-ar", str(audio[2])]
+        if not has_audio:
+            args += ["-shortest"]
+    _ffmpeg(*args, dst)
+
+
+def _can_normalize(signature) -> bool:
+    video = signature[0]
+    audio = [stream for stream in signature if stream[0] == "audio"]
+    return (
+        video[1] in _VIDEO_ENCODERS and None not in video
+        and all(stream[1] in _AUDIO_ENCODERS and None not in stream for stream in audio)
+        and len(signature) == 1 + len(audio) <= 2
+    )
+
+
+def _concat_list(paths, list_path):
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def _merge_by_stream_copy(video_paths, final_video_path) -> bool:
+    """Join the clips without re-encoding them, normalizing only the odd ones out.
+
+    Returns False if the clips cannot be brought to common parameters.
+    """
+    signatures = [_probe(video_path) for video_path in video_paths]
+    reference = Counter(signatures).most_common(1)[0][0]
+    mismatched = [i for i, signature in enumerate(signatures) if signature != reference]
+    if mismatched and not _can_normalize(reference):
+        return False
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(final_video_path) or ".") as tmp_dir:
+        paths = list(video_paths)
+        for i in mismatched:
+            paths[i] = os.path.join(tmp_dir, f"normalized_{i}.mp4")
+            _normalize(video_paths[i], paths[i], reference, signatures[i])
+        if mismatched:
+            logging.info(f"⚙️ Re-encoded {len(mismatched)}/{len(paths)} clips whose parameters differ from the rest.")
+
+        list_path = os.path.join(tmp_dir, "concat.txt")
+        _concat_list(paths, list_path)
+        output_path = os.path.join(tmp_dir, "final_video.mp4")
+        # The concat demuxer moves each clip's H.264 parameter sets in-band (auto_convert),
+        # so normalized clips with their own encoder settings still decode after the join.
+        _ffmpeg("-f", "concat", "-safe", "0", "-i", list_path, "-map", "0", "-c", "copy", "-movflags", "+faststart", output_path)
+        os.replace(output_path, final_video_path)
+    return True
+
+
+def _pipe(src, dst, limit=None) -> int:
+    """Copy from ``src`` to ``dst`` in fixed-size chunks, at most ``limit`` bytes; return the bytes copied."""
+    copied = 0
+    while limit is None or copied < limit:
+        chunk = src.read(_PIPE_CHUNK if limit is None else min(_PIPE_CHUNK, limit - copied))
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
+    return copied
+
+
+def _decode(args):
+    return subprocess.Popen([_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def _finish(process, what):
+    process.stdout.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to {what}.")
+
+
+def _merge_by_reencode(video_paths, final_video_path, threads=None, preset=None, crf=None):
+    """Re-encode the film by streaming the clips, one at a time, into a single encoder.
+
+    Each clip is decoded by its own ffmpeg process to raw frames at the
+    film's size and frame rate, which are piped into one long-running
+    encoder; its audio is appended to a raw PCM track cut to the exact
+    length of its frames. Only one clip is open at any time and data is
+    passed through in fixed-size chunks, so memory does not grow with the
+    number of shots.
+    """
+    threads = VIDEO_ENCODER_THREADS if threads is None else threads
+    preset = VIDEO_ENCODER_PRESET if preset is None else preset
+    crf = VIDEO_ENCODER_CRF if crf is None else crf
+
+    signatures = [_probe(video_path) for video_path in video_paths]
+    _, _, _, size, fps = Counter(signature[0] for signature in signatures).most_common(1)[0][0]
+    width, height = size or (1280, 720)
+    fps = fps or 24.0
+    has_audio = [any(stream[0] == "audio" for stream in signature) for signature in signatures]
+    frame_bytes = width * height * 3
+    sample_bytes = AUDIO_CHANNELS * 2
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(final_video_path) or ".") as tmp_dir:
+        video_only_path = os.path.join(tmp_dir, "video.mp4")
+        audio_path = os.path.join(tmp_dir, "audio.pcm")
+        encoder = subprocess.Popen([
+            _ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-threads", str(threads),
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart", video_only_path,
+        ], stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            frames = 0
+            samples = 0
+            with open(audio_path, "wb") as audio_file:
+                for video_path, clip_has_audio in zip(video_paths, has_audio):
+                    decoder = _decode([
+                        "-i", video_path, "-map", "0:v:0",
+                        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps}",
+                        "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+                    ])
+                    frames += _pipe(decoder.stdout, encoder.stdin) // frame_bytes
+                    _finish(decoder, f"decode {video_path}")
+
+                    if not any(has_audio):
+                        continue
+                    # Cut or pad every clip's audio to end exactly where its frames end, so that
+                    # rounding does not accumulate into drift over a long film.
+                    target = round(frames / fps * AUDIO_RATE)
+                    if clip_has_audio:
+                        decoder = _decode([
+                            "-i", video_path, "-map", "0:a:0",
+                            "-f", "s16le", "-ac", str(AUDIO_CHANNELS), "-ar", str(AUDIO_RATE), "-",
+                        ])
+                        samples += _pipe(decoder.stdout, audio_file, (target - samples) * sample_bytes) // sample_bytes
+                        decoder.kill()
+                        decoder.stdout.close()
+                        decoder.wait()
+                    while samples < target:
+                        chunk = min(target - samples, _PIPE_CHUNK // sample_bytes)
+                        audio_file.write(bytes(chunk * sample_bytes))
+                        samples += chunk
+            encoder.stdin.close()
+            if encoder.wait() != 0:
+                raise RuntimeError("ffmpeg failed to encode the film.")
+        except BaseException:
+            encoder.kill()
+            encoder.wait()
+            raise
+
+        if any(has_audio):
+            output_path = os.path.join(tmp_dir, "final_video.mp4")
+            _ffmpeg(
+                "-i", video_only_path,
+                "-f", "s16le", "-ac", str(AUDIO_CHANNELS), "-ar", str(AUDIO_RATE), "-i", audio_path,
+                "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-movflags", "+faststart", output_path,
+            )
+        else:
+            output_path = video_only_path
+        os.replace(output_path, final_video_path)
 
 
 def merge_final_video(state: VideoGenState) -> VideoGenState:
     all_video_paths = []
+    missing = []
     final_video_path = os.path.join(state['cache_dir'], "final_video.mp4")
-    if os.path.exists(final_video_path):
+    for idx, shots in enumerate(state["shot_descriptions"]):
+        for j, shot_description in enumerate(shots):
+            shot_root = os.path.join(state['cache_dir'], f"scene_{idx}", f"shot_{j}")
+            video_path = os.path.join(shot_root, "video.mp4")
+            if not os.path.exists(video_path):
+                shot_status = load_shot_status(shot_root)
+                missing.append(f"scene {idx} shot {j}: " + (f"{shot_status.status} ({shot_status.message})" if shot_status else "not generated"))
+            all_video_paths.append(video_path)
+    if missing:
+        raise RuntimeError(f"{len(missing)}/{len(all_video_paths)} shots have no video:\n" + "\n".join(missing))
+
+    key = artifact_key("concatenate_videoclips", [file_digest(video_path) for video_path in all_video_paths])
+    if artifact_cache.lookup(final_video_path, key):
         logging.info(f"🚀 Skipped concatenating videos, already exists.")
     else:
         logging.info(f"🎬 Starting concatenating videos...")
-        for idx, shots in enumerate(state["shot_descriptions"]):
-            for j, shot_description in enumerate(shots):
-                video_path = os.path.join(state['cache_dir'], f"scene_{idx}", f"shot_{j}", "video.mp4")
-                assert os.path.exists(video_path)
-                all_video_paths.append(video_path)
-
-        video_clips = [VideoFileClip(final_video_path)
-                       for final_video_path in all_video_paths]
-        final_video = concatenate_videoclips(video_clips)
-        final_video.write_videofile(final_video_path)
+        merged = False
+        if VIDEO_MERGE_MODE == "auto":
+            try:
+                merged = _merge_by_stream_copy(all_video_paths, final_video_path)
+            except Exception as e:
+                logging.warning(f"⚠️ Stream copy concatenation failed, re-encoding instead: {e}")
+        if not merged:
+            _merge_by_reencode(all_video_paths, final_video_path)
+        artifact_cache.store(final_video_path, key)
         logging.info(f"☑️ Concatenated videos, saved to {final_video_path}.")
 
-    return state
\ No newline at end of file
+    return state
@@ -0,0 +1,106 @@
+"""Cold-start cost of the package: import time and what dominates it.
+
+Every target runs in a fresh interpreter, so nothing is cached between
+samples except the operating system's file cache. A target is a module to
+import or a statement to run after importing ``idea2video_agent``:
+
+- ``agents``: the package alone, as tools that only touch a few modules pay for it
+- ``agents.artifact_cache``: a light module used by cache and CLI tools
+- ``idea2video_agent``: every node, and the graph library
+- ``build_agent``: compiling the graph on top of that
+
+The slowest modules by cumulative import time (``python -X importtime``)
+are listed for each target. ``--max-seconds`` turns the run into a check
+that fails when a median exceeds the budget.
+
+    python benchmarks/import_time.py --repeat 5 --json import_time.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "agents": "import agents",
+    "agents.artifact_cache": "import agents.artifact_cache",
+    "idea2video_agent": "import idea2video_agent",
+    "build_agent": "import idea2video_agent; idea2video_agent.build_agent()",
+}
+
+_TIMER = "import time; _start = time.perf_counter(); {}; print(time.perf_counter() - _start)"
+
+
+def environment():
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    # Importing must not need credentials; nothing is called.
+    env.pop("DASHSCOPE_API_KEY", None)
+    return env
+
+
+def sample(statement) -> float:
+    proc = subprocess.run([sys.executable, "-c", _TIMER.format(statement)], cwd=ROOT, env=environment(),
+                          capture_output=True, text=True, check=True)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(statement, top):
+    """Return the ``top`` packages with the largest cumulative import time, and the number of modules loaded."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=ROOT, env=environment(),
+                          capture_output=True, text=True, check=True)
+    packages = {}
+    modules = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules += 1
+        # The largest cumulative time of any of a package's modules, which covers namespace packages
+        # such as langgraph that have no module of their own.
+        package = name.strip().split(".")[0]
+        packages[package] = max(packages.get(package, 0.0), int(cumulative) / 1e6)
+    return sorted(((seconds, package) for package, seconds in packages.items()), reverse=True)[:top], modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=8, help="slowest top-level imports to list")
+    parser.add_argument("--max-seconds", nargs="*", default=[], metavar="TARGET=SECONDS",
+                        help="fail when a target's median exceeds its budget, e.g. agents=0.2")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    args = parser.parse_args()
+
+    budgets = {name: float(seconds) for name, seconds in (item.split("=", 1) for item in args.max_seconds)}
+    results = []
+    for name in args.targets:
+        statement = TARGETS[name]
+        samples = [sample(statement) for _ in range(args.repeat)]
+        slowest, modules = slowest_modules(statement, args.top)
+        result = {
+            "target": name,
+            "median_seconds": round(statistics.median(samples), 4),
+            "min_seconds": round(min(samples), 4),
+            "modules_loaded": modules,
+            "slowest_imports": [{"module": module, "seconds": round(seconds, 4)} for seconds, module in slowest],
+        }
+        results.append(result)
+        print(json.dumps({key: result[key] for key in ("target", "median_seconds", "min_seconds", "modules_loaded")}))
+        print("    " + ", ".join(f"{module} {seconds:.3f}s" for seconds, module in slowest))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "runs": results}, f, indent=4)
+
+    over = [f"{result['target']} {result['median_seconds']}s > {budgets[result['target']]}s"
+            for result in results if result["target"] in budgets and result["median_seconds"] > budgets[result["target"]]]
+    if over:
+        sys.exit("Over the import time budget: " + "; ".join(over))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Memory regression benchmark for the re-encode path of merge_final_video.
+
+Generates synthetic shots with ffmpeg's test sources, merges them in a fresh
+process per run and reports the peak RSS of the merging process together
+with all the ffmpeg processes it spawns, sampled from /proc. The streaming
+compositor should use the same memory for 5 shots as for 60; the exit
+status is 1 if the largest run exceeds the smallest by more than
+--max-growth.
+
+    python benchmarks/merge_memory.py --clips 5 60
+    python benchmarks/merge_memory.py --clips 5 20 --engine moviepy   # the old merge, for comparison
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_clips(root, count, duration, size, fps):
+    from moviepy.config import FFMPEG_BINARY
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"clip_{i}.mp4")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        # Every other clip has a soundtrack, so the audio padding is exercised too.
+        audio = ["-f", "lavfi", "-i", f"sine=frequency={220 + 20 * i}:sample_rate=44100", "-c:a", "aac", "-ac", "2"] if i % 2 == 0 else []
+        subprocess.run([
+            FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}",
+            *audio, "-t", str(duration), "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+        ], check=True)
+    return paths
+
+
+def tree_rss(root_pid):
+    """Return the summed RSS in bytes of ``root_pid`` and its descendants, and their number (Linux only)."""
+    parents = {}
+    rss = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        rss[int(entry)] = int(fields[21]) * page_size
+    tree = {root_pid}
+    grew = True
+    while grew:
+        children = {pid for pid, ppid in parents.items() if ppid in tree} - tree
+        tree |= children
+        grew = bool(children)
+    return sum(rss.get(pid, 0) for pid in tree), len(tree)
+
+
+class TreeSampler(threading.Thread):
+    """Track the peak RSS of this process together with every process it spawns."""
+
+    def __init__(self, interval=0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_bytes = 0
+        self.peak_processes = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            total, processes = tree_rss(os.getpid())
+            self.peak_bytes = max(self.peak_bytes, total)
+            self.peak_processes = max(self.peak_processes, processes)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def merge_with_moviepy(paths, output_path):
+    from moviepy import VideoFileClip, concatenate_videoclips
+
+    clips = [VideoFileClip(path) for path in paths]
+    concatenate_videoclips(clips).write_videofile(output_path, logger=None)
+
+
+def worker(engine, paths, output_path):
+    from agents.video_merger import _merge_by_reencode
+
+    sampler = TreeSampler()
+    sampler.start()
+    start = time.perf_counter()
+    if engine == "moviepy":
+        merge_with_moviepy(paths, output_path)
+    else:
+        _merge_by_reencode(paths, output_path)
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    print(json.dumps({
+        "seconds": round(elapsed, 3),
+        # ru_maxrss is in KiB on Linux.
+        "peak_python_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_tree_rss_mib": round(sampler.peak_bytes / 1024 ** 2, 1),
+        "peak_processes": sampler.peak_processes,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", type=int, nargs="+", default=[5, 60], help="shot counts to merge")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per shot")
+    parser.add_argument("--size", default="640x360")
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--engine", choices=["streaming", "moviepy"], default="streaming")
+    parser.add_argument("--max-growth", type=float, default=1.5, help="allowed peak RSS ratio of the largest to the smallest run")
+    parser.add_argument("--workdir", default=None, help="where to keep the synthetic clips (default: a temporary directory)")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--worker", nargs=2, metavar=("CLIP_LIST", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        with open(args.worker[0], "r", encoding="utf-8") as f:
+            worker(args.engine, json.load(f), args.worker[1])
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="merge_memory_")
+    os.makedirs(workdir, exist_ok=True)
+    clips = make_clips(workdir, max(args.clips), args.duration, args.size, args.fps)
+
+    results = []
+    for count in sorted(args.clips):
+        clip_list = os.path.join(workdir, f"clips_{count}.json")
+        with open(clip_list, "w", encoding="utf-8") as f:
+            json.dump(clips[:count], f)
+        output_path = os.path.join(workdir, f"merged_{count}.mp4")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--engine", args.engine, "--worker", clip_list, output_path],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            sys.exit(proc.returncode)
+        result = {"engine": args.engine, "clips": count, **json.loads(proc.stdout.strip().splitlines()[-1])}
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    smallest, largest = results[0], results[-1]
+    growth = largest["peak_tree_rss_mib"] / smallest["peak_tree_rss_mib"]
+    print(f"peak memory growth from {smallest['clips']} to {largest['clips']} clips: {growth:.2f}x")
+    if growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
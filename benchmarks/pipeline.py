@@ -0,0 +1,235 @@
+"""End-to-end throughput and latency benchmark of the idea2video workflow.
+
+Runs the full LangGraph workflow from ``idea2video_agent.build_agent``
+against the offline stand-in provider (``PROVIDER=standin``), once per
+workload and each in a fresh process with a cold cache. A workload is
+``SCENESxSHOTSxCHARACTERS``. For every run it reports:
+
+- makespan: wall-clock time from the user idea to the final video
+- per-node time: calls, total and longest seconds of every graph node
+- API calls and bytes: chat, image and video requests, uploads and media downloads
+- peak RSS of the process and everything it spawns (ffmpeg), sampled from /proc
+
+Results are written as JSON together with the commit they were measured
+on; pass an earlier result file as --baseline to compare makespans.
+
+    python benchmarks/pipeline.py --workload 1x2x1 2x4x2 --video-latency 5 --json bench.json
+    python benchmarks/pipeline.py --workload 2x4x2 --baseline bench.json --env VIDEO_MAX_CONCURRENCY=8
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_workload(text):
+    scenes, shots, characters = (int(part) for part in text.lower().split("x"))
+    return {"scenes": scenes, "shots": shots, "characters": characters}
+
+
+def workload_env(workload, args):
+    lengths = {
+        "script": workload["scenes"],
+        "storyboard": workload["shots"],
+        "camera_parent_items": workload["shots"],
+        "decompositions": workload["shots"],
+        "characters": workload["characters"],
+    }
+    return {
+        "PROVIDER": "standin",
+        "STANDIN_CHAT_LATENCY": str(args.chat_latency),
+        "STANDIN_IMAGE_LATENCY": str(args.image_latency),
+        "STANDIN_VIDEO_LATENCY": str(args.video_latency),
+        "STANDIN_JITTER": str(args.jitter),
+        "STANDIN_LATENCY_DISTRIBUTION": args.distribution,
+        "STANDIN_FAILURE_RATE": str(args.failure_rate),
+        "STANDIN_THROTTLE_RATE": str(args.throttle_rate),
+        "STANDIN_LIST_LENGTHS": ",".join(f"{field}={length}" for field, length in lengths.items()),
+        "STANDIN_SEED": str(args.seed),
+        "DASHSCOPE_API_KEY": os.getenv("DASHSCOPE_API_KEY", "standin"),
+    }
+
+
+class NodeTimer:
+    """LangChain callback handler that times every LangGraph node run."""
+
+    def __init__(self):
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        timer = self
+        self.lock = threading.Lock()
+        self.started = {}
+        self.nodes = {}
+
+        class Handler(BaseCallbackHandler):
+            def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, name=None, **kwargs):
+                node = (metadata or {}).get("langgraph_node")
+                # Only the node itself, not the chains it runs.
+                if node is not None and name == node:
+                    with timer.lock:
+                        timer.started[run_id] = (node, time.perf_counter())
+
+            def on_chain_end(self, outputs, *, run_id, **kwargs):
+                timer.finish(run_id)
+
+            def on_chain_error(self, error, *, run_id, **kwargs):
+                timer.finish(run_id)
+
+        self.handler = Handler()
+
+    def finish(self, run_id):
+        with self.lock:
+            started = self.started.pop(run_id, None)
+            if started is None:
+                return
+            node, start = started
+            elapsed = time.perf_counter() - start
+            stats = self.nodes.setdefault(node, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def report(self):
+        with self.lock:
+            return {
+                node: {"calls": stats["calls"], "seconds": round(stats["seconds"], 3), "max_seconds": round(stats["max_seconds"], 3)}
+                for node, stats in self.nodes.items()
+            }
+
+
+def worker(workdir):
+    import logging
+    import uuid
+    from langgraph.types import Command
+    from merge_memory import TreeSampler
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", force=True)
+    import idea2video_agent
+    from agents.artifact_cache import artifact_cache
+    from agents.providers import get_provider
+    from agents.llm_cache import get_response_cache
+    from agents.rate_limit import get_rate_limiter
+    from agents.reference_image_selector import selection_stats
+    from agents.references import encoding_cache
+    from agents.tracing import finish_run
+
+    agent = idea2video_agent.build_agent()
+    timer = NodeTimer()
+    cache_dir = os.path.join(workdir, "working_dir")
+    os.makedirs(cache_dir, exist_ok=True)
+    config = {"configurable": {"thread_id": uuid.uuid4().hex}, "callbacks": [timer.handler]}
+
+    sampler = TreeSampler()
+    sampler.start()
+    start = time.perf_counter()
+    result = agent.invoke(idea2video_agent.initial_state(
+        idea2video_agent.user_idea, idea2video_agent.user_requirement, idea2video_agent.style, cache_dir,
+    ), config=config)
+    while "__interrupt__" in result:
+        result = agent.invoke(Command(resume=(True, "")), config=config)
+    makespan = time.perf_counter() - start
+    sampler.stop()
+    finish_run(cache_dir)
+
+    final_video = os.path.join(cache_dir, "final_video.mp4")
+    print(json.dumps({
+        "makespan_seconds": round(makespan, 3),
+        "nodes": timer.report(),
+        "api": get_provider().stats(),
+        "final_video_bytes": os.path.getsize(final_video) if os.path.exists(final_video) else None,
+        "artifact_cache": {"hits": artifact_cache.hits, "misses": artifact_cache.misses},
+        "encoding_cache": encoding_cache.stats(),
+        "llm_cache": get_response_cache().stats() if get_response_cache() else None,
+        "rate_limits": get_rate_limiter().stats(),
+        "reference_selection": selection_stats.stats(),
+        "peak_tree_rss_mib": round(sampler.peak_bytes / 1024 ** 2, 1),
+        "peak_processes": sampler.peak_processes,
+    }))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {run["workload_name"]: run for run in json.load(f)["runs"]}
+    for run in results:
+        before = baseline.get(run["workload_name"])
+        if before is None:
+            continue
+        ratio = run["makespan_seconds"] / before["makespan_seconds"]
+        print(f"{run['workload_name']}: makespan {before['makespan_seconds']}s -> {run['makespan_seconds']}s ({ratio:.2f}x), "
+              f"peak RSS {before['peak_tree_rss_mib']} -> {run['peak_tree_rss_mib']} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", nargs="+", default=["1x2x1", "2x4x2"], help="SCENESxSHOTSxCHARACTERS")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="seconds per LLM call")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="seconds per image generation or edit")
+    parser.add_argument("--video-latency", type=float, default=10.0, help="seconds per video task")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative spread of the latencies")
+    parser.add_argument("--distribution", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per workload")
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE", help="extra settings for the runs, e.g. VIDEO_MAX_CONCURRENCY=8")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--baseline", default=None, help="result file of an earlier run to compare against")
+    parser.add_argument("--worker", metavar="WORKDIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker)
+        return
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    results = []
+    for name in args.workload:
+        workload = parse_workload(name)
+        for repeat in range(args.repeat):
+            with tempfile.TemporaryDirectory(prefix="pipeline_bench_") as workdir:
+                env = {**os.environ, **workload_env(workload, args), **extra_env,
+                       "ARTIFACT_CACHE_DIR": os.path.join(workdir, "artifacts"),
+                       "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.sqlite"),
+                       "PYTHONPATH": os.pathsep.join([ROOT, os.path.dirname(os.path.abspath(__file__))])}
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--worker", workdir],
+                    cwd=workdir, env=env, capture_output=True, text=True,
+                )
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stderr)
+                sys.exit(proc.returncode)
+            run = {"workload_name": name, **workload, "repeat": repeat, **json.loads(proc.stdout.strip().splitlines()[-1])}
+            results.append(run)
+            print(json.dumps({key: run[key] for key in ("workload_name", "repeat", "makespan_seconds", "peak_tree_rss_mib")}))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("worker", "json", "baseline")},
+        "runs": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Request size and encoding time of reference images, per attachment mode.
+
+Simulates a scene whose shots each reference the same character portraits
+and the first frame of their parent shot, and builds the image-edit and
+image-to-video request arguments for every shot the way the pipeline does:
+
+- uncached: every request reads and base64-encodes its images (the old path)
+- cached: encodings are reused from the in-memory encoding cache
+- upload: each image is uploaded once to the stand-in upload service
+
+    python benchmarks/reference_payloads.py --shots 40 --characters 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_images(root, characters, size):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    portraits = []
+    for i in range(characters):
+        for view in ("front", "side", "back"):
+            path = os.path.join(root, f"character_{i}", f"{view}.png")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Image.fromarray(rng.integers(0, 255, (size, size, 3), dtype=np.uint8)).save(path)
+            portraits.append(path)
+    first_frame = os.path.join(root, "first_frame.png")
+    Image.fromarray(rng.integers(0, 255, (size, size, 3), dtype=np.uint8)).save(first_frame)
+    return portraits, first_frame
+
+
+def run(mode, shots, portraits, first_frame):
+    from agents import references, utils
+    from agents.standin import StandInUploader
+
+    references.encoding_cache.clear()
+    references.set_uploader(StandInUploader() if mode == "upload" else None)
+    if mode == "uncached":
+        references.encoding_cache.max_bytes = 0
+
+    payload_bytes = 0
+    start = time.process_time()
+    for _ in range(shots):
+        images = [utils.reference_image(path, utils.IMAGE_EDIT_MODEL) for path in portraits + [first_frame]]
+        arguments = utils.i2v_arguments("prompt", [first_frame])
+        payload_bytes += sum(len(image) for image in images) + len(json.dumps(arguments))
+    cpu_seconds = time.process_time() - start
+
+    references.encoding_cache.max_bytes = references.ENCODE_CACHE_MAX_BYTES
+    uploads = references.get_uploads()
+    return {
+        "mode": mode,
+        "shots": shots,
+        "request_mib": round(payload_bytes / 1024 ** 2, 2),
+        "cpu_seconds": round(cpu_seconds, 3),
+        "encode_cache": references.encoding_cache.stats(),
+        "uploads": uploads.stats() if uploads else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shots", type=int, default=40)
+    parser.add_argument("--characters", type=int, default=3)
+    parser.add_argument("--size", type=int, default=1024, help="width and height of the images in pixels")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="reference_payloads_") as root:
+        portraits, first_frame = make_images(root, args.characters, args.size)
+        results = [run(mode, args.shots, portraits, first_frame) for mode in ("uncached", "cached", "upload")]
+    for result in results:
+        print(json.dumps(result))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ from langgraph.graph import StateGraph, START, END
 # from agents import story_writer, character_extractor, character_portraits_generator, scene_writer, scene2video
 from agents import develop_story, extract_characters, generate_character_images, write_script_based_on_story, design_storyboard, design_shot, construct_camera_tree, VideoGenState
 from agents import select_reference_images_and_generate_prompt, generate_single_video, merge_final_video
+from agents import fan_out_scenes, dispatch_scenes, process_scene
+from agents.tracing import traced_node, finish_run
+from agents.checkpoint import SQLiteSaver, CHECKPOINT_DB
 from langchain.messages import AnyMessage
 import operator
 import os
@@ -20,47 +23,87 @@ def approval_node(state: VideoGenState):
         "story": state["story"],
     })
 
+    # Record the response as a state update, so that a resume only re-runs this node and develop_story sees each rejection once
+    need_regen = defaultdict(lambda: [False, ""], state["need_regen"])
+    need_regen["develop_story"] = [not is_approved, "" if is_approved else reason]
+    return {"need_regen": need_regen}
+
+
+def route_approval(state: VideoGenState):
     # Route based on the response
-    if is_approved:
-        return True  # Runs after the resume payload is provided
-    else:
-        state["need_regen"]["develop_story"] = [True, reason]
-        return False
-
-
-# Build workflow
-agent_builder = StateGraph(VideoGenState)
-
-# Add nodes
-agent_builder.add_node("develop_story", develop_story)
-agent_builder.add_node("extract_characters", extract_characters)
-agent_builder.add_node("generate_character_images", generate_character_images)
-agent_builder.add_node("write_script_based_on_story", write_script_based_on_story)
-agent_builder.add_node("design_storyboard", design_storyboard)
-agent_builder.add_node("design_shot", design_shot)
-agent_builder.add_node("construct_camera_tree", construct_camera_tree)
-agent_builder.add_node("select_reference_images_and_generate_prompt", select_reference_images_and_generate_prompt)
-agent_builder.add_node("generate_single_video", generate_single_video)
-agent_builder.add_node("merge_final_video", merge_final_video)
-agent_builder.add_node("approval_node", approval_node)
-
-# Add edges to connect nodes
-agent_builder.add_edge(START, "develop_story")
-agent_builder.add_conditional_edges("develop_story", approval_node, {True: "extract_characters", False: "develop_story"})
-# agent_builder.add_edge("develop_story", "extract_characters")
-agent_builder.add_edge("extract_characters", "generate_character_images")
-agent_builder.add_edge("generate_character_images", "write_script_based_on_story")
-agent_builder.add_edge("write_script_based_on_story", "design_storyboard")
-agent_builder.add_edge("design_storyboard", "design_shot")
-agent_builder.add_edge("design_shot", "construct_camera_tree")
-agent_builder.add_edge("construct_camera_tree", "select_reference_images_and_generate_prompt")
-agent_builder.add_edge("select_reference_images_and_generate_prompt", "generate_single_video")
-agent_builder.add_edge("generate_single_video", "merge_final_video")
-agent_builder.add_edge("merge_final_video", END)
-
-# Compile the agent
-checkpointer = MemorySaver()
-agent = agent_builder.compile(checkpointer=checkpointer)
+    return not state["need_regen"].get("develop_story", [False, ""])[0]
+
+
+def build_agent(checkpointer=None):
+    """Build and compile the workflow; the approval step interrupts it until resumed."""
+    agent_builder = StateGraph(VideoGenState)
+
+    # Add nodes
+    agent_builder.add_node("develop_story", traced_node("develop_story", develop_story))
+    agent_builder.add_node("extract_characters", traced_node("extract_characters", extract_characters))
+    agent_builder.add_node("generate_character_images", traced_node("generate_character_images", generate_character_images))
+    agent_builder.add_node("write_script_based_on_story", traced_node("write_script_based_on_story", write_script_based_on_story))
+    # Per-scene stages (storyboard → shots → camera tree → frames → videos) run as one branch per scene
+    agent_builder.add_node("fan_out_scenes", traced_node("fan_out_scenes", fan_out_scenes))
+    agent_builder.add_node("process_scene", traced_node("process_scene", process_scene))
+    agent_builder.add_node("merge_final_video", traced_node("merge_final_video", merge_final_video))
+    agent_builder.add_node("approval_node", traced_node("approval_node", approval_node))
+
+    # Add edges to connect nodes
+    agent_builder.add_edge(START, "develop_story")
+    agent_builder.add_edge("develop_story", "approval_node")
+    agent_builder.add_conditional_edges("approval_node", route_approval, {True: "extract_characters", False: "develop_story"})
+    # agent_builder.add_edge("develop_story", "extract_characters")
+    agent_builder.add_edge("extract_characters", "generate_character_images")
+    agent_builder.add_edge("generate_character_images", "write_script_based_on_story")
+    agent_builder.add_edge("write_script_based_on_story", "fan_out_scenes")
+    agent_builder.add_conditional_edges("fan_out_scenes", dispatch_scenes, ["process_scene"])
+    agent_builder.add_edge("process_scene", "merge_final_video")
+    agent_builder.add_edge("merge_final_video", END)
+
+    # Compile the agent
+    return agent_builder.compile(checkpointer=checkpointer if checkpointer is not None else MemorySaver())
+
+
+def initial_state(user_idea, user_requirement, style, cache_dir) -> VideoGenState:
+    return {"user_idea": user_idea, "user_requirement": user_requirement, "style": style, "cache_dir": cache_dir, "need_regen": defaultdict(lambda: [False, ""])}
+
+
+def answer_approvals(agent, config, resumed):
+    """Ask on the command line about every approval the run stops at, until it completes."""
+    # 命令行接收用户输入（处理输入合法性）
+    while "__interrupt__" in resumed.keys():
+        print(resumed["__interrupt__"])
+        user_input = input("Do you want to proceed with this action? (y/n)：").strip().lower()
+        if user_input in ["y", "n"]:
+            is_approved = (user_input == "y")
+            if is_approved:
+                resumed = agent.invoke(Command(resume=(is_approved, "")), config=config)
+            else:
+                user_input = input("Why?：").strip().lower()
+                resumed = agent.invoke(Command(resume=(is_approved, user_input)), config=config)
+        else:
+            print("Invalid Input， y or n !")
+    return resumed
+
+
+def resume(thread_id, checkpointer=None):
+    """Continue the run of ``thread_id`` from its last completed node and return its final state.
+
+    ``checkpointer`` defaults to the SQLite database at CHECKPOINT_DB, where
+    command line runs keep their checkpoints.
+    """
+    agent = build_agent(checkpointer if checkpointer is not None else SQLiteSaver(CHECKPOINT_DB))
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = agent.get_state(config)
+    if not snapshot.values:
+        raise ValueError(f"No checkpoint of thread {thread_id} found.")
+    if not snapshot.next:
+        logging.info(f"🚀 Thread {thread_id} has already completed.")
+        return snapshot.values
+    logging.info(f"🔁 Resuming thread {thread_id} at {', '.join(snapshot.next)}.")
+    return answer_approvals(agent, config, agent.invoke(None, config=config))
+
 
 user_idea = \
     """
@@ -76,24 +119,30 @@ For adults, do not exceed 3 scenes. Each scene should be no more than 5 shots.
 """
 style = "Realistic, warm feel"
 
-cache_dir = "working_dir"
-os.makedirs(cache_dir, exist_ok=True)
-from langchain.messages import HumanMessage
-
-config = {"configurable": {"thread_id": uuid.uuid4().hex}}
-resumed = agent.invoke({"user_idea": user_idea, "user_requirement": user_requirement, "style": style,"cache_dir": cache_dir, "need_regen": defaultdict(lambda: [False, ""])}, config=config,)
-# 命令行接收用户输入（处理输入合法性）
-while "__interrupt__" in resumed.keys():
-    print(resumed["__interrupt__"])
-    user_input = input("Do you want to proceed with this action? (y/n)：").strip().lower()
-    if user_input in ["y", "n"]:
-        is_approved = (user_input == "y")
-        if is_approved:
-            resumed = agent.invoke(Command(resume=(is_approved, "")), config=config)
-        else:
-            user_input = input("Why?：").strip().lower()
-            resumed = agent.invoke(Command(resume=(is_approved, user_input)), config=config)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Turn the idea above into a video.")
+    parser.add_argument("--resume", metavar="THREAD_ID", help="continue an interrupted run from its last checkpoint")
+    args = parser.parse_args()
+    if args.resume and not CHECKPOINT_DB:
+        parser.error("--resume needs the checkpoint database set by CHECKPOINT_DB.")
+    checkpointer = SQLiteSaver(CHECKPOINT_DB) if CHECKPOINT_DB else None
+
+    if args.resume:
+        resumed = resume(args.resume, checkpointer)
     else:
-        print("Invalid Input， y or n !")
-# messages = agent.invoke({"user_idea": [HumanMessage(content=user_idea)], "user_requirement": [HumanMessage(content=user_requirement)], "style": [HumanMessage(content=style)],"cache_dir": cache_dir})
-# print(messages)
\ No newline at end of file
+        agent = build_agent(checkpointer)
+
+        cache_dir = "working_dir"
+        os.makedirs(cache_dir, exist_ok=True)
+        from langchain.messages import HumanMessage
+
+        thread_id = uuid.uuid4().hex
+        if checkpointer is not None:
+            logging.info(f"⚙️ Checkpointing thread {thread_id}; continue it with: python idea2video_agent.py --resume {thread_id}")
+        config = {"configurable": {"thread_id": thread_id}}
+        resumed = answer_approvals(agent, config, agent.invoke(initial_state(user_idea, user_requirement, style, cache_dir), config=config,))
+    finish_run(resumed["cache_dir"])
+    # messages = agent.invoke({"user_idea": [HumanMessage(content=user_idea)], "user_requirement": [HumanMessage(content=user_requirement)], "style": [HumanMessage(content=style)],"cache_dir": cache_dir})
+    # print(messages)
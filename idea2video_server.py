@@ -0,0 +1,303 @@
+"""Long-running idea2video service with an HTTP API on localhost.
+
+Jobs share one compiled graph, one process worth of pooled provider
+clients and caches, and a pool of ``--max-jobs`` workers; each job is a
+graph thread whose id is the job id, checkpointed to SQLite so that a
+failed or interrupted job can be resumed, also after a restart of the
+service. Every job works in its own directory under ``--jobs-dir``.
+
+    python idea2video_server.py --port 8765 --max-jobs 4
+
+    POST /jobs                                {"user_idea", "user_requirement", "style", "auto_approve"}
+    GET  /jobs                                all jobs
+    GET  /jobs/<id>                           status, pending approval and error of a job
+    POST /jobs/<id>/approval                  {"approved": true} or {"approved": false, "reason": "..."}
+    POST /jobs/<id>/resume                    continue a failed or interrupted job from its last checkpoint
+    GET  /jobs/<id>/artifacts                 files written by the job
+    GET  /jobs/<id>/artifacts/<path>          one of those files, e.g. final_video.mp4
+    GET  /rate_limits                         calls and wait time per model, see agents.rate_limit
+"""
+import argparse
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, List, Optional
+from urllib.parse import unquote
+
+from pydantic import BaseModel
+from langgraph.types import Command
+
+from idea2video_agent import build_agent, initial_state
+from agents.checkpoint import SQLiteSaver
+from agents.rate_limit import get_rate_limiter
+from agents.tracing import finish_run
+
+JOB_FILE = "job.json"
+# Bookkeeping files that are not served as artifacts.
+_HIDDEN_SUFFIXES = (".key", ".part", ".tmp")
+
+# Statuses of a job; "interrupted" jobs were running when the service stopped.
+QUEUED, RUNNING, AWAITING_APPROVAL, COMPLETED, FAILED, INTERRUPTED = (
+    "queued", "running", "awaiting_approval", "completed", "failed", "interrupted")
+
+
+class Job(BaseModel):
+    job_id: str
+    status: str = QUEUED
+    user_idea: str
+    user_requirement: str = ""
+    style: str = ""
+    auto_approve: bool = False
+    cache_dir: str
+    created_at: float
+    updated_at: float
+    # Payloads of the approvals the job is waiting for, e.g. the story to review.
+    interrupts: Optional[List[Any]] = None
+    error: Optional[str] = None
+
+
+class JobError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class JobManager:
+    """Run idea2video jobs as concurrent threads of one compiled graph."""
+
+    def __init__(self, jobs_dir, max_jobs=4):
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.agent = build_agent(SQLiteSaver(os.path.join(self.jobs_dir, "checkpoints.sqlite")))
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix="job")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self._load()
+
+    def _load(self):
+        for name in sorted(os.listdir(self.jobs_dir)):
+            path = os.path.join(self.jobs_dir, name, JOB_FILE)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                job = Job.model_validate(json.load(f))
+            if job.status in (QUEUED, RUNNING):
+                job.status = INTERRUPTED
+                self._save(job)
+            self.jobs[job.job_id] = job
+        if self.jobs:
+            logging.info(f"🚀 Loaded {len(self.jobs)} jobs from {self.jobs_dir}.")
+
+    @staticmethod
+    def _save(job: Job):
+        path = os.path.join(job.cache_dir, JOB_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job.model_dump(), f, ensure_ascii=False, indent=4, default=str)
+        os.replace(path + ".tmp", path)
+
+    def _update(self, job: Job, **fields):
+        with self.lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            self._save(job)
+
+    def get(self, job_id) -> Job:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise JobError(HTTPStatus.NOT_FOUND, f"No job {job_id}.")
+        return job
+
+    def list(self) -> List[Job]:
+        with self.lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created_at)
+
+    def submit(self, user_idea, user_requirement="", style="", auto_approve=False) -> Job:
+        if not user_idea:
+            raise JobError(HTTPStatus.BAD_REQUEST, "user_idea is required.")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = Job(job_id=job_id, user_idea=user_idea, user_requirement=user_requirement, style=style,
+                  auto_approve=auto_approve, cache_dir=os.path.join(self.jobs_dir, job_id), created_at=now, updated_at=now)
+        os.makedirs(job.cache_dir, exist_ok=True)
+        with self.lock:
+            self.jobs[job_id] = job
+            self._save(job)
+        self.executor.submit(self._run, job, initial_state(user_idea, user_requirement, style, job.cache_dir))
+        logging.info(f"📥 Accepted job {job_id}.")
+        return job
+
+    def approve(self, job_id, approved, reason="") -> Job:
+        job = self._transition(job_id, (AWAITING_APPROVAL,))
+        self.executor.submit(self._run, job, Command(resume=(bool(approved), reason or "")))
+        return job
+
+    def resume(self, job_id) -> Job:
+        job = self._transition(job_id, (FAILED, INTERRUPTED))
+        # None continues the thread from its last checkpoint.
+        self.executor.submit(self._run, job, None)
+        return job
+
+    def _transition(self, job_id, allowed) -> Job:
+        job = self.get(job_id)
+        with self.lock:
+            if job.status not in allowed:
+                raise JobError(HTTPStatus.CONFLICT, f"Job {job_id} is {job.status}, expected one of {', '.join(allowed)}.")
+            job.status = QUEUED
+            job.interrupts = None
+            job.updated_at = time.time()
+            self._save(job)
+        return job
+
+    def _run(self, job: Job, payload):
+        config = {"configurable": {"thread_id": job.job_id}}
+        self._update(job, status=RUNNING, interrupts=None, error=None)
+        logging.info(f"🎬 Running job {job.job_id}...")
+        try:
+            result = self.agent.invoke(payload, config=config)
+            while "__interrupt__" in result and job.auto_approve:
+                result = self.agent.invoke(Command(resume=(True, "")), config=config)
+        except Exception as e:
+            logging.exception(f"❌ Job {job.job_id} failed.")
+            self._update(job, status=FAILED, error=f"{type(e).__name__}: {e}")
+            finish_run(job.cache_dir)
+            return
+        if "__interrupt__" in result:
+            self._update(job, status=AWAITING_APPROVAL, interrupts=[item.value for item in result["__interrupt__"]])
+            logging.info(f"⏸️ Job {job.job_id} is waiting for approval.")
+            return
+        self._update(job, status=COMPLETED)
+        finish_run(job.cache_dir)
+        logging.info(f"☑️ Completed job {job.job_id}.")
+
+    def artifacts(self, job_id) -> List[dict]:
+        job = self.get(job_id)
+        artifacts = []
+        for dirpath, _, filenames in os.walk(job.cache_dir):
+            for filename in sorted(filenames):
+                if filename == JOB_FILE or filename.endswith(_HIDDEN_SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, filename)
+                artifacts.append({"path": os.path.relpath(path, job.cache_dir), "bytes": os.path.getsize(path)})
+        return artifacts
+
+    def artifact_path(self, job_id, relative_path) -> str:
+        job = self.get(job_id)
+        root = os.path.realpath(job.cache_dir)
+        path = os.path.realpath(os.path.join(root, relative_path))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            raise JobError(HTTPStatus.NOT_FOUND, f"No artifact {relative_path} in job {job_id}.")
+        return path
+
+    def shutdown(self):
+        # Running jobs are picked up as interrupted on the next start.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    manager: JobManager = None
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise JobError(HTTPStatus.BAD_REQUEST, "The request body is not valid JSON.")
+        if not isinstance(body, dict):
+            raise JobError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object.")
+        return body
+
+    def _route(self):
+        return [unquote(part) for part in self.path.split("?", 1)[0].strip("/").split("/") if part]
+
+    def _handle(self, method):
+        try:
+            parts = self._route()
+            if method == "GET" and parts == ["rate_limits"]:
+                return self._send_json(HTTPStatus.OK, get_rate_limiter().stats())
+            if not parts or parts[0] != "jobs":
+                raise JobError(HTTPStatus.NOT_FOUND, f"No route {self.path}.")
+            manager = self.manager
+            if method == "GET" and len(parts) == 1:
+                return self._send_json(HTTPStatus.OK, [job.model_dump() for job in manager.list()])
+            if method == "POST" and len(parts) == 1:
+                body = self._read_json()
+                job = manager.submit(body.get("user_idea", ""), body.get("user_requirement", ""), body.get("style", ""),
+                                     bool(body.get("auto_approve", False)))
+                return self._send_json(HTTPStatus.ACCEPTED, job.model_dump())
+            if method == "GET" and len(parts) == 2:
+                return self._send_json(HTTPStatus.OK, manager.get(parts[1]).model_dump())
+            if method == "POST" and len(parts) == 3 and parts[2] == "approval":
+                body = self._read_json()
+                if "approved" not in body:
+                    raise JobError(HTTPStatus.BAD_REQUEST, "approved is required.")
+                return self._send_json(HTTPStatus.ACCEPTED, manager.approve(parts[1], body["approved"], body.get("reason", "")).model_dump())
+            if method == "POST" and len(parts) == 3 and parts[2] == "resume":
+                return self._send_json(HTTPStatus.ACCEPTED, manager.resume(parts[1]).model_dump())
+            if method == "GET" and len(parts) == 3 and parts[2] == "artifacts":
+                return self._send_json(HTTPStatus.OK, manager.artifacts(parts[1]))
+            if method == "GET" and len(parts) > 3 and parts[2] == "artifacts":
+                return self._send_file(manager.artifact_path(parts[1], os.path.join(*parts[3:])))
+            raise JobError(HTTPStatus.NOT_FOUND, f"No route {method} {self.path}.")
+        except JobError as e:
+            self._send_json(e.status, {"error": str(e)})
+
+    def _send_file(self, path):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def serve(host="127.0.0.1", port=8765, jobs_dir="jobs", max_jobs=4):
+    manager = JobManager(jobs_dir, max_jobs)
+    handler = type("JobHandler", (Handler,), {"manager": manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    logging.info(f"⚙️ Serving idea2video jobs on http://{host}:{server.server_port} with {max_jobs} workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--jobs-dir", default="jobs", help="one working directory per job, plus the checkpoint database")
+    parser.add_argument("--max-jobs", type=int, default=4, help="jobs run concurrently")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.jobs_dir, args.max_jobs)